@@ -0,0 +1,190 @@
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from memory import keywords
+
+
+# follow ups lean on the history, the same words can mean something else
+# next time so they are never answered from the cache
+REFERS_BACK = re.compile(r'\b(it|its|they|them|their|those|these|that one|this one|same|again|above|previous|last one)\b')
+
+# page ids change every run, they shouldnt change the fingerprint
+PAGE_ID = re.compile(r'page_id p\d+')
+
+
+def normalize(question):
+    """the words that matter, in a fixed order
+
+    "which buckets are public?" and "what buckets are public" both become
+    "bucket public"
+    """
+    words = keywords(question)
+    words.discard('refresh')
+    stems = set()
+    for word in words:
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        stems.add(word)
+    return " ".join(sorted(stems))
+
+
+def fingerprint(results):
+    """hash of the tool outputs an answer was written from"""
+    digest = hashlib.sha256()
+    for name, args, result in results:
+        digest.update(name.encode())
+        digest.update(repr(sorted(args.items())).encode())
+        digest.update(PAGE_ID.sub('page_id', result).encode())
+    return digest.hexdigest()
+
+
+def cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    if norm == 0:
+        return 0.0
+    return dot / norm
+
+
+def make_embedder(model_name):
+    """embed(text) -> vector from a local sentence-transformers model
+
+    needs `pip install sentence-transformers`, nothing leaves the machine
+    """
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        raise RuntimeError("answer cache embeddings need sentence-transformers, do: pip install sentence-transformers")
+
+    model = SentenceTransformer(model_name)
+
+    def embed(text):
+        return [float(x) for x in model.encode(text)]
+
+    return embed
+
+
+class CachedAnswer:
+    def __init__(self, key, calls, fingerprint, answer, vector=None):
+        self.key = key
+        self.calls = calls            # [(tool name, args)] to replay
+        self.fingerprint = fingerprint
+        self.answer = answer
+        self.vector = vector
+        self.created_at = time.time()
+
+
+class AnswerCache:
+    """answers to questions asked before, checked against fresh tool output
+
+    an answer is found by its normalized question, or with an embedder by
+    the closest earlier question above min_similarity. before it is used
+    the tool calls behind it run again, those come from the resource cache
+    so they cost no aws calls while the data is cached. if the results
+    changed (the aws data was refreshed and is different now) the answer is
+    dropped and the question goes to claude as usual.
+    """
+
+    def __init__(self, ttl=600, max_entries=500, embedder=None, min_similarity=0.92):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.embedder = embedder
+        self.min_similarity = min_similarity
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cacheable(self, question):
+        return REFERS_BACK.search(question.lower()) is None and normalize(question) != ""
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for key in [k for k, e in self._entries.items() if e.created_at < cutoff]:
+            del self._entries[key]
+
+    def find(self, question):
+        """the cached answer for this question or a close one, None if there isnt one"""
+        if not self.cacheable(question):
+            return None
+
+        key = normalize(question)
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            candidates = list(self._entries.values())
+
+        if entry is None and self.embedder is not None and len(candidates) > 0:
+            vector = self.embedder(question)
+            best = max(candidates, key=lambda e: cosine(vector, e.vector or []))
+            if cosine(vector, best.vector or []) >= self.min_similarity:
+                entry = best
+
+        if entry is None:
+            self.misses = self.misses + 1
+        return entry
+
+    def store(self, question, tool_outputs, answer):
+        if not self.cacheable(question):
+            return
+        # a paged result cant be replayed, its pages are gone next time
+        for name, args, result in tool_outputs:
+            if name == 'show_more' or result.startswith('tool error'):
+                return
+
+        vector = None
+        if self.embedder is not None:
+            vector = self.embedder(question)
+
+        key = normalize(question)
+        calls = [(name, dict(args)) for name, args, result in tool_outputs]
+        entry = CachedAnswer(key, calls, fingerprint(tool_outputs), answer, vector)
+
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def confirm(self, entry, tool_outputs):
+        """true when the replayed tool outputs match what the answer was built on"""
+        if fingerprint(tool_outputs) == entry.fingerprint:
+            self.hits = self.hits + 1
+            return True
+
+        self.misses = self.misses + 1
+        with self._lock:
+            if self._entries.get(entry.key) is entry:
+                del self._entries[entry.key]
+        return False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            entries = len(self._entries)
+        return {'entries': entries, 'hits': self.hits, 'misses': self.misses}
+
+
+def make_answer_cache():
+    """answer cache from the env, None when CHATBOT_ANSWER_CACHE=0"""
+    if os.getenv('CHATBOT_ANSWER_CACHE', '1') == '0':
+        return None
+
+    embedder = None
+    model_name = os.getenv('CHATBOT_ANSWER_EMBEDDINGS')
+    if model_name:
+        embedder = make_embedder(model_name)
+
+    return AnswerCache(
+        ttl=int(os.getenv('CHATBOT_ANSWER_TTL', '600')),
+        embedder=embedder,
+        min_similarity=float(os.getenv('CHATBOT_ANSWER_SIMILARITY', '0.92'))
+    )
@@ -0,0 +1,257 @@
+"""offline benchmark of the tools and ask_claude
+
+builds fake accounts of a few sizes in moto, runs the same questions
+against each with the stub llm and reports aws api calls, wall time, peak
+memory and prompt sizes. nothing talks to aws or anthropic.
+
+    python benchmark.py --scales small,medium
+    python benchmark.py --scales small --save baseline.json
+    python benchmark.py --scales small --compare baseline.json
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+import tracemalloc
+
+from memory import estimate_tokens
+
+
+SCALES = {
+    'small': {'buckets': 20, 'objects': 20, 'instances': 50, 'groups': 50, 'users': 20},
+    'medium': {'buckets': 200, 'objects': 50, 'instances': 500, 'groups': 300, 'users': 200},
+    'large': {'buckets': 2000, 'objects': 100, 'instances': 2000, 'groups': 3000, 'users': 2000},
+}
+
+# a metric has to get this much worse than the baseline to count
+REGRESSION_RATIO = 1.25
+
+# and by at least this much, so tiny numbers dont flap
+MIN_DIFFERENCE = {'cold_seconds': 0.05, 'warm_seconds': 0.05, 'cold_calls': 1, 'warm_calls': 1, 'peak_mb': 1.0, 'prompt_tokens': 50, 'llm_calls': 0}
+
+
+class CallCounter:
+    """counts aws api calls through a botocore before-call hook"""
+
+    def __init__(self):
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event_name=None, **kwargs):
+        # before-call.<service>.<Operation>
+        operation = ".".join(event_name.split('.')[1:3])
+        with self._lock:
+            self.counts[operation] = self.counts.get(operation, 0) + 1
+
+    def take(self):
+        with self._lock:
+            counts = self.counts
+            self.counts = {}
+        return counts
+
+
+def reset_caches():
+    """back to a cold start, as if the bot had just been launched"""
+    from tools.aws_clients import get_clients
+    from tools.cache import get_cache
+    from tools.ec2_index import clear_indexes
+    from tools.sg_index import clear_indexes as clear_group_indexes
+
+    get_cache().clear()
+    clear_indexes()
+    clear_group_indexes()
+    # new clients and sessions, the call counter stays registered on them
+    get_clients().clear()
+
+
+def scenarios(llm, tools):
+    """(name, fn) pairs, each fn returns the text that would go back to claude"""
+    from chatbot import ask_claude
+    from tools.ec2_tool import GetEC2InstanceSizeTool
+    from tools.iam_tool import GetIAMUserPermissionsTool
+    from tools.results import fit
+    from tools.s3_tool import S3Tool
+    from tools.security_group_tool import GetSecurityGroupInfoTool
+    from tool_runner import DEFAULT_OUTPUT_TOKENS
+
+    import boto3
+    ec2 = boto3.client('ec2')
+    first = ec2.describe_instances(MaxResults=5)['Reservations'][0]['Instances'][0]
+    ip = first['PrivateIpAddress']
+
+    s3_tool = S3Tool()
+    ec2_tool = GetEC2InstanceSizeTool()
+    iam_tool = GetIAMUserPermissionsTool()
+    sg_tool = GetSecurityGroupInfoTool()
+
+    def tool(fn, **args):
+        return lambda: fit(fn(**args), DEFAULT_OUTPUT_TOKENS)
+
+    def ask(question):
+        return lambda: ask_claude(question, tools, llm)
+
+    return [
+        ('s3 all buckets', tool(s3_tool._run)),
+        ('s3 one bucket', tool(s3_tool._run, bucket_name='sample-bucket-1')),
+        ('ec2 by ip', tool(ec2_tool._run, query=ip)),
+        ('ec2 by tag', tool(ec2_tool._run, query='env=sample')),
+        ('ec2 by cidr', tool(ec2_tool._run, query='10.0.0.0/8')),
+        ('sg all groups', tool(sg_tool._run)),
+        ('sg open ssh', tool(sg_tool._run, source='0.0.0.0/0', port=22)),
+        ('iam user', tool(iam_tool._run, username='sample-user-0')),
+        ('iam action check', tool(iam_tool._run, username='sample-user-0', action='s3:GetObject')),
+        ('ask public buckets', ask("which buckets are public")),
+        ('ask open ssh', ask("which security groups allow 0.0.0.0/0 on 22")),
+        ('ask planned', ask("why are my buckets public and how big are they")),
+    ]
+
+
+def measure(fn, counter, llm, repeat=3):
+    """runs fn cold then warm repeat times, then cold once under tracemalloc
+
+    times are the best of the repeats, moto and the machine add enough
+    noise that a single run says little. counts come from the first run.
+    """
+    cold_times = []
+    warm_times = []
+
+    for attempt in range(repeat):
+        reset_caches()
+        counter.take()
+        llm.prompt_sizes.clear()
+        start = time.perf_counter()
+        output = fn()
+        cold_times.append(time.perf_counter() - start)
+        cold_calls = counter.take()
+
+        if attempt == 0:
+            first_output = output
+            first_cold_calls = cold_calls
+            prompt_chars = sum(llm.prompt_sizes)
+            llm_calls = len(llm.prompt_sizes)
+
+        start = time.perf_counter()
+        fn()
+        warm_times.append(time.perf_counter() - start)
+        warm_calls = counter.take()
+        if attempt == 0:
+            first_warm_calls = warm_calls
+
+    # tracemalloc slows everything down, so memory gets its own run
+    reset_caches()
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    counter.take()
+
+    return {
+        'cold_seconds': round(min(cold_times), 4),
+        'warm_seconds': round(min(warm_times), 4),
+        'cold_calls': sum(first_cold_calls.values()),
+        'warm_calls': sum(first_warm_calls.values()),
+        'calls_by_api': first_cold_calls,
+        'peak_mb': round(peak / 1024 / 1024, 2),
+        'output_tokens': estimate_tokens(str(first_output)),
+        'llm_calls': llm_calls,
+        'prompt_tokens': prompt_chars // 4
+    }
+
+
+def run_scale(scale, llm_latency, repeat):
+    from mock_account import start_mock_account
+    from server import make_tools
+    from stub_llm import StubChatModel
+    from tools.aws_clients import get_clients
+
+    print(f"building the {scale} account {SCALES[scale]}...", file=sys.stderr)
+    start = time.perf_counter()
+    mock = start_mock_account(**SCALES[scale])
+    print(f"built in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    counter = CallCounter()
+    clients = get_clients()
+    # clients from an earlier scale belong to a stopped mock
+    clients.clear()
+    clients.register('before-call', counter)
+
+    llm = StubChatModel(latency=llm_latency)
+    tools = make_tools()
+
+    results = {}
+    try:
+        for name, fn in scenarios(llm, tools):
+            results[name] = measure(fn, counter, llm, repeat)
+            print(f"  {name}: {results[name]['cold_seconds']:.2f}s cold", file=sys.stderr)
+    finally:
+        clients.unregister('before-call', counter)
+        mock.stop()
+
+    return results
+
+
+def print_table(scale, results):
+    print(f"\n{scale}")
+    print(f"{'scenario':<22} {'cold s':>8} {'warm s':>8} {'calls':>11} {'peak mb':>8} {'out tok':>8} {'llm':>4} {'prompt tok':>10}")
+    for name, r in results.items():
+        calls = f"{r['cold_calls']}/{r['warm_calls']}"
+        print(f"{name:<22} {r['cold_seconds']:>8.3f} {r['warm_seconds']:>8.3f} {calls:>11} {r['peak_mb']:>8.2f} {r['output_tokens']:>8} {r['llm_calls']:>4} {r['prompt_tokens']:>10}")
+
+
+def compare(report, baseline):
+    """lines for every metric that got worse than the baseline"""
+    regressions = []
+    for scale, results in report.items():
+        for name, metrics in results.items():
+            before = baseline.get(scale, {}).get(name)
+            if before is None:
+                continue
+            for metric, floor in MIN_DIFFERENCE.items():
+                old = before.get(metric)
+                new = metrics.get(metric)
+                if old is None or new is None:
+                    continue
+                if new - old > floor and new > old * REGRESSION_RATIO:
+                    regressions.append(f"{scale} / {name}: {metric} {old} -> {new}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="offline benchmark against moto with the stub llm")
+    parser.add_argument('--scales', default='small', help="comma separated: " + ", ".join(SCALES))
+    parser.add_argument('--llm-latency', type=float, default=0.0, help="seconds each stub llm call takes")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per scenario, the best time counts")
+    parser.add_argument('--save', help="write the results here as the new baseline")
+    parser.add_argument('--compare', help="baseline file to compare against, exits 1 on regressions")
+    args = parser.parse_args()
+
+    scales = [s.strip() for s in args.scales.split(',') if s.strip()]
+    for scale in scales:
+        if scale not in SCALES:
+            parser.error(f"unknown scale {scale}, pick from {', '.join(SCALES)}")
+
+    report = {}
+    for scale in scales:
+        report[scale] = run_scale(scale, args.llm_latency, args.repeat)
+        print_table(scale, report[scale])
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"\nsaved baseline to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline)
+        if regressions:
+            print(f"\n{len(regressions)} regressions against {args.compare}:")
+            for line in regressions:
+                print(f"- {line}")
+            sys.exit(1)
+        print(f"\nno regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,98 +1,317 @@
+import asyncio
+import contextlib
 import os
+import re
+import time
 from langchain_anthropic import ChatAnthropic
+from langchain_core.messages import AIMessage, ToolMessage
 
 
-from tools.s3_tool import S3Tool
+from answer_cache import make_answer_cache
+from memory import ConversationMemory, make_summarizer
+from prompts import cache_usage, question_message, system_message
+from router import route
+from tool_runner import ToolExecutor
+from tools.cache import get_cache
+from tools.s3_tool import make_s3_tool
 from tools.ec2_tool import GetEC2InstanceSizeTool
 from tools.iam_tool import GetIAMUserPermissionsTool
 from tools.security_group_tool import GetSecurityGroupInfoTool
+from tools.more_tool import ShowMoreTool
+from tools.snapshot import take_snapshot
+from tools.tracing import get_tracer
+from tools.warmup import Warmup
 
 
-# function to ask claude
-def ask_claude(question, tools, history=[]):
-    """asks claude and lets it use tools"""
+class LLMTimings:
+    """wall time of each llm call, the first call also pays for the connection
     
-
-    llm = ChatAnthropic(
-        model="claude-sonnet-4-20250514",
-        temperature=0
-    )
+    also adds up prompt cache reads and writes for the turn, replies that
+    didnt report them (streamed ones) are counted apart instead of as zeros.
+    one object lasts the whole session, start_turn() clears the per
+    question part at the start of every ask
+    """
     
-
-    tool_descriptions = []
-    for tool in tools:
-        tool_descriptions.append(f"- {tool.name}: {tool.description}")
+    def __init__(self, setup_seconds=0.0):
+        self.setup_seconds = setup_seconds
+        self.calls = 0
+        self.start_turn()
+    
+    def start_turn(self):
+        self.turn = []
+        self.cache_read = 0
+        self.cache_write = 0
+        self.uncached = 0
+        self.cache_measured = 0
+        self.cache_unknown = 0
+        self.routed = 0
+        self.cached_answer = False
+    
+    def record_usage(self, response):
+        read, written, uncached = cache_usage(response)
+        self.uncached = self.uncached + uncached
+        if read is None:
+            self.cache_unknown = self.cache_unknown + 1
+            return
+        self.cache_measured = self.cache_measured + 1
+        self.cache_read = self.cache_read + read
+        self.cache_write = self.cache_write + written
+    
+    async def timed_invoke(self, llm, label, prompt):
+        cold = self.calls == 0
+        start = time.perf_counter()
+        response = await llm.ainvoke(prompt)
+        self.turn.append((label, time.perf_counter() - start, cold))
+        self.calls = self.calls + 1
+        return response
+    
+    async def timed_stream(self, llm, label, prompt):
+        """yields message chunks from llm.astream and records time to first token"""
+        cold = self.calls == 0
+        start = time.perf_counter()
+        first_token = None
+        try:
+            async for chunk in llm.astream(prompt):
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                yield chunk
+        finally:
+            self.turn.append((label, time.perf_counter() - start, cold, first_token))
+            self.calls = self.calls + 1
     
-    tools_text = "\n".join(tool_descriptions)
+    def report(self):
+        parts = []
+        for label, seconds, cold, *rest in self.turn:
+            text = f"{label} {seconds:.2f}s"
+            if rest and rest[0] is not None:
+                text = text + f" (first token {rest[0]:.2f}s)"
+            if cold:
+                text = text + " (cold, includes connection setup)"
+            parts.append(text)
+        report = "llm: " + ", ".join(parts) + f" | client setup {self.setup_seconds * 1000:.0f}ms once"
+        if self.cache_measured == 0 and self.cache_unknown > 0:
+            report = report + f"\nprompt cache: not reported for streamed replies, set CHATBOT_STREAM=0 to see it ({self.uncached} uncached input)"
+        else:
+            report = report + f"\nprompt cache: {self.cache_read} tokens read, {self.cache_write} written, {self.uncached} uncached input"
+            if self.cache_unknown > 0:
+                report = report + f" ({self.cache_unknown} streamed replies not counted)"
+        if self.routed:
+            report = report + "\ntools picked locally, planning call skipped"
+        if self.cached_answer:
+            report = report + "\nanswered from the answer cache, no llm calls"
+        return report
+
+
+def make_llm():
+    """builds the claude client once at startup so its connection pool is reused"""
     
+    return ChatAnthropic(
+        model=os.getenv('CLAUDE_MODEL', 'claude-sonnet-4-20250514'),
+        temperature=0,
+        timeout=float(os.getenv('CLAUDE_TIMEOUT', '60')),
+        max_retries=int(os.getenv('CLAUDE_MAX_RETRIES', '2'))
+    )
 
-    prompt = f"""you are an ai that answers aws questions. you can use tools.
 
-tools:
-{tools_text}
+def message_text(message):
+    """text part of a message, content is a list of blocks when tools are used"""
+    content = message.content
+    if isinstance(content, str):
+        return content
+    
+    parts = []
+    for block in content:
+        if isinstance(block, str):
+            parts.append(block)
+        elif block.get('type') == 'text':
+            parts.append(block.get('text', ''))
+    return "".join(parts)
+
 
-to use a tool say:
-TOOL: tool_name
-INPUT: the input
+async def stream_step(llm, messages, timings, label, on_token, executor):
+    """streams one model turn, text goes to on_token as it arrives
+    
+    tool calls are handed to the executor as soon as each one is complete
+    so they run while claude is still writing the next one
+    """
+    response = None
+    async for chunk in timings.timed_stream(llm, label, messages):
+        text = message_text(chunk)
+        if text:
+            on_token(text)
+        if response is None:
+            response = chunk
+        else:
+            response = response + chunk
+        if chunk.tool_call_chunks:
+            executor.start_finished_chunks(response.tool_call_chunks)
+    return response
 
-for s3_tool leave INPUT blank for all buckets or put bucket name for specific bucket.
 
-history:
-{history}
+def token_usage(response):
+    """token counts of one reply, for its trace span"""
+    read, written, uncached = cache_usage(response)
+    metadata = getattr(response, 'usage_metadata', None) or {}
+    output = metadata.get('output_tokens') or (response.response_metadata.get('usage') or {}).get('output_tokens') or 0
+    usage = {
+        'input_tokens': uncached,
+        'output_tokens': output
+    }
+    # left out rather than recorded as zero when the reply didnt say
+    if read is not None:
+        usage['cache_read_tokens'] = read
+        usage['cache_write_tokens'] = written
+    return usage
 
-question: {question}
 
-think step by step."""
+async def ask_claude_async(question, tools, llm, memory=None, timings=None, on_token=None, max_steps=None, tool_timeouts=None, limiter=None, answers=None):
+    """asks claude and lets it use tools
+    
+    claude gets the tools natively and can call several per turn, those run
+    at the same time and all results go back in one follow up. the loop
+    keeps going until it answers or max_steps runs out. with on_token set
+    the text is streamed through it as it arrives. the turn and its tool
+    outputs are saved to memory when one is given. a limiter (any async
+    context manager) is held around each llm call, the server uses it to
+    cap how many calls run at once. with an answer cache a question asked
+    before is answered from it when the tool results are still the same
+    """
     
-    # call claude
-    response = llm.invoke(prompt)
-    answer = response.content
+    if timings is None:
+        timings = LLMTimings()
+    # the repl keeps one timings for the session, whether or not it prints them
+    timings.start_turn()
     
+    # the whole question is one trace, llm calls, tools and aws calls nest under it
+    with get_tracer().span('ask', 'ask_claude', question=question[:200]) as span:
+        calls = timings.calls
+        answer = await _ask_claude_async(question, tools, llm, memory, timings, on_token, max_steps, tool_timeouts, limiter, answers)
+        span.set(llm_calls=timings.calls - calls, routed=timings.routed > 0, cached_answer=timings.cached_answer)
+        return answer
 
-    if "TOOL:" in answer and "INPUT:" in answer:
-        lines = answer.split('\n')
+
+async def _ask_claude_async(question, tools, llm, memory, timings, on_token, max_steps, tool_timeouts, limiter, answers):
+    if max_steps is None:
+        max_steps = int(os.getenv('CHATBOT_MAX_STEPS', '5'))
+    
+    llm_with_tools = llm.bind_tools(tools)
+    
+    # "refresh" in the question skips cached aws data
+    refresh = re.search(r'\brefresh\b', question.lower()) is not None
+    
+    # asked before and the data behind the answer hasnt changed
+    if answers is not None and not refresh:
+        entry = answers.find(question)
+        if entry is not None:
+            executor = ToolExecutor(tools, False, tool_timeouts)
+            for name, args in entry.calls:
+                executor.start({'name': name, 'args': args, 'id': f"replay_{len(executor.calls)}"})
+            replayed = [(call['name'], call['args'], result) for call, result in await executor.results()]
+            if answers.confirm(entry, replayed):
+                timings.cached_answer = True
+                if on_token:
+                    on_token(entry.answer)
+                if memory is not None:
+                    await asyncio.to_thread(memory.add, question, entry.answer, replayed)
+                return entry.answer
+    
+    history = "(none)"
+    if memory is not None:
+        history = memory.render(question)
+    
+    # stable cached preamble first, then the part that changes every turn
+    messages = [
+        system_message(tools),
+        question_message(question, history)
+    ]
+    
+    answer = ""
+    tool_outputs = []
+    first_step = 0
+    
+    # questions the router is sure about skip the planning call, the tools
+    # run straight away and claude only writes the answer from the results
+    if os.getenv('CHATBOT_ROUTER', '1') != '0' and max_steps > 1:
+        plan = route(question, tools)
+        if plan.confidence >= float(os.getenv('CHATBOT_ROUTER_THRESHOLD', '0.8')):
+            executor = ToolExecutor(tools, refresh, tool_timeouts)
+            for call in plan.calls:
+                executor.start(call)
+            messages.append(AIMessage(content="", tool_calls=plan.calls))
+            for call, result in await executor.results():
+                tool_outputs.append((call['name'], call.get('args') or {}, result))
+                messages.append(ToolMessage(content=result, tool_call_id=call['id']))
+            timings.routed = timings.routed + 1
+            first_step = 1
+    
+    for step in range(first_step, max_steps):
+        label = f"step {step + 1}"
+        executor = ToolExecutor(tools, refresh, tool_timeouts)
         
-        tool_name = None
-        tool_input = None
+        async with limiter or contextlib.nullcontext():
+            with get_tracer().span('llm', label, stream=on_token is not None) as llm_span:
+                if on_token:
+                    response = await stream_step(llm_with_tools, messages, timings, label, on_token, executor)
+                else:
+                    response = await timings.timed_invoke(llm_with_tools, label, messages)
+                llm_span.set(tool_calls=len(response.tool_calls), **token_usage(response))
         
-        for line in lines:
-            if line.startswith('TOOL:'):
-                tool_name = line.replace('TOOL:', '').strip()
-            if line.startswith('INPUT:'):
-                tool_input = line.replace('INPUT:', '').strip()
+        timings.record_usage(response)
+        messages.append(response)
+        answer = message_text(response)
         
-
-        selected_tool = None
-        for t in tools:
-            if t.name == tool_name:
-                selected_tool = t
-                break
+        if not response.tool_calls:
+            if answers is not None:
+                answers.store(question, tool_outputs, answer)
+            if memory is not None:
+                # summarizing old turns can call the llm, keep it off the loop
+                await asyncio.to_thread(memory.add, question, answer, tool_outputs)
+            return answer
         
-
-        if selected_tool:
-            try:
-                if tool_input and tool_input != '':
-                    result = selected_tool._run(tool_input)
-                else:
-                    result = selected_tool._run()
-                
-                # ask claude again
-                follow_up = f"""tool result:
-{result}
-
-original question: {question}
-
-answer based on tool result."""
-                
-                final = llm.invoke(follow_up)
-                return final.content
-                
-            except Exception as e:
-                return f"tool error: {e}"
+        if on_token:
+            on_token("\n")
+        
+        # anything not started while streaming starts now
+        for call in response.tool_calls:
+            executor.start(call)
+        
+        last_step = step == max_steps - 2
+        for call, result in await executor.results():
+            tool_outputs.append((call['name'], call.get('args') or {}, result))
+            if last_step:
+                result = result + "\n\n(no more tool calls allowed, answer with what you have)"
+            messages.append(ToolMessage(content=result, tool_call_id=call['id']))
     
+    note = f"(stopped after {max_steps} steps without a final answer)"
+    if on_token:
+        on_token(note)
+    answer = (answer + "\n" + note).strip()
+    if memory is not None:
+        await asyncio.to_thread(memory.add, question, answer, tool_outputs)
     return answer
 
 
+_loop = None
+
+
+# function to ask claude
+def ask_claude(question, tools, llm, memory=None, timings=None, on_token=None, max_steps=None, tool_timeouts=None, answers=None):
+    """asks claude and lets it use tools, blocking version of ask_claude_async"""
+    global _loop
+    
+    # one loop for the whole session, the async http client keeps its
+    # connections tied to the loop that opened them
+    if _loop is None:
+        _loop = asyncio.new_event_loop()
+    
+    return _loop.run_until_complete(
+        ask_claude_async(question, tools, llm, memory, timings, on_token, max_steps, tool_timeouts, answers=answers)
+    )
+
+
+def print_token(token):
+    print(token, end="", flush=True)
+
 
 def main():
     
@@ -111,13 +330,27 @@ def main():
     
 
     tools = [
-        S3Tool(),
+        make_s3_tool(),
         GetEC2InstanceSizeTool(),
         GetIAMUserPermissionsTool(),
-        GetSecurityGroupInfoTool()
+        GetSecurityGroupInfoTool(),
+        ShowMoreTool()
     ]
     
     print(f"loaded {len(tools)} tools")
+    
+    # fill the caches while the user is still typing the first question
+    warmup = None
+    warmup_log = []
+    if os.getenv('CHATBOT_WARMUP') == '1':
+        warmup = Warmup(tools, on_progress=warmup_log.append).start()
+    
+    start = time.perf_counter()
+    llm = make_llm()
+    timings = LLMTimings(time.perf_counter() - start)
+    show_timings = os.getenv('CHATBOT_TIMINGS') == '1'
+    stream = os.getenv('CHATBOT_STREAM', '1') != '0'
+    
     print("ready")
     print()
     print("examples:")
@@ -125,21 +358,39 @@ def main():
     print("- which buckets are public")
     print("- whats in bucket my-bucket")
     print("- what size is ec2 at ip 10.0.1.5")
+    print("- which instances are tagged env=prod")
     print("- what permissions does user bob have")
     print("- show me security group sg-12345")
     print("- list all security groups")
+    print("- which security groups allow 0.0.0.0/0 on 22")
+    print("- refresh which buckets are public")
     print()
-    print("type quit to exit")
+    print("answers are cached for a few minutes, say refresh to skip the cache")
+    print("type cache to see cache hits, stats for timings and aws calls, quit to exit")
+    print("type snapshot to save the whole account to an inventory file")
+    if warmup is not None:
+        print("warming up the caches in the background, type warmup to see how far it got")
     print()
     print("=" * 60)
     print()
     
-
-    history = []
+    # repeat questions come back from here when the data is unchanged
+    answers = make_answer_cache()
+    
+    # older turns get summarized so the prompt stays the same size
+    memory = ConversationMemory(
+        max_tokens=int(os.getenv('CHATBOT_HISTORY_TOKENS', '1500')),
+        summarizer=make_summarizer(llm)
+    )
     
     
     while True:
         
+        # progress from the warm-up threads, printed here so it doesnt
+        # land in the middle of the prompt
+        while warmup_log:
+            print(warmup_log.pop(0))
+        
         try:
             question = input("question: ")
         except KeyboardInterrupt:
@@ -152,16 +403,58 @@ def main():
             print("bye")
             break
         
+        if question.lower() == 'warmup':
+            if warmup is None:
+                print("warm-up is off, set CHATBOT_WARMUP=1 to turn it on")
+            else:
+                print(warmup.status())
+            print()
+            continue
+        
         if question == '':
             continue
         
+        if question.lower() == 'cache':
+            stats = get_cache().stats()
+            print(f"cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)")
+            if answers is not None:
+                stats = answers.stats()
+                print(f"answers: {stats['entries']} cached, {stats['hits']} reused, {stats['misses']} misses")
+            print()
+            continue
+        
+        if question.lower() == 'stats':
+            print(get_tracer().summary())
+            print()
+            continue
+        
+        if question.lower() == 'snapshot':
+            path = os.getenv('CHATBOT_INVENTORY_DB') or 'inventory.db'
+            print(f"taking a snapshot of the account into {path}...")
+            start = time.perf_counter()
+            try:
+                inventory = take_snapshot(path, all_regions=os.getenv('CHATBOT_INVENTORY_ALL_REGIONS') == '1', on_progress=print)
+                print(f"done in {time.perf_counter() - start:.1f}s: {inventory.summary()}")
+                if not os.getenv('CHATBOT_INVENTORY_DB'):
+                    print(f"set CHATBOT_INVENTORY_DB={path} to answer from it")
+            except Exception as e:
+                print(f"snapshot failed: {e}")
+            print()
+            continue
+        
         print()
         
         try:
-            answer = ask_claude(question, tools, history)
-            print(answer)
+            if stream:
+                answer = ask_claude(question, tools, llm, memory, timings, on_token=print_token, answers=answers)
+                print()
+            else:
+                answer = ask_claude(question, tools, llm, memory, timings, answers=answers)
+                print(answer)
             
-            history.append(f"Q: {question}\nA: {answer}")
+            if show_timings and (timings.turn or timings.cached_answer):
+                print()
+                print(timings.report())
             
         except Exception as e:
             print(f"error: {e}")
@@ -169,6 +462,9 @@ def main():
         print()
         print("=" * 60)
         print()
+    
+    if warmup is not None:
+        warmup.cancel()
 
 
 if __name__ == "__main__":
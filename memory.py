@@ -0,0 +1,158 @@
+import re
+
+
+STOPWORDS = {
+    'the', 'and', 'for', 'are', 'what', 'which', 'how', 'many', 'does', 'have',
+    'has', 'show', 'me', 'is', 'in', 'of', 'my', 'do', 'i', 'a', 'an', 'to',
+    'whats', 'with', 'that', 'this', 'get', 'tool', 'info', 'all', 'any'
+}
+
+
+def estimate_tokens(text):
+    """rough token count, about 4 characters per token for english"""
+    return len(text) // 4 + 1
+
+
+def keywords(text):
+    words = re.findall(r'[a-z0-9][a-z0-9\-\._/:]*', text.lower())
+    return {w for w in words if len(w) > 1 and w not in STOPWORDS}
+
+
+def truncate(text, max_tokens):
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars] + "\n...(cut)"
+
+
+def make_summarizer(llm):
+    """summarizer that asks the llm to fold old turns into the running summary"""
+
+    def summarize(summary, old_turns):
+        prompt = f"""update this running summary of a chat about an aws account.
+keep resource ids, names, ips and numbers. at most 120 words.
+
+summary so far:
+{summary or '(empty)'}
+
+new turns:
+{old_turns}"""
+        response = llm.invoke(prompt)
+        return str(response.content).strip()
+
+    return summarize
+
+
+class ConversationMemory:
+    """chat history that stays inside a token budget
+
+    the last few turns are kept word for word, older ones are folded into a
+    rolling summary. tool outputs are kept apart from the answers and only
+    go back into the prompt when the new question mentions what they were
+    about.
+    """
+
+    def __init__(self, max_tokens=1500, window=4, summarizer=None, tool_outputs="relevant", tool_output_tokens=400):
+        self.max_tokens = max_tokens
+        self.window = window
+        self.summarizer = summarizer
+        self.tool_outputs = tool_outputs
+        self.tool_output_tokens = tool_output_tokens
+        self.turns = []
+        self.summary = ""
+
+    def add(self, question, answer, tool_outputs=None):
+        """tool_outputs is a list of (tool name, args dict, output text)"""
+        self.turns.append({
+            'question': question,
+            'answer': answer,
+            'tools': tool_outputs or []
+        })
+        self._compact()
+
+    def _turn_text(self, turn):
+        return f"Q: {turn['question']}\nA: {turn['answer']}"
+
+    def _compact(self):
+        old = []
+        while len(self.turns) > self.window:
+            old.append(self.turns.pop(0))
+
+        # the window itself can still be too big with long answers
+        while len(self.turns) > 1 and self._turns_tokens() > self.max_tokens // 2:
+            old.append(self.turns.pop(0))
+
+        if len(old) == 0:
+            return
+
+        old_text = "\n\n".join(self._turn_text(t) for t in old)
+        if self.summarizer:
+            try:
+                self.summary = self.summarizer(self.summary, old_text)
+            except Exception:
+                self.summary = self._fallback_summary(old)
+        else:
+            self.summary = self._fallback_summary(old)
+
+        self.summary = truncate(self.summary, self.max_tokens // 4)
+
+    def _fallback_summary(self, old):
+        # no llm, keep the questions and the first line of each answer
+        lines = [self.summary] if self.summary else []
+        for t in old:
+            first_line = t['answer'].strip().split('\n')[0][:200]
+            lines.append(f"- asked: {t['question']} -> {first_line}")
+        return "\n".join(lines)
+
+    def _turns_tokens(self):
+        return sum(estimate_tokens(self._turn_text(t)) for t in self.turns)
+
+    def _relevant_outputs(self, question):
+        if self.tool_outputs == "never":
+            return []
+
+        words = keywords(question)
+        found = []
+        for turn in reversed(self.turns):
+            for name, args, output in turn['tools']:
+                if self.tool_outputs == "always":
+                    found.append((name, args, output))
+                    continue
+                about = keywords(" ".join(str(v) for v in args.values()))
+                about = about | keywords(name.replace('_', ' '))
+                if words & about:
+                    found.append((name, args, output))
+        return found
+
+    def render(self, question=""):
+        """history text for the prompt, never much over max_tokens"""
+        parts = []
+        used = 0
+
+        if self.summary:
+            parts.append(f"summary of earlier chat:\n{self.summary}")
+            used = used + estimate_tokens(self.summary)
+
+        # newest turns first until the budget runs out, then put back in order
+        recent = []
+        for turn in reversed(self.turns):
+            text = self._turn_text(turn)
+            cost = estimate_tokens(text)
+            if used + cost > self.max_tokens and len(recent) > 0:
+                break
+            recent.insert(0, truncate(text, self.max_tokens - used))
+            used = used + cost
+        if recent:
+            parts.append("recent turns:\n" + "\n\n".join(recent))
+
+        for name, args, output in self._relevant_outputs(question):
+            remaining = self.max_tokens - used
+            if remaining < 50:
+                break
+            text = truncate(output, min(self.tool_output_tokens, remaining))
+            parts.append(f"earlier {name} result for {args}:\n{text}")
+            used = used + estimate_tokens(text)
+
+        if len(parts) == 0:
+            return "(none)"
+        return "\n\n".join(parts)
@@ -0,0 +1,80 @@
+import json
+import os
+
+
+def start_mock_account(buckets=5, instances=10, groups=5, users=3, objects=None, region='us-east-1'):
+    """starts moto and fills it with a small fake account, returns the mock
+
+    everything boto3 does after this goes to moto instead of aws. call
+    .stop() on the result to go back. needs `pip install moto`. objects is
+    how many objects each bucket gets, by default a few in some of them.
+    """
+    try:
+        from moto import mock_aws
+    except ImportError:
+        raise RuntimeError("mock aws needs moto, do: pip install moto")
+
+    import boto3
+
+    # moto still wants credentials to sign with, fake ones are fine
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    os.environ.setdefault('AWS_DEFAULT_REGION', region)
+
+    mock = mock_aws()
+    mock.start()
+
+    s3 = boto3.client('s3', region_name=region)
+    for i in range(buckets):
+        name = f"sample-bucket-{i}"
+        s3.create_bucket(Bucket=name)
+        count = i % 4 if objects is None else objects
+        for j in range(count):
+            s3.put_object(Bucket=name, Key=f"data/file-{j}.txt", Body=b"x" * 1024 * (j + 1))
+    if buckets > 0:
+        s3.put_bucket_policy(Bucket="sample-bucket-0", Policy=json.dumps({
+            'Version': '2012-10-17',
+            'Statement': [{'Effect': 'Allow', 'Principal': '*', 'Action': 's3:GetObject', 'Resource': 'arn:aws:s3:::sample-bucket-0/*'}]
+        }))
+
+    ec2 = boto3.client('ec2', region_name=region)
+    group_ids = []
+    for i in range(groups):
+        group_id = ec2.create_security_group(GroupName=f"sample-group-{i}", Description=f"sample group {i}")['GroupId']
+        permissions = [{'IpProtocol': 'tcp', 'FromPort': 443, 'ToPort': 443, 'IpRanges': [{'CidrIp': '10.0.0.0/8'}]}]
+        if i == 0:
+            permissions.append({'IpProtocol': 'tcp', 'FromPort': 22, 'ToPort': 22, 'IpRanges': [{'CidrIp': '0.0.0.0/0', 'Description': 'ssh'}]})
+        if len(group_ids) > 0:
+            permissions.append({'IpProtocol': 'tcp', 'FromPort': 5432, 'ToPort': 5432, 'UserIdGroupPairs': [{'GroupId': group_ids[0]}]})
+        ec2.authorize_security_group_ingress(GroupId=group_id, IpPermissions=permissions)
+        group_ids.append(group_id)
+
+    if instances > 0:
+        images = ec2.describe_images(Owners=['amazon'])['Images']
+        # run_instances takes at most 1000 at a time
+        for start in range(0, instances, 1000):
+            count = min(1000, instances - start)
+            ec2.run_instances(
+                ImageId=images[0]['ImageId'],
+                MinCount=count,
+                MaxCount=count,
+                InstanceType='t3.micro',
+                TagSpecifications=[{'ResourceType': 'instance', 'Tags': [{'Key': 'env', 'Value': 'sample'}]}]
+            )
+        pages = ec2.get_paginator('describe_instances').paginate()
+        for n, instance in enumerate(i for page in pages for r in page['Reservations'] for i in r['Instances']):
+            ec2.create_tags(Resources=[instance['InstanceId']], Tags=[{'Key': 'Name', 'Value': f"sample-{n}"}])
+
+    iam = boto3.client('iam')
+    read_only = iam.create_policy(PolicyName='sample-read-only', PolicyDocument=json.dumps({
+        'Version': '2012-10-17',
+        'Statement': [{'Effect': 'Allow', 'Action': ['s3:Get*', 's3:List*', 'ec2:Describe*'], 'Resource': '*'}]
+    }))['Policy']['Arn']
+    iam.create_group(GroupName='sample-readers')
+    iam.attach_group_policy(GroupName='sample-readers', PolicyArn=read_only)
+    for i in range(users):
+        username = f"sample-user-{i}"
+        iam.create_user(UserName=username)
+        iam.add_user_to_group(GroupName='sample-readers', UserName=username)
+
+    return mock
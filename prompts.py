@@ -0,0 +1,77 @@
+from langchain_core.messages import HumanMessage, SystemMessage
+
+
+INSTRUCTIONS = """you are an ai that answers aws questions. you can use tools.
+
+call the tools to look things up, you can ask for several tools at once if they dont depend on each other.
+for s3_tool leave bucket_name empty for all buckets or put bucket name for specific bucket.
+when you have what you need answer the question directly."""
+
+
+def tool_catalogue(tools):
+    """one block per tool with its arguments, built from the tools themselves"""
+    lines = []
+    for tool in tools:
+        lines.append(f"- {tool.name}: {tool.description}")
+        schema = tool.args_schema
+        if schema is None:
+            continue
+        for field_name, field in schema.model_fields.items():
+            description = field.description or ""
+            lines.append(f"    {field_name}: {description}")
+    return "\n".join(lines)
+
+
+def system_message(tools):
+    """the part of the prompt that never changes between turns
+
+    it carries a cache breakpoint so anthropic caches the tool definitions
+    and this text, every later turn reads them from the cache instead of
+    paying for them again. keep anything that changes per turn out of here
+    or the cache never hits.
+    """
+    text = f"""{INSTRUCTIONS}
+
+tools:
+{tool_catalogue(tools)}"""
+
+    return SystemMessage(content=[
+        {'type': 'text', 'text': text, 'cache_control': {'type': 'ephemeral'}}
+    ])
+
+
+def question_message(question, history):
+    """the part that changes every turn"""
+    return HumanMessage(content=f"""history:
+{history}
+
+question: {question}""")
+
+
+def cache_usage(response):
+    """(cache read tokens, cache write tokens, uncached input tokens) from a reply
+
+    read and written are None when the reply doesnt say. streamed replies
+    from langchain-anthropic 0.1 only carry input_tokens from message_start,
+    the cache counts are dropped, so that isnt the same as nothing cached.
+    """
+    usage = response.response_metadata.get('usage') or {}
+    if hasattr(usage, 'model_dump'):
+        usage = usage.model_dump()
+
+    read = usage.get('cache_read_input_tokens')
+    written = usage.get('cache_creation_input_tokens')
+    uncached = usage.get('input_tokens') or 0
+
+    # newer langchain puts the same numbers in usage_metadata instead
+    metadata = getattr(response, 'usage_metadata', None) or {}
+    details = metadata.get('input_token_details') or {}
+    if read is None and written is None:
+        read = details.get('cache_read')
+        written = details.get('cache_creation')
+    if not uncached:
+        uncached = metadata.get('input_tokens') or 0
+
+    if read is None and written is None:
+        return None, None, uncached
+    return read or 0, written or 0, uncached
@@ -0,0 +1,149 @@
+import re
+import uuid
+from typing import NamedTuple
+
+
+# real ids are 8 or 17 hex digits, people shorten them in questions
+SG_ID = r'\bsg-[0-9a-f]{3,17}\b'
+INSTANCE_ID = r'\bi-[0-9a-f]{8,17}\b'
+IP_OR_CIDR = r'\b\d{1,3}(?:\.\d{1,3}){3}(?:/\d{1,2})?\b'
+TAG = r'\btagged\s+([\w.:/-]+=[\w.:/*-]+)'
+USERNAME = r'[\w+=,.@-]+'
+# no \b at the end, it cant match after a trailing * like s3:*
+IAM_ACTION = r'\b[a-z0-9-]+:[A-Za-z*]+(?![\w*])'
+BUCKET_NAME = r'([a-z0-9][a-z0-9.-]{1,61}[a-z0-9])'
+
+# questions with these in them usually want more than one lookup or some
+# reasoning on top, claude plans those itself
+VAGUE = re.compile(r'\b(and|or|then|compare|why|how (do|can|should) i|should|explain|which of|unless|except)\b')
+
+
+class Route(NamedTuple):
+    calls: list          # tool calls in the same shape claude makes them
+    confidence: float
+    reason: str
+
+
+NO_ROUTE = Route([], 0.0, "no pattern matched")
+
+
+def call(name, args):
+    return {'name': name, 'args': args, 'id': f"route_{uuid.uuid4().hex[:16]}"}
+
+
+def security_group_routes(text):
+    group_ids = re.findall(SG_ID, text)
+    port = re.search(r'\b(?:on|port)\s+(?:port\s+)?(\d{1,5})\b', text)
+    source = re.search(r'\ballows?\s+(' + IP_OR_CIDR[2:-2] + r'|' + SG_ID[2:-2] + r')', text)
+
+    if source:
+        args = {'source': source.group(1)}
+        if port:
+            args['port'] = int(port.group(1))
+        return [call('get_security_group_info', args)], 0.9, "security groups allowing a source"
+
+    if group_ids:
+        calls = []
+        for group_id in dict.fromkeys(group_ids):
+            args = {'group_id': group_id}
+            if port and re.search(r'\breach\b', text):
+                args['port'] = int(port.group(1))
+            calls.append(call('get_security_group_info', args))
+        return calls, 0.95, "security group id"
+
+    if re.search(r'\b(list|show|all)\b.*\bsecurity groups\b', text):
+        return [call('get_security_group_info', {})], 0.9, "all security groups"
+
+    return None
+
+
+def ec2_routes(text):
+    # ips in a security group question are sources, not instances
+    if re.search(r'security groups?|' + SG_ID, text):
+        return None
+
+    terms = re.findall(IP_OR_CIDR, text) + re.findall(INSTANCE_ID, text) + re.findall(TAG, text)
+    if terms:
+        query = ", ".join(dict.fromkeys(terms))
+        return [call('get_ec2_instance_size', {'query': query})], 0.9, "ip, cidr, instance id or tag"
+
+    name = re.search(r'\binstances?\s+(?:called|named)\s+(\S+)', text)
+    if name:
+        return [call('get_ec2_instance_size', {'query': name.group(1)})], 0.85, "instance name"
+
+    return None
+
+
+def iam_routes(text):
+    can = re.search(r'\bcan\s+(?:user\s+)?(' + USERNAME + r')\s+(?:do\s+)?(' + IAM_ACTION + r')(?:\s+on\s+(arn:\S+))?', text)
+    if can:
+        args = {'username': can.group(1), 'action': can.group(2)}
+        if can.group(3):
+            args['resource'] = can.group(3)
+        return [call('get_iam_user_permissions', args)], 0.9, "iam action check"
+
+    user = re.search(r'\b(?:permissions|policies|access)\b.*\buser\s+(' + USERNAME + r')', text)
+    if user is None:
+        user = re.search(r'\buser\s+(' + USERNAME + r')\s+(?:have|has|get)\b', text)
+    if user:
+        return [call('get_iam_user_permissions', {'username': user.group(1).rstrip('?.')})], 0.9, "iam user"
+
+    return None
+
+
+def s3_routes(text):
+    # "can bob do s3:GetObject" is an iam question
+    if re.search(IAM_ACTION, text):
+        return None
+
+    # "in bucket logs-prod ..." anywhere, or "bucket logs-prod" at the end
+    bucket = re.search(r'\bin bucket\s+' + BUCKET_NAME, text)
+    if bucket is None:
+        bucket = re.search(r'\bbucket\s+(?:called\s+|named\s+)?' + BUCKET_NAME + r'\s*[?.!]?\s*$', text)
+    if bucket and bucket.group(1) not in ('is', 'are', 'public', 'private', 'size', 'sizes'):
+        return [call('s3_tool', {'bucket_name': bucket.group(1)})], 0.85, "bucket name"
+
+    if re.search(r'\b(buckets|s3)\b', text):
+        return [call('s3_tool', {})], 0.85, "all buckets"
+
+    return None
+
+
+ROUTERS = [security_group_routes, ec2_routes, iam_routes, s3_routes]
+
+
+def route(question, tools):
+    """tool calls for a question without asking claude, and how sure it is
+
+    each router looks for its own kind of thing (sg ids, ips, usernames,
+    bucket names). exactly one of them has to match, when several do the
+    question is probably about more than one thing and claude should plan
+    it. words like "and", "why" or "compare" lower the confidence too.
+    """
+    text = question.strip()
+    # "refresh" is handled by the caller, it isnt part of the question
+    text = re.sub(r'\brefresh\b', '', text, flags=re.IGNORECASE).strip()
+    lowered = text.lower()
+
+    names = set(t.name for t in tools)
+    matches = []
+    for router in ROUTERS:
+        found = router(lowered if router is not iam_routes else text)
+        if found is None:
+            continue
+        calls, confidence, reason = found
+        if all(c['name'] in names for c in calls):
+            matches.append((calls, confidence, reason))
+
+    if len(matches) == 0:
+        return NO_ROUTE
+
+    if len(matches) > 1:
+        reasons = ", ".join(m[2] for m in matches)
+        return Route(matches[0][0], 0.4, f"ambiguous: {reasons}")
+
+    calls, confidence, reason = matches[0]
+    if VAGUE.search(lowered):
+        confidence = confidence - 0.3
+        reason = reason + ", question needs planning"
+    return Route(calls, confidence, reason)
@@ -0,0 +1,320 @@
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import WSMsgType, web
+
+from answer_cache import make_answer_cache
+from chatbot import LLMTimings, ask_claude_async, make_llm
+from memory import ConversationMemory, make_summarizer
+from tools.cache import get_cache
+from tools.ec2_tool import GetEC2InstanceSizeTool
+from tools.iam_tool import GetIAMUserPermissionsTool
+from tools.more_tool import ShowMoreTool
+from tools.s3_tool import make_s3_tool
+from tools.security_group_tool import GetSecurityGroupInfoTool
+from tools.tracing import get_tracer
+from tools.warmup import Warmup
+
+
+class Busy(Exception):
+    pass
+
+
+class LLMGate:
+    """caps llm calls running at once and how many can queue behind them
+
+    turns already in progress always get to wait for a slot, new questions
+    are turned away with a 503 once the queue is full so a burst of users
+    slows down instead of piling up timeouts
+    """
+
+    def __init__(self, max_calls=4, max_waiting=32):
+        self.max_calls = max_calls
+        self.max_waiting = max_waiting
+        self.running = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max_calls)
+
+    def admit(self):
+        if self.waiting >= self.max_waiting:
+            raise Busy(f"{self.waiting} questions already waiting for the llm, try again shortly")
+
+    async def __aenter__(self):
+        self.waiting = self.waiting + 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting = self.waiting - 1
+        self.running = self.running + 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self.running = self.running - 1
+        self._semaphore.release()
+
+
+class Session:
+    def __init__(self, session_id, memory):
+        self.id = session_id
+        self.memory = memory
+        self.last_used = time.time()
+        # one question at a time per session so history stays in order
+        self.lock = asyncio.Lock()
+
+
+class SessionStore:
+    """per user conversation memory, idle sessions are dropped"""
+
+    def __init__(self, make_memory, max_sessions=1000, idle_seconds=3600):
+        self.make_memory = make_memory
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self._sessions = OrderedDict()
+
+    def get(self, session_id=None):
+        self._expire()
+        session_id = session_id or uuid.uuid4().hex
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = Session(session_id, self.make_memory())
+            self._sessions[session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        self._sessions.move_to_end(session_id)
+        session.last_used = time.time()
+        return session
+
+    def _expire(self):
+        cutoff = time.time() - self.idle_seconds
+        for session_id in [s.id for s in self._sessions.values() if s.last_used < cutoff and not s.lock.locked()]:
+            del self._sessions[session_id]
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class ChatServer:
+    """many users sharing one bot
+
+    the tools, the aws client pools, the resource cache and the llm client
+    are made once and shared, every session only has its own history
+    """
+
+    def __init__(self, llm, tools, max_requests=64, max_llm_calls=4, max_llm_waiting=32, max_pending=64):
+        self.llm = llm
+        self.tools = tools
+        self.sessions = SessionStore(self._make_memory)
+        self.gate = LLMGate(max_llm_calls, max_llm_waiting)
+        # shared, a question one user asked is free for the next one
+        self.answers = make_answer_cache()
+        self.requests = asyncio.Semaphore(max_requests)
+        self.max_pending = max_pending
+        # waiting for a request slot or for their sessions last question
+        self.pending = 0
+        self.active = 0
+        self.answered = 0
+        self.rejected = 0
+
+    def _make_memory(self):
+        return ConversationMemory(
+            max_tokens=int(os.getenv('CHATBOT_HISTORY_TOKENS', '1500')),
+            summarizer=make_summarizer(self.llm)
+        )
+
+    def admit(self):
+        """turns a new question away when too many are queued anywhere"""
+        self.gate.admit()
+        if self.pending >= self.max_pending:
+            raise Busy(f"{self.pending} questions already queued, try again shortly")
+
+    async def answer(self, session, question, on_token=None):
+        self.admit()
+        self.pending = self.pending + 1
+        queued = True
+        try:
+            async with self.requests, session.lock:
+                self.pending = self.pending - 1
+                queued = False
+                return await self._answer(session, question, on_token)
+        finally:
+            if queued:
+                self.pending = self.pending - 1
+
+    async def _answer(self, session, question, on_token):
+        self.active = self.active + 1
+        try:
+            answer = await ask_claude_async(
+                question,
+                self.tools,
+                self.llm,
+                session.memory,
+                LLMTimings(),
+                on_token=on_token,
+                limiter=self.gate,
+                answers=self.answers
+            )
+            self.answered = self.answered + 1
+            return answer
+        finally:
+            self.active = self.active - 1
+
+    async def handle_ask(self, request):
+        try:
+            body = await request.json()
+        except ValueError:
+            return web.json_response({'error': 'body must be json'}, status=400)
+
+        question = str(body.get('question', '')).strip()
+        if question == '':
+            return web.json_response({'error': 'question is empty'}, status=400)
+
+        session = self.sessions.get(body.get('session'))
+        try:
+            answer = await self.answer(session, question)
+        except Busy as e:
+            self.rejected = self.rejected + 1
+            return web.json_response({'error': str(e)}, status=503, headers={'Retry-After': '5'})
+
+        return web.json_response({'session': session.id, 'answer': answer})
+
+    async def handle_ws(self, request):
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+
+        session = self.sessions.get(request.query.get('session'))
+        await ws.send_json({'type': 'session', 'session': session.id})
+
+        async for message in ws:
+            if message.type != WSMsgType.TEXT:
+                continue
+
+            question = message.data.strip()
+            if question.startswith('{'):
+                try:
+                    question = str(message.json().get('question', '')).strip()
+                except ValueError:
+                    pass
+            if question == '':
+                continue
+
+            # tokens go out in order through a queue so a slow client
+            # only holds up its own session
+            tokens = asyncio.Queue()
+
+            async def send_tokens():
+                while True:
+                    token = await tokens.get()
+                    if token is None:
+                        return
+                    await ws.send_json({'type': 'token', 'text': token})
+
+            sender = asyncio.create_task(send_tokens())
+            try:
+                answer = await self.answer(session, question, on_token=tokens.put_nowait)
+                await tokens.put(None)
+                await sender
+                await ws.send_json({'type': 'answer', 'text': answer})
+            except Busy as e:
+                self.rejected = self.rejected + 1
+                sender.cancel()
+                await ws.send_json({'type': 'busy', 'text': str(e)})
+            except Exception as e:
+                sender.cancel()
+                await ws.send_json({'type': 'error', 'text': str(e)})
+
+        return ws
+
+    async def handle_health(self, request):
+        return web.json_response({
+            'sessions': len(self.sessions),
+            'active': self.active,
+            'pending': self.pending,
+            'answered': self.answered,
+            'rejected': self.rejected,
+            'llm_running': self.gate.running,
+            'llm_waiting': self.gate.waiting,
+            'cache': get_cache().stats(),
+            'answers': self.answers.stats() if self.answers is not None else None
+        })
+
+    async def handle_metrics(self, request):
+        return web.Response(text=get_tracer().summary() + "\n")
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post('/ask', self.handle_ask)
+        app.router.add_get('/ws', self.handle_ws)
+        app.router.add_get('/health', self.handle_health)
+        app.router.add_get('/metrics', self.handle_metrics)
+        return app
+
+
+def make_tools():
+    return [
+        make_s3_tool(),
+        GetEC2InstanceSizeTool(),
+        GetIAMUserPermissionsTool(),
+        GetSecurityGroupInfoTool(),
+        ShowMoreTool()
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="aws chatbot server for many users")
+    parser.add_argument('--host', default=os.getenv('CHATBOT_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('CHATBOT_PORT', '8080')))
+    parser.add_argument('--stub', action='store_true', help="fake llm, no api key needed")
+    parser.add_argument('--moto', action='store_true', help="fake aws account from moto")
+    args = parser.parse_args()
+
+    if args.moto:
+        from mock_account import start_mock_account
+        start_mock_account()
+        print("using a fake aws account (moto)")
+
+    if args.stub:
+        from stub_llm import StubChatModel
+        llm = StubChatModel()
+        print("using the stub llm")
+    elif not os.getenv('ANTHROPIC_API_KEY'):
+        print("ERROR: set ANTHROPIC_API_KEY or run with --stub")
+        return
+    else:
+        llm = make_llm()
+
+    server = ChatServer(
+        llm,
+        make_tools(),
+        max_requests=int(os.getenv('CHATBOT_MAX_REQUESTS', '64')),
+        max_llm_calls=int(os.getenv('CHATBOT_MAX_LLM_CALLS', '4')),
+        max_llm_waiting=int(os.getenv('CHATBOT_MAX_LLM_WAITING', '32')),
+        max_pending=int(os.getenv('CHATBOT_MAX_PENDING', '64'))
+    )
+
+    async def setup_threads(app):
+        # boto3 calls run on worker threads, give them enough for everyone
+        threads = int(os.getenv('CHATBOT_TOOL_THREADS', '32'))
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=threads))
+
+    async def start_warmup(app):
+        if os.getenv('CHATBOT_WARMUP') == '1':
+            app['warmup'] = Warmup(server.tools, on_progress=print).start()
+
+    async def stop_warmup(app):
+        if 'warmup' in app:
+            app['warmup'].cancel()
+
+    app = server.app()
+    app.on_startup.append(setup_threads)
+    app.on_startup.append(start_warmup)
+    app.on_cleanup.append(stop_warmup)
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
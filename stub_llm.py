@@ -0,0 +1,96 @@
+import json
+import re
+import time
+import uuid
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+# (pattern, tool name, args from the match) tried in order
+ROUTES = [
+    (r'\b(sg-[0-9a-f]+)\b', 'get_security_group_info', lambda m: {'group_id': m.group(1)}),
+    (r'security groups?', 'get_security_group_info', lambda m: {}),
+    (r'\b(\d{1,3}(?:\.\d{1,3}){3}(?:/\d{1,2})?)\b', 'get_ec2_instance_size', lambda m: {'query': m.group(1)}),
+    (r'\b(i-[0-9a-f]{8,17})\b', 'get_ec2_instance_size', lambda m: {'query': m.group(1)}),
+    (r'\b(?:user|can) ([\w+=,.@-]+)', 'get_iam_user_permissions', lambda m: {'username': m.group(1)}),
+    (r'\bbucket (\S+)', 's3_tool', lambda m: {'bucket_name': m.group(1)}),
+    (r'\b(?:s3|buckets?)\b', 's3_tool', lambda m: {}),
+]
+
+
+def question_of(message):
+    text = str(message.content)
+    if 'question:' in text:
+        return text.rsplit('question:', 1)[1].strip()
+    return text
+
+
+class StubChatModel(BaseChatModel):
+    """a fake claude for running the bot without an api key
+
+    picks a tool from keywords in the question, then answers by repeating
+    the start of the tool output. enough to drive the server, the tools and
+    the caches end to end against moto.
+    """
+
+    answer_chars: int = 300
+    latency: float = 0.0          # seconds each call pretends to take
+    prompt_sizes: list = []       # characters sent in each call, for benchmarks
+
+    @property
+    def _llm_type(self):
+        return "stub"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tool_names=[t.name for t in tools], **kwargs)
+
+    def _reply(self, messages, tool_names=None):
+        self.prompt_sizes.append(sum(len(str(m.content)) for m in messages))
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        last = messages[-1]
+
+        if isinstance(last, ToolMessage):
+            outputs = []
+            for message in reversed(messages):
+                if not isinstance(message, ToolMessage):
+                    break
+                outputs.insert(0, str(message.content)[:self.answer_chars])
+            return AIMessage(content="here is what i found:\n" + "\n".join(outputs))
+
+        if tool_names:
+            question = question_of(last).lower()
+            for pattern, tool_name, make_args in ROUTES:
+                match = re.search(pattern, question)
+                if match and tool_name in tool_names:
+                    call = {'name': tool_name, 'args': make_args(match), 'id': f"toolu_{uuid.uuid4().hex[:12]}"}
+                    return AIMessage(content="", tool_calls=[call])
+
+        # summaries and anything no tool fits
+        return AIMessage(content=str(last.content)[:self.answer_chars])
+
+    def _generate(self, messages, stop=None, run_manager=None, tool_names=None, **kwargs):
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages, tool_names))])
+
+    def _stream(self, messages, stop=None, run_manager=None, tool_names=None, **kwargs):
+        reply = self._reply(messages, tool_names)
+
+        if reply.tool_calls:
+            chunks = [
+                {'name': c['name'], 'args': json.dumps(c['args']), 'id': c['id'], 'index': i}
+                for i, c in enumerate(reply.tool_calls)
+            ]
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=chunks))
+            return
+
+        # a few words at a time like the real thing
+        words = reply.content.split(' ')
+        for i in range(0, len(words), 5):
+            text = ' '.join(words[i:i + 5])
+            if i + 5 < len(words):
+                text = text + ' '
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text))
+
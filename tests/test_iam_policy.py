@@ -0,0 +1,132 @@
+from tools.iam_policy import UserBindings, build_permissions
+
+
+ADMIN = 'arn:aws:iam::aws:policy/AdministratorAccess'
+BOUNDARY = 'arn:aws:iam::123456789012:policy/boundary'
+SCOPED = 'arn:aws:iam::123456789012:policy/scoped'
+
+
+def document(*statements):
+    return {'Version': '2012-10-17', 'Statement': list(statements)}
+
+
+def permissions(documents, attached=(ADMIN,), boundary=None, inline=()):
+    bindings = UserBindings(
+        username='bob',
+        attached=[(arn.split('/')[-1], arn) for arn in attached],
+        inline=list(inline),
+        boundary_arn=boundary
+    )
+    return build_permissions(bindings, documents)
+
+
+def test_admin_allows_anything():
+    perms = permissions({ADMIN: document({'Effect': 'Allow', 'Action': '*', 'Resource': '*'})})
+    decision = perms.evaluate('iam:CreateUser')
+    assert decision.allowed
+    assert 'AdministratorAccess' in decision.reason
+
+
+def test_explicit_deny_beats_allow():
+    perms = permissions({ADMIN: document(
+        {'Effect': 'Allow', 'Action': '*', 'Resource': '*'},
+        {'Effect': 'Deny', 'Action': 's3:DeleteBucket', 'Resource': '*'}
+    )})
+    assert not perms.evaluate('s3:DeleteBucket').allowed
+    assert 'explicitly denied' in perms.evaluate('s3:DeleteBucket').reason
+    assert perms.evaluate('s3:GetObject').allowed
+
+
+def test_deny_on_one_resource_only_blocks_that_resource():
+    perms = permissions({ADMIN: document(
+        {'Effect': 'Allow', 'Action': 's3:*', 'Resource': '*'},
+        {'Effect': 'Deny', 'Action': 's3:GetObject', 'Resource': 'arn:aws:s3:::secret/*'}
+    )})
+    assert not perms.evaluate('s3:GetObject', 'arn:aws:s3:::secret/key').allowed
+    assert perms.evaluate('s3:GetObject', 'arn:aws:s3:::public/key').allowed
+
+
+def test_nothing_attached_is_implicit_deny():
+    decision = permissions({}, attached=()).evaluate('s3:GetObject')
+    assert not decision.allowed
+    assert 'implicit deny' in decision.reason
+
+
+def test_boundary_deny_beats_admin():
+    perms = permissions({
+        ADMIN: document({'Effect': 'Allow', 'Action': '*', 'Resource': '*'}),
+        BOUNDARY: document(
+            {'Effect': 'Allow', 'Action': '*', 'Resource': '*'},
+            {'Effect': 'Deny', 'Action': 'iam:*', 'Resource': '*'}
+        )
+    }, boundary=BOUNDARY)
+    decision = perms.evaluate('iam:CreateUser')
+    assert not decision.allowed
+    assert 'permissions boundary' in decision.reason
+    assert perms.evaluate('s3:GetObject').allowed
+
+
+def test_boundary_without_allow_blocks():
+    perms = permissions({
+        ADMIN: document({'Effect': 'Allow', 'Action': '*', 'Resource': '*'}),
+        BOUNDARY: document({'Effect': 'Allow', 'Action': 's3:*', 'Resource': '*'})
+    }, boundary=BOUNDARY)
+    assert perms.evaluate('s3:PutObject').allowed
+    decision = perms.evaluate('ec2:RunInstances')
+    assert not decision.allowed
+    assert 'blocked by the permissions boundary' in decision.reason
+
+
+def test_boundary_does_not_grant():
+    perms = permissions({
+        SCOPED: document({'Effect': 'Allow', 'Action': 's3:GetObject', 'Resource': '*'}),
+        BOUNDARY: document({'Effect': 'Allow', 'Action': '*', 'Resource': '*'})
+    }, attached=(SCOPED,), boundary=BOUNDARY)
+    assert perms.evaluate('s3:GetObject').allowed
+    assert not perms.evaluate('s3:PutObject').allowed
+
+
+def test_conditional_boundary_deny_is_flagged():
+    perms = permissions({
+        ADMIN: document({'Effect': 'Allow', 'Action': '*', 'Resource': '*'}),
+        BOUNDARY: document(
+            {'Effect': 'Allow', 'Action': '*', 'Resource': '*'},
+            {'Effect': 'Deny', 'Action': 'iam:*', 'Resource': '*', 'Condition': {'Bool': {'aws:MultiFactorAuthPresent': 'false'}}}
+        )
+    }, boundary=BOUNDARY)
+    decision = perms.evaluate('iam:CreateUser')
+    assert decision.allowed
+    assert decision.conditional
+
+
+def test_not_action_allow():
+    perms = permissions({ADMIN: document({'Effect': 'Allow', 'NotAction': 'iam:*', 'Resource': '*'})})
+    assert perms.evaluate('s3:GetObject').allowed
+    assert not perms.evaluate('iam:CreateUser').allowed
+
+
+def test_not_action_deny():
+    # deny everything except reading s3
+    perms = permissions({ADMIN: document(
+        {'Effect': 'Allow', 'Action': '*', 'Resource': '*'},
+        {'Effect': 'Deny', 'NotAction': ['s3:Get*', 's3:List*'], 'Resource': '*'}
+    )})
+    assert perms.evaluate('s3:GetObject').allowed
+    assert not perms.evaluate('s3:PutObject').allowed
+    assert not perms.evaluate('ec2:RunInstances').allowed
+
+
+def test_not_action_in_boundary():
+    perms = permissions({
+        ADMIN: document({'Effect': 'Allow', 'Action': '*', 'Resource': '*'}),
+        BOUNDARY: document({'Effect': 'Allow', 'NotAction': 'iam:*', 'Resource': '*'})
+    }, boundary=BOUNDARY)
+    assert perms.evaluate('ec2:DescribeInstances').allowed
+    assert not perms.evaluate('iam:CreateUser').allowed
+
+
+def test_inline_policy_and_case_insensitive_actions():
+    perms = permissions({}, attached=(), inline=[
+        ('inline', document({'Effect': 'Allow', 'Action': 'S3:getobject', 'Resource': '*'}))
+    ])
+    assert perms.evaluate('s3:GetObject').allowed
@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+import pytest
+
+from router import route
+
+
+TOOLS = [SimpleNamespace(name=name) for name in ('s3_tool', 'get_ec2_instance_size', 'get_iam_user_permissions', 'get_security_group_info')]
+
+
+def routed(question):
+    plan = route(question, TOOLS)
+    return [(c['name'], c['args']) for c in plan.calls], plan.confidence
+
+
+# the examples the repl prints
+@pytest.mark.parametrize('question, expected', [
+    ("how many s3 buckets do i have", [('s3_tool', {})]),
+    ("which buckets are public", [('s3_tool', {})]),
+    ("whats in bucket my-bucket", [('s3_tool', {'bucket_name': 'my-bucket'})]),
+    ("what size is ec2 at ip 10.0.1.5", [('get_ec2_instance_size', {'query': '10.0.1.5'})]),
+    ("which instances are tagged env=prod", [('get_ec2_instance_size', {'query': 'env=prod'})]),
+    ("what permissions does user bob have", [('get_iam_user_permissions', {'username': 'bob'})]),
+    ("show me security group sg-12345", [('get_security_group_info', {'group_id': 'sg-12345'})]),
+    ("list all security groups", [('get_security_group_info', {})]),
+    ("which security groups allow 0.0.0.0/0 on 22", [('get_security_group_info', {'source': '0.0.0.0/0', 'port': 22})]),
+    ("refresh which buckets are public", [('s3_tool', {})]),
+])
+def test_repl_examples(question, expected):
+    calls, confidence = routed(question)
+    assert calls == expected
+    assert confidence >= 0.8
+
+
+@pytest.mark.parametrize('action', ['s3:*', 's3:GetObject', 'ec2:Describe*', 'iam:*'])
+def test_iam_action_check(action):
+    calls, confidence = routed(f"can bob do {action}")
+    assert calls == [('get_iam_user_permissions', {'username': 'bob', 'action': action})]
+    assert confidence >= 0.8
+
+
+def test_iam_action_on_resource():
+    calls, confidence = routed("can bob do s3:GetObject on arn:aws:s3:::logs/*")
+    assert calls == [('get_iam_user_permissions', {'username': 'bob', 'action': 's3:GetObject', 'resource': 'arn:aws:s3:::logs/*'})]
+
+
+def test_full_length_group_id():
+    calls, confidence = routed("show me security group sg-0123456789abcdef0")
+    assert calls == [('get_security_group_info', {'group_id': 'sg-0123456789abcdef0'})]
+
+
+def test_vague_question_is_left_to_claude():
+    calls, confidence = routed("why is bucket logs public and should i change it")
+    assert confidence < 0.8
+
+
+def test_several_kinds_of_thing_is_ambiguous():
+    plan = route("what size is ec2 at ip 10.0.1.5 and what permissions does user bob have", TOOLS)
+    assert plan.confidence < 0.8
+
+
+def test_unknown_question():
+    assert route("hello there", TOOLS).calls == []
+
+
+def test_missing_tool_is_not_routed():
+    assert route("how many s3 buckets do i have", TOOLS[1:]).calls == []
@@ -0,0 +1,117 @@
+import asyncio
+import json
+import os
+
+from tools.results import fit, get_pages
+from tools.tracing import get_tracer
+
+
+DEFAULT_TIMEOUT = float(os.getenv('CHATBOT_TOOL_TIMEOUT', '90'))
+
+# a tool with its own deadline (the s3 scan) gets this long past it to
+# answer with what it has before the call itself is cut off
+DEADLINE_MARGIN = 20
+
+# tokens of tool output sent back per step, shared by the calls in it
+DEFAULT_OUTPUT_TOKENS = int(os.getenv('CHATBOT_TOOL_OUTPUT_TOKENS', '3000'))
+
+# no call gets less than this however many run in one step
+MIN_OUTPUT_TOKENS = 300
+
+
+def find_tool(tools, name):
+    for t in tools:
+        if t.name == name:
+            return t
+    return None
+
+
+def tool_timeout(tool):
+    """the default timeout, longer for a tool whose own deadline is past it"""
+    own = getattr(tool, 'scan_timeout', None)
+    if own is None:
+        return DEFAULT_TIMEOUT
+    return max(DEFAULT_TIMEOUT, own + DEADLINE_MARGIN)
+
+
+async def run_tool_call(call, tools, refresh=False, timeout=None):
+    """runs one tool call from claude through the tools _arun
+
+    returns what the tool returned, text or a ToolResult, errors as text
+    """
+
+    selected_tool = find_tool(tools, call['name'])
+    if selected_tool is None:
+        return f"tool error: no tool called {call['name']}"
+
+    args = dict(call.get('args') or {})
+    schema = selected_tool.args_schema
+    if refresh and schema is not None and 'refresh' in schema.model_fields:
+        args['refresh'] = True
+
+    if timeout is None:
+        timeout = tool_timeout(selected_tool)
+
+    with get_tracer().span('tool', call['name'], args=args) as span:
+        try:
+            return await asyncio.wait_for(selected_tool._arun(**args), timeout)
+        except asyncio.TimeoutError:
+            span.error = f"timed out after {timeout:.0f}s"
+            return f"tool error: {call['name']} timed out after {timeout:.0f}s"
+        except Exception as e:
+            span.error = f"{type(e).__name__}: {e}"
+            return f"tool error: {e}"
+
+
+class ToolExecutor:
+    """starts tool calls as soon as they are known and runs them side by side
+
+    results come back in the order claude asked for them, whatever order
+    they finish in, cut down so all of them together fit in max_tokens.
+    """
+
+    def __init__(self, tools, refresh=False, timeouts=None, max_tokens=None, pages=None):
+        self.tools = tools
+        self.refresh = refresh
+        self.timeouts = timeouts or {}
+        self.max_tokens = max_tokens or DEFAULT_OUTPUT_TOKENS
+        self.pages = pages or get_pages()
+        self.calls = []
+        self._tasks = {}
+
+    def start(self, call):
+        if call['id'] in self._tasks:
+            return
+        timeout = self.timeouts.get(call['name'])
+        task = asyncio.ensure_future(run_tool_call(call, self.tools, self.refresh, timeout))
+        self.calls.append(call)
+        self._tasks[call['id']] = task
+
+    def start_finished_chunks(self, tool_call_chunks):
+        """starts every streamed tool call whose block is already closed
+
+        anthropic streams one content block at a time, so once a chunk for
+        a later block shows up the earlier ones are complete.
+        """
+        if len(tool_call_chunks) == 0:
+            return
+        latest = max(c.get('index') or 0 for c in tool_call_chunks)
+        for c in tool_call_chunks:
+            if (c.get('index') or 0) >= latest or not c.get('id'):
+                continue
+            try:
+                args = json.loads(c.get('args') or '{}')
+            except ValueError:
+                continue
+            self.start({'name': c['name'], 'args': args, 'id': c['id']})
+
+    async def results(self):
+        """waits for everything started, returns [(call, result text)]
+
+        long results are cut to their share of the budget, the rest can be
+        fetched with the show_more tool
+        """
+        outputs = await asyncio.gather(*[self._tasks[call['id']] for call in self.calls])
+        share = max(self.max_tokens // max(len(self.calls), 1), MIN_OUTPUT_TOKENS)
+        texts = [fit(output, share, self.pages) for output in outputs]
+        return list(zip(self.calls, texts))
@@ -0,0 +1,111 @@
+import os
+import threading
+import weakref
+
+import boto3
+from botocore.config import Config
+
+from tools.tracing import get_tracer
+
+
+def default_config():
+    """connection pool and retry settings shared by every client"""
+    return Config(
+        max_pool_connections=int(os.getenv('AWS_MAX_POOL_CONNECTIONS', '50')),
+        retries={
+            'max_attempts': int(os.getenv('AWS_MAX_ATTEMPTS', '8')),
+            'mode': 'adaptive'
+        },
+        connect_timeout=5,
+        read_timeout=30,
+        tcp_keepalive=True
+    )
+
+
+# which factory and profile made each client, so a cached call can be
+# keyed under the account its own credentials belong to
+_owners = weakref.WeakKeyDictionary()
+
+
+def owner_of(client):
+    """(factory, profile) that made client, None for clients made elsewhere"""
+    return _owners.get(client)
+
+
+class ClientFactory:
+    """hands out one boto3 client per (service, region, profile) and reuses it
+
+    boto3 sessions arent thread safe but the clients they make are, so the
+    sessions are only touched under the lock and the clients are shared
+    freely between threads and questions.
+    """
+
+    def __init__(self, config=None, region=None, profile=None):
+        self.config = config or default_config()
+        self.region = region
+        self.profile = profile
+        self._sessions = {}
+        self._clients = {}
+        self._handlers = []
+        self._lock = threading.Lock()
+
+    def _session(self, profile):
+        session = self._sessions.get(profile)
+        if session is None:
+            session = boto3.session.Session(profile_name=profile)
+            self._sessions[profile] = session
+        return session
+
+    def client(self, service, region=None, profile=None):
+        region = region or self.region
+        profile = profile or self.profile
+        key = (service, region, profile)
+
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                with get_tracer().span('setup', f"client {service}", region=region):
+                    session = self._session(profile)
+                    client = session.client(service, region_name=region, config=self.config)
+                for event_name, handler in self._handlers:
+                    client.meta.events.register(event_name, handler)
+                self._clients[key] = client
+                _owners[client] = (self, profile)
+            return client
+
+    def register(self, event_name, handler):
+        """adds a botocore event handler to every client, made now or later"""
+        with self._lock:
+            self._handlers.append((event_name, handler))
+            for client in self._clients.values():
+                client.meta.events.register(event_name, handler)
+
+    def unregister(self, event_name, handler):
+        with self._lock:
+            self._handlers.remove((event_name, handler))
+            for client in self._clients.values():
+                client.meta.events.unregister(event_name, handler)
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+            self._sessions.clear()
+
+
+_default_factory = None
+_default_lock = threading.Lock()
+
+
+def get_clients():
+    """the process wide client factory, its aws calls show up in the traces"""
+    global _default_factory
+
+    with _default_lock:
+        if _default_factory is None:
+            _default_factory = ClientFactory()
+            get_tracer().install(_default_factory)
+        return _default_factory
@@ -0,0 +1,248 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from tools.aws_clients import get_clients, owner_of
+
+
+# seconds to keep each kind of resource before asking aws again
+DEFAULT_TTLS = {
+    'account': 86400,
+    'regions': 86400,
+    's3': 300,
+    'ec2': 60,
+    'iam': 600,
+    'iam_policy': 86400,
+    'security_group': 120,
+    'default': 120
+}
+
+
+class MemoryBackend:
+    """lru dict in memory, oldest entries fall off past max_entries"""
+
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+            return entry
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def _encode(value):
+    # boto3 responses are plain json apart from their timestamps
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    raise TypeError(f"{type(value).__name__} isnt json")
+
+
+def _decode(obj):
+    if len(obj) == 1 and '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+    return obj
+
+
+class SQLiteBackend:
+    """keeps entries in a sqlite file so they survive restarts
+
+    only json goes in the file, the path comes from the environment and
+    nothing read back from it gets unpickled. values that arent plain json
+    (parsed policies, bucket checks) are kept in memory instead.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._memory = MemoryBackend()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, expires_at REAL, value BLOB)")
+        self._conn.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+        self._conn.commit()
+
+    def get(self, key):
+        entry = self._memory.get(key)
+        if entry is not None:
+            return entry
+        with self._lock:
+            row = self._conn.execute("SELECT expires_at, value FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            return row[0], json.loads(row[1], object_hook=_decode)
+        except ValueError:
+            # written by an older version, or not by us at all
+            self.delete(key)
+            return None
+
+    def set(self, key, value, expires_at):
+        try:
+            text = json.dumps(value, default=_encode)
+        except (TypeError, ValueError):
+            self._memory.set(key, value, expires_at)
+            return
+        self._memory.delete(key)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO cache (key, expires_at, value) VALUES (?, ?, ?)", (key, expires_at, text))
+            self._conn.commit()
+
+    def delete(self, key):
+        self._memory.delete(key)
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def clear(self):
+        self._memory.clear()
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._conn.commit()
+
+
+class ResourceCache:
+    """ttl cache for aws responses, shared by all the tools
+
+    keys are account/region/call/params so the same question against a
+    different account or region never gets someone elses answer.
+    """
+
+    def __init__(self, backend=None, ttls=None):
+        self.backend = backend or MemoryBackend()
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.hits = 0
+        self.misses = 0
+        self._accounts = {}
+        self._lock = threading.Lock()
+
+    def ttl_for(self, resource_type):
+        return self.ttls.get(resource_type, self.ttls['default'])
+
+    def get_or_load(self, resource_type, key, loader, refresh=False):
+        """returns the cached value for key or calls loader() and caches it"""
+        full_key = f"{resource_type}/{key}"
+
+        if not refresh:
+            entry = self.backend.get(full_key)
+            if entry is not None and entry[0] > time.time():
+                with self._lock:
+                    self.hits += 1
+                return entry[1]
+
+        with self._lock:
+            self.misses += 1
+
+        value = loader()
+        self.backend.set(full_key, value, time.time() + self.ttl_for(resource_type))
+        return value
+
+    def account_id(self, clients=None, profile=None, refresh=False):
+        """the account the credentials of clients (and profile) belong to
+
+        kept in memory per factory and profile and never in the backend, a
+        restart with another profile or other credentials has to ask sts
+        again or it would read the old accounts cached answers. not counted
+        in hits and misses, those are for aws resources.
+        """
+        clients = clients or get_clients()
+        profile = profile or clients.profile
+        key = (clients, profile)
+
+        with self._lock:
+            entry = self._accounts.get(key)
+            if not refresh and entry is not None and entry[0] > time.time():
+                return entry[1]
+
+        account = clients.client('sts', profile=profile).get_caller_identity()['Account']
+        with self._lock:
+            self._accounts[key] = (time.time() + self.ttl_for('account'), account)
+        return account
+
+    def _client_account(self, client):
+        # the account of whoever made the client, not of the default factory
+        owner = owner_of(client)
+        if owner is None:
+            return self.account_id()
+        factory, profile = owner
+        return self.account_id(factory, profile)
+
+    def call(self, resource_type, client, method, refresh=False, **params):
+        """cached client.method(**params), keyed by account and the clients region"""
+        region = client.meta.region_name or 'global'
+        service = client.meta.service_model.service_name
+        args = json.dumps(params, sort_keys=True, default=str)
+        key = f"{self._client_account(client)}/{region}/{service}.{method}/{args}"
+
+        def load():
+            return getattr(client, method)(**params)
+
+        return self.get_or_load(resource_type, key, load, refresh)
+
+    def call_paginated(self, resource_type, client, method, result_key, refresh=False, **params):
+        """cached list of every result_key item across all pages of client.method"""
+        region = client.meta.region_name or 'global'
+        service = client.meta.service_model.service_name
+        args = json.dumps(params, sort_keys=True, default=str)
+        key = f"{self._client_account(client)}/{region}/{service}.{method}:all/{args}"
+
+        def load():
+            items = []
+            for page in client.get_paginator(method).paginate(**params):
+                items.extend(page.get(result_key, []))
+            return items
+
+        return self.get_or_load(resource_type, key, load, refresh)
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self._accounts.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        hit_rate = 0.0
+        if total > 0:
+            hit_rate = self.hits / total
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': hit_rate}
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_cache():
+    """the process wide cache, set CHATBOT_CACHE_DB to keep it on disk"""
+    global _default_cache
+
+    with _default_lock:
+        if _default_cache is None:
+            path = os.getenv('CHATBOT_CACHE_DB')
+            if path:
+                _default_cache = ResourceCache(SQLiteBackend(path))
+            else:
+                _default_cache = ResourceCache()
+        return _default_cache
@@ -0,0 +1,224 @@
+import fnmatch
+import ipaddress
+import threading
+import time
+from typing import NamedTuple
+
+from tools.aws_clients import get_clients
+from tools.cache import get_cache
+
+
+class InstanceRecord(NamedTuple):
+    """just the bits of an instance the tools print, a tuple keeps it small"""
+    instance_id: str
+    instance_type: str
+    state: str
+    name: str
+    private_ips: tuple
+    public_ips: tuple
+    region: str
+    tags: tuple
+
+
+def make_record(instance, region):
+    private_ips = []
+    public_ips = []
+
+    if instance.get('PrivateIpAddress'):
+        private_ips.append(instance['PrivateIpAddress'])
+    if instance.get('PublicIpAddress'):
+        public_ips.append(instance['PublicIpAddress'])
+
+    # secondary addresses on every eni, with their elastic ips
+    for eni in instance.get('NetworkInterfaces', []):
+        for address in eni.get('PrivateIpAddresses', []):
+            ip = address.get('PrivateIpAddress')
+            if ip and ip not in private_ips:
+                private_ips.append(ip)
+            public_ip = address.get('Association', {}).get('PublicIp')
+            if public_ip and public_ip not in public_ips:
+                public_ips.append(public_ip)
+
+    name = 'no name'
+    tags = []
+    for tag in instance.get('Tags', []):
+        tags.append((tag['Key'], tag['Value']))
+        if tag['Key'] == 'Name':
+            name = tag['Value']
+
+    return InstanceRecord(
+        instance_id=instance['InstanceId'],
+        instance_type=instance['InstanceType'],
+        state=instance['State']['Name'],
+        name=name,
+        private_ips=tuple(private_ips),
+        public_ips=tuple(public_ips),
+        region=region or '',
+        tags=tuple(tags)
+    )
+
+
+class InstanceIndex:
+    """every instance in one region, looked up by ip, id, name or tag in memory
+
+    built from one paginated describe_instances sweep. once the ttl runs
+    out lookups keep using the old index while a background sweep builds a
+    new one, and instances found by targeted lookups are merged in as they
+    turn up, so the index catches up without blocking anyone.
+    """
+
+    def __init__(self, region=None, clients=None, ttl=300):
+        self.region = region
+        self.clients = clients or get_clients()
+        self.ttl = ttl
+        self.built_at = 0.0
+        self.by_id = {}
+        self.by_ip = {}
+        self.by_name = {}
+        self.by_tag = {}
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _sweep(self):
+        ec2 = self.clients.client('ec2', self.region)
+        paginator = ec2.get_paginator('describe_instances')
+
+        records = []
+        for page in paginator.paginate(PaginationConfig={'PageSize': 1000}):
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    records.append(make_record(instance, self.region))
+        return records
+
+    def _build(self, records):
+        maps = ({}, {}, {}, {})
+        for record in records:
+            self._insert(record, *maps)
+        return maps
+
+    def _insert(self, record, by_id, by_ip, by_name, by_tag):
+        by_id[record.instance_id] = record
+
+        keys = [(by_name, record.name.lower())]
+        for ip in record.private_ips + record.public_ips:
+            keys.append((by_ip, ip))
+        for tag_key, tag_value in record.tags:
+            keys.append((by_tag, (tag_key.lower(), tag_value.lower())))
+
+        for mapping, key in keys:
+            ids = mapping.setdefault(key, [])
+            if record.instance_id not in ids:
+                ids.append(record.instance_id)
+
+    def rebuild(self):
+        by_id, by_ip, by_name, by_tag = self._build(self._sweep())
+        # swap the whole thing at once so readers never see half an index
+        with self._lock:
+            self.by_id = by_id
+            self.by_ip = by_ip
+            self.by_name = by_name
+            self.by_tag = by_tag
+            self.built_at = time.time()
+            self._refreshing = False
+
+    def _background_rebuild(self):
+        try:
+            self.rebuild()
+        except Exception:
+            with self._lock:
+                self._refreshing = False
+
+    def is_built(self):
+        return self.built_at > 0
+
+    def is_fresh(self):
+        return time.time() - self.built_at < self.ttl
+
+    def ensure(self, refresh=False, wait=True):
+        """builds the index the first time, refreshes it in the background after
+
+        with wait=False even the first build happens in the background
+        """
+        if refresh or (wait and not self.is_built()):
+            self.rebuild()
+            return
+
+        if self.is_fresh():
+            return
+
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_rebuild, daemon=True).start()
+
+    def add(self, instances):
+        """merges instances from a targeted describe_instances call"""
+        with self._lock:
+            for instance in instances:
+                record = make_record(instance, self.region)
+                self._insert(record, self.by_id, self.by_ip, self.by_name, self.by_tag)
+
+    def _records(self, ids):
+        return [self.by_id[i] for i in ids if i in self.by_id]
+
+    def lookup_ip(self, ip):
+        return self._records(self.by_ip.get(ip, []))
+
+    def lookup_ips(self, ips):
+        """{ip: [records]} for every ip, no api calls"""
+        return {ip: self.lookup_ip(ip) for ip in ips}
+
+    def lookup_id(self, instance_id):
+        record = self.by_id.get(instance_id)
+        if record is None:
+            return []
+        return [record]
+
+    def lookup_name(self, name):
+        name = name.lower()
+        if '*' in name or '?' in name:
+            ids = []
+            for key in fnmatch.filter(list(self.by_name), name):
+                ids.extend(self.by_name[key])
+            return self._records(ids)
+        return self._records(self.by_name.get(name, []))
+
+    def lookup_tag(self, key, value):
+        return self._records(self.by_tag.get((key.lower(), value.lower()), []))
+
+    def lookup_cidr(self, cidr):
+        """every instance with an address inside the block, scans the ip map"""
+        network = ipaddress.ip_network(cidr, strict=False)
+        ids = []
+        for ip, instance_ids in list(self.by_ip.items()):
+            try:
+                if ipaddress.ip_address(ip) in network:
+                    ids.extend(instance_ids)
+            except ValueError:
+                continue
+        return self._records(list(dict.fromkeys(ids)))
+
+    def records(self):
+        return list(self.by_id.values())
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(region=None, clients=None, ttl=300):
+    """one shared index per account and region"""
+    key = (get_cache().account_id(clients), region)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = InstanceIndex(region, clients, ttl)
+            _indexes[key] = index
+        return index
+
+
+def clear_indexes():
+    """forgets every index, the next lookup sweeps again"""
+    with _indexes_lock:
+        _indexes.clear()
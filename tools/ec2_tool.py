@@ -1,84 +1,308 @@
-import boto3
+import asyncio
+import ipaddress
+import re
+from typing import Optional
+from botocore.exceptions import ClientError
 from langchain_core.tools import BaseTool
 from pydantic import BaseModel, Field
 
+from tools.aws_clients import ClientFactory, get_clients
+from tools.cache import ResourceCache, get_cache
+from tools.ec2_index import get_index
+from tools.inventory import Inventory, get_inventory
+from tools.regions import default_region, enabled_regions, fan_out
+from tools.results import ToolResult
 
 
-class EC2IPInput(BaseModel):
-    ip_address: str = Field(description="ip address")
+# describe_instances takes at most 200 values per filter
+MAX_FILTER_VALUES = 200
+
+
+def unsupported_filter(error):
+    """true when the endpoint doesnt know one of the filters
+
+    aws answers InvalidParameterValue, moto raises NotImplementedError for
+    the filters it hasnt got. throttling or access denied are not this.
+    """
+    if isinstance(error, NotImplementedError):
+        return True
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code') == 'InvalidParameterValue'
+    return False
+
+
+
+class EC2LookupInput(BaseModel):
+    query: str = Field(description="what to look for, separated by commas: ip addresses, cidr blocks (10.0.1.0/24), instance ids (i-xxxx), tags as key=value, or instance names (* wildcards ok)")
+    region: str = Field(default="", description="aws region, 'all' to search every enabled region, empty for the default region")
+    refresh: bool = Field(default=False, description="true to skip cached data and ask aws again")
+
+
+
+def parse_query(query):
+    """splits the query into [(kind, value)], kind is ip, cidr, id, tag or name"""
+    terms = []
+
+    for piece in query.split(','):
+        piece = piece.strip()
+        if piece == '':
+            continue
+
+        words = piece.split()
+        kinds = [term_kind(w) for w in words]
+
+        # "10.0.1.5 10.0.1.6" is two ips but "web server 1" is one name
+        if len(words) > 1 and 'name' in kinds:
+            terms.append(('name', piece))
+            continue
+
+        for word, kind in zip(words, kinds):
+            if kind == 'tag':
+                key, value = word.split('=', 1)
+                terms.append(('tag', (key, value)))
+            else:
+                terms.append((kind, word))
+
+    return terms
+
+
+def term_kind(word):
+    if re.fullmatch(r'i-[0-9a-f]{8,17}', word):
+        return 'id'
+    if '/' in word:
+        try:
+            ipaddress.ip_network(word, strict=False)
+            return 'cidr'
+        except ValueError:
+            pass
+    try:
+        ipaddress.ip_address(word)
+        return 'ip'
+    except ValueError:
+        pass
+    if '=' in word:
+        return 'tag'
+    return 'name'
+
+
+def term_text(kind, value):
+    if kind == 'tag':
+        return f"tag {value[0]}={value[1]}"
+    return f"{kind} {value}"
 
 
 
 class GetEC2InstanceSizeTool(BaseTool):
     name: str = "get_ec2_instance_size"
-    description: str = "finds ec2 info by ip address"
-    args_schema: type[BaseModel] = EC2IPInput
-    
-    def _run(self, ip_address: str) -> str:
-        
-        ec2 = boto3.client('ec2')
-        
-        
-        response = ec2.describe_instances(
-            Filters=[
-                {
-                    'Name': 'network-interface.addresses.private-ip-address',
-                    'Values': [ip_address]
-                }
-            ]
-        )
-        
-        
-        if len(response['Reservations']) == 0:
-            response = ec2.describe_instances(
-                Filters=[
-                    {
-                        'Name': 'ip-address',
-                        'Values': [ip_address]
-                    }
-                ]
+    description: str = "finds ec2 instances and their size by ip address, cidr block, instance id, tag or name. takes several at once"
+    args_schema: type[BaseModel] = EC2LookupInput
+    cache: Optional[ResourceCache] = None
+    clients: Optional[ClientFactory] = None
+    inventory: Optional[Inventory] = None
+    all_regions: bool = False
+    index_ttl: int = 300
+
+    def _index_lookup(self, index, kind, value):
+        if kind == 'ip':
+            return index.lookup_ip(value)
+        if kind == 'cidr':
+            return index.lookup_cidr(value)
+        if kind == 'id':
+            return index.lookup_id(value)
+        if kind == 'tag':
+            return index.lookup_tag(value[0], value[1])
+        return index.lookup_name(value)
+
+    def _batched_filters(self, terms):
+        """the fewest describe_instances filters that cover the terms
+
+        filters in one call are ANDed, so each kind of term gets its own
+        call with all of its values in it (200 at a time)
+        """
+        values = {}
+        for kind, value in terms:
+            if kind == 'ip':
+                values.setdefault('network-interface.addresses.private-ip-address', []).append(value)
+                values.setdefault('network-interface.addresses.association.public-ip', []).append(value)
+            elif kind == 'id':
+                values.setdefault('instance-id', []).append(value)
+            elif kind == 'name':
+                values.setdefault('tag:Name', []).append(value)
+            elif kind == 'tag':
+                values.setdefault(f"tag:{value[0]}", []).append(value[1])
+
+        filters = []
+        for name, vals in values.items():
+            for i in range(0, len(vals), MAX_FILTER_VALUES):
+                filters.append({'Name': name, 'Values': vals[i:i + MAX_FILTER_VALUES]})
+        return filters
+
+    def _find_instances(self, region, terms, refresh=False):
+        """[(term, [instance records])] for one region
+
+        a fresh instance index answers everything locally. otherwise the
+        missing terms are fetched with batched filter calls and merged into
+        the index, and the index is (re)built in the background for next time
+        """
+        index = get_index(region, self.clients, self.index_ttl)
+
+        # cidr blocks can only be answered by scanning every address
+        needs_full_index = any(kind == 'cidr' for kind, value in terms)
+        index.ensure(refresh, wait=needs_full_index)
+
+        found = [(term, self._index_lookup(index, *term)) for term in terms]
+        if index.is_built() and index.is_fresh():
+            return found
+
+        missing = [term for term, records in found if len(records) == 0 and term[0] != 'cidr']
+        if len(missing) == 0:
+            return found
+
+        clients = self.clients or get_clients()
+        ec2 = clients.client('ec2', region)
+        paginator = ec2.get_paginator('describe_instances')
+        try:
+            for instance_filter in self._batched_filters(missing):
+                for page in paginator.paginate(Filters=[instance_filter]):
+                    for reservation in page['Reservations']:
+                        index.add(reservation['Instances'])
+        except Exception as e:
+            # not every endpoint (or moto) supports every filter, a full
+            # sweep answers the same question. anything else is a real error
+            if not unsupported_filter(e):
+                raise
+            index.rebuild()
+
+        return [(term, self._index_lookup(index, *term)) for term in terms]
+
+    def _format(self, record):
+        private_ip = ", ".join(record.private_ips) or 'N/A'
+        public_ip = ", ".join(record.public_ips) or 'N/A'
+
+        lines = [
+            "ec2 instance:",
+            f"id: {record.instance_id}",
+            f"type: {record.instance_type}",
+            f"state: {record.state}",
+            f"name: {record.name}",
+            f"private ip: {private_ip}",
+            f"public ip: {public_ip}"
+        ]
+        if record.region:
+            lines.append(f"region: {record.region}")
+        return "\n".join(lines)
+
+    def _summarize(self, records):
+        states = {}
+        for record in records:
+            states[record.state] = states.get(record.state, 0) + 1
+        counts = ", ".join(f"{count} {state}" for state, count in sorted(states.items()))
+        return f"{len(records)} more instances not listed: {counts}"
+
+    def _run(self, query: str, region: str = "", refresh: bool = False):
+
+        terms = parse_query(query)
+        if len(terms) == 0:
+            return "nothing to look for, give an ip, cidr, instance id, tag or name"
+
+        matches = {term: [] for term in terms}
+        failed = []
+        searched = 1
+
+        # the region the question is about, the snapshot has to have it
+        wanted = region or default_region(self.clients)
+        if region == "all" or (region == "" and self.all_regions):
+            wanted = "all"
+
+        inventory = None
+        if not refresh:
+            inventory = self.inventory or get_inventory((self.cache or get_cache()).account_id(self.clients))
+            if inventory is not None and not inventory.covers('instances', wanted):
+                inventory = None
+
+        if inventory is not None:
+            in_region = None
+            if wanted != "all":
+                in_region = wanted
+            for term in terms:
+                matches[term].extend(inventory.instances(*term, region=in_region))
+        elif region == "all" or (region == "" and self.all_regions):
+            regions = enabled_regions(self.cache, self.clients)
+            searched = len(regions)
+
+            # ips and ids are unique, once they have all turned up the other
+            # regions can be skipped. names, tags and cidrs need every region
+            unique = all(kind in ('ip', 'id') for kind, value in terms)
+            seen = set()
+
+            def all_found(result):
+                for term, records in result:
+                    if len(records) > 0:
+                        seen.add(term)
+                return unique and len(seen) == len(terms)
+
+            results = fan_out(
+                regions,
+                lambda r: self._find_instances(r, terms, refresh),
+                stop_when=all_found
             )
-        
-    
-        if len(response['Reservations']) == 0:
-            return f"no instance found with ip {ip_address}"
-        
-        # get instance
-        reservation = response['Reservations'][0]
-        instance = reservation['Instances'][0]
-        
-        # get info
-        instance_id = instance['InstanceId']
-        instance_type = instance['InstanceType']
-        state = instance['State']['Name']
-        
-        # get ips
-        private_ip = 'N/A'
-        if 'PrivateIpAddress' in instance:
-            private_ip = instance['PrivateIpAddress']
-        
-        public_ip = 'N/A'
-        if 'PublicIpAddress' in instance:
-            public_ip = instance['PublicIpAddress']
-        
-        # get name
-        name = 'no name'
-        if 'Tags' in instance:
-            tags = instance['Tags']
-            for tag in tags:
-                if tag['Key'] == 'Name':
-                    name = tag['Value']
-        
-        
-        output = "ec2 instance:\n"
-        output = output + f"id: {instance_id}\n"
-        output = output + f"type: {instance_type}\n"
-        output = output + f"state: {state}\n"
-        output = output + f"name: {name}\n"
-        output = output + f"private ip: {private_ip}\n"
-        output = output + f"public ip: {public_ip}"
-        
-        return output
-    
-    def _arun(self, ip_address: str) -> str:
-        return self._run(ip_address)
+            for r, result, error in results:
+                if error is not None:
+                    failed.append(f"{r}: {error}")
+                    continue
+                for term, records in result:
+                    matches[term].extend(records)
+        else:
+            for term, records in self._find_instances(region or None, terms, refresh):
+                matches[term].extend(records)
+
+        # each instance once, even if several terms matched it
+        instances = []
+        shown = set()
+        summary = []
+        not_found = []
+        for term in terms:
+            records = matches[term]
+            if len(records) == 0:
+                not_found.append(term_text(*term))
+                continue
+            if len(terms) > 1:
+                ids = ", ".join(r.instance_id for r in records)
+                summary.append(f"- {term_text(*term)}: {len(records)} instances ({ids})")
+            for record in records:
+                key = (record.region, record.instance_id)
+                if key in shown:
+                    continue
+                shown.add(key)
+                instances.append(record)
+
+        header = ""
+        if len(summary) > 0:
+            header = "matches:\n" + "\n".join(summary)
+
+        notes = []
+        if len(not_found) > 0:
+            where = ""
+            if searched > 1:
+                where = f" in {searched} regions"
+            notes.append(f"no instance found for {', '.join(not_found)}{where}")
+
+        if len(failed) > 0:
+            notes.append(f"{len(failed)} regions failed: " + ", ".join(failed))
+
+        if inventory is not None:
+            notes.append(inventory.note())
+
+        return ToolResult(
+            instances,
+            render=self._format,
+            header=header,
+            notes=notes,
+            summarize=self._summarize,
+            separator="\n\n",
+            noun="instances"
+        )
+
+    async def _arun(self, query: str, region: str = "", refresh: bool = False):
+        # boto3 is blocking, run it on a worker thread so other tools keep going
+        return await asyncio.to_thread(self._run, query, region, refresh)
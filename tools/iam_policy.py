@@ -0,0 +1,274 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+from pydantic import BaseModel
+
+
+class GroupBindings(BaseModel):
+    name: str
+    attached: list = []   # [(policy name, policy arn)]
+    inline: list = []     # [(policy name, policy document)]
+
+
+class UserBindings(BaseModel):
+    """everything attached to a user, directly or through groups"""
+    username: str
+    attached: list = []
+    inline: list = []
+    groups: list = []
+    boundary_arn: Optional[str] = None
+
+    def managed_arns(self):
+        arns = [arn for name, arn in self.attached]
+        for group in self.groups:
+            arns.extend(arn for name, arn in group.attached)
+        if self.boundary_arn:
+            arns.append(self.boundary_arn)
+        return list(dict.fromkeys(arns))
+
+
+class CompiledStatement(NamedTuple):
+    effect: str
+    services: tuple
+    actions: tuple
+    not_actions: tuple
+    resources: tuple
+    not_resources: tuple
+    has_condition: bool
+    source: str
+
+
+def as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return list(value)
+
+
+def wildcard(pattern, ignore_case=False):
+    """iam style * and ? wildcards as a compiled regex"""
+    regex = '^' + re.escape(pattern).replace('\\*', '.*').replace('\\?', '.') + '$'
+    flags = re.IGNORECASE if ignore_case else 0
+    return re.compile(regex, flags)
+
+
+def compile_document(document, source):
+    """turns a policy document into CompiledStatements"""
+    statements = document.get('Statement', [])
+    if isinstance(statements, dict):
+        statements = [statements]
+
+    compiled = []
+    for stmt in statements:
+        compiled.append(CompiledStatement(
+            effect=stmt.get('Effect', 'Allow'),
+            services=services_of(stmt),
+            actions=tuple(wildcard(a, True) for a in as_list(stmt.get('Action'))),
+            not_actions=tuple(wildcard(a, True) for a in as_list(stmt.get('NotAction'))),
+            resources=tuple(wildcard(r) for r in as_list(stmt.get('Resource'))),
+            not_resources=tuple(wildcard(r) for r in as_list(stmt.get('NotResource'))),
+            has_condition=bool(stmt.get('Condition')),
+            source=source
+        ))
+    return compiled
+
+
+def services_of(stmt):
+    """the services a statement can apply to, empty when it could be any"""
+    if stmt.get('NotAction') or not stmt.get('Action'):
+        return ()
+    services = set()
+    for action in as_list(stmt.get('Action')):
+        prefix = action.split(':', 1)[0].lower()
+        if ':' not in action or '*' in prefix or '?' in prefix:
+            return ()
+        services.add(prefix)
+    return tuple(sorted(services))
+
+
+def action_matches(stmt, action):
+    if stmt.not_actions:
+        return not any(p.match(action) for p in stmt.not_actions)
+    return any(p.match(action) for p in stmt.actions)
+
+
+def resource_matches(stmt, resource):
+    # no resource given means "on anything at all"
+    if resource is None:
+        if stmt.effect == 'Deny':
+            return any(p.match('*') for p in stmt.resources) and not stmt.not_resources
+        return True
+    if stmt.not_resources:
+        return not any(p.match(resource) for p in stmt.not_resources)
+    return any(p.match(resource) for p in stmt.resources)
+
+
+class Decision(NamedTuple):
+    allowed: bool
+    reason: str
+    conditional: bool
+
+
+class PermissionSet:
+    """a users compiled statements, indexed by service so a check only looks
+    at the few statements that could match
+
+    explicit deny beats allow, in the users policies or the permissions
+    boundary, and with a boundary the action also has to be allowed by it.
+    conditions are not evaluated, statements with conditions are flagged in
+    the answer instead.
+    """
+
+    def __init__(self, statements, boundary=None):
+        self.by_service = {}
+        self.any_service = []
+        for stmt in statements:
+            if len(stmt.services) == 0:
+                self.any_service.append(stmt)
+            for service in stmt.services:
+                self.by_service.setdefault(service, []).append(stmt)
+        self.boundary = boundary
+        self.statement_count = len(statements)
+
+    def _candidates(self, action):
+        service = action.split(':', 1)[0].lower()
+        return self.by_service.get(service, []) + self.any_service
+
+    def evaluate(self, action, resource=None):
+        matched = [
+            s for s in self._candidates(action)
+            if action_matches(s, action) and resource_matches(s, resource)
+        ]
+
+        denies = [s for s in matched if s.effect == 'Deny']
+        allows = [s for s in matched if s.effect == 'Allow']
+
+        unconditional_denies = [s for s in denies if not s.has_condition]
+        if unconditional_denies:
+            return Decision(False, f"explicitly denied by {unconditional_denies[0].source}", False)
+
+        # a deny in the boundary is as final as one in the users own policies
+        boundary_denies = []
+        boundary_allows = []
+        if self.boundary is not None:
+            in_boundary = [s for s in self.boundary if action_matches(s, action) and resource_matches(s, resource)]
+            boundary_denies = [s for s in in_boundary if s.effect == 'Deny']
+            boundary_allows = [s for s in in_boundary if s.effect == 'Allow']
+            if any(not s.has_condition for s in boundary_denies):
+                return Decision(False, "explicitly denied by the permissions boundary", False)
+
+        if len(allows) == 0:
+            return Decision(False, "no policy allows it (implicit deny)", False)
+
+        if self.boundary is not None and len(boundary_allows) == 0:
+            return Decision(False, "allowed by policy but blocked by the permissions boundary", False)
+
+        conditional = (
+            all(s.has_condition for s in allows) or len(denies) > 0 or len(boundary_denies) > 0
+            or (self.boundary is not None and all(s.has_condition for s in boundary_allows))
+        )
+        sources = ", ".join(dict.fromkeys(s.source for s in allows))
+        reason = f"allowed by {sources}"
+        if conditional:
+            reason = reason + " (depends on policy conditions, not checked here)"
+        return Decision(True, reason, conditional)
+
+
+def build_permissions(bindings, documents):
+    """PermissionSet for a user from their bindings and {arn: document}"""
+    statements = []
+
+    for name, arn in bindings.attached:
+        if arn in documents:
+            statements.extend(compile_document(documents[arn], f"managed policy {name}"))
+    for name, document in bindings.inline:
+        statements.extend(compile_document(document, f"inline policy {name}"))
+    for group in bindings.groups:
+        for name, arn in group.attached:
+            if arn in documents:
+                statements.extend(compile_document(documents[arn], f"managed policy {name} (group {group.name})"))
+        for name, document in group.inline:
+            statements.extend(compile_document(document, f"inline policy {name} (group {group.name})"))
+
+    boundary = None
+    if bindings.boundary_arn and bindings.boundary_arn in documents:
+        boundary = compile_document(documents[bindings.boundary_arn], "permissions boundary")
+
+    return PermissionSet(statements, boundary)
+
+
+class PolicyFetcher:
+    """pulls a users bindings and policy documents from iam, in parallel
+
+    managed policy documents are cached by arn and default version, so a
+    policy shared by a hundred users is only downloaded once per version
+    """
+
+    def __init__(self, iam, cache, max_workers=8):
+        self.iam = iam
+        self.cache = cache
+        self.max_workers = max_workers
+
+    def _list(self, method, result_key, refresh, **params):
+        return self.cache.call_paginated('iam', self.iam, method, result_key, refresh=refresh, **params)
+
+    def _inline_document(self, getter, name, refresh, **params):
+        response = self.cache.call('iam', self.iam, getter, refresh=refresh, PolicyName=name, **params)
+        return name, response['PolicyDocument']
+
+    def _group(self, group_name, refresh):
+        # runs on a pool worker, so it does its own calls one after another
+        # instead of waiting on the pool it is running in
+        attached = self._list('list_attached_group_policies', 'AttachedPolicies', refresh, GroupName=group_name)
+        inline_names = self._list('list_group_policies', 'PolicyNames', refresh, GroupName=group_name)
+        inline = [self._inline_document('get_group_policy', name, refresh, GroupName=group_name) for name in inline_names]
+        return GroupBindings(
+            name=group_name,
+            attached=[(p['PolicyName'], p['PolicyArn']) for p in attached],
+            inline=inline
+        )
+
+    def bindings(self, username, refresh=False):
+        # raises if the user doesnt exist
+        user = self.cache.call('iam', self.iam, 'get_user', refresh=refresh, UserName=username)['User']
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            attached = pool.submit(self._list, 'list_attached_user_policies', 'AttachedPolicies', refresh, UserName=username)
+            inline_names = pool.submit(self._list, 'list_user_policies', 'PolicyNames', refresh, UserName=username)
+            groups = pool.submit(self._list, 'list_groups_for_user', 'Groups', refresh, UserName=username)
+
+            inline_futures = [
+                pool.submit(self._inline_document, 'get_user_policy', name, refresh, UserName=username)
+                for name in inline_names.result()
+            ]
+
+            # every group at the same time
+            group_futures = [pool.submit(self._group, g['GroupName'], refresh) for g in groups.result()]
+
+            return UserBindings(
+                username=username,
+                attached=[(p['PolicyName'], p['PolicyArn']) for p in attached.result()],
+                inline=[f.result() for f in inline_futures],
+                groups=[f.result() for f in group_futures],
+                boundary_arn=user.get('PermissionsBoundary', {}).get('PermissionsBoundaryArn')
+            )
+
+    def document(self, arn, refresh=False):
+        policy = self.cache.call('iam', self.iam, 'get_policy', refresh=refresh, PolicyArn=arn)['Policy']
+        version = policy['DefaultVersionId']
+
+        def load():
+            response = self.iam.get_policy_version(PolicyArn=arn, VersionId=version)
+            return response['PolicyVersion']['Document']
+
+        # versions never change, so the document can be kept a long time
+        return self.cache.get_or_load('iam_policy', f"{arn}/{version}", load)
+
+    def documents(self, arns, refresh=False):
+        if len(arns) == 0:
+            return {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {arn: pool.submit(self.document, arn, refresh) for arn in arns}
+            return {arn: future.result() for arn, future in futures.items()}
@@ -0,0 +1,226 @@
+import gzip
+import json
+import os
+import threading
+import time
+import urllib.parse
+
+from tools.aws_clients import get_clients
+from tools.cache import get_cache
+from tools.iam_policy import GroupBindings, UserBindings
+
+
+def as_document(document):
+    # boto3 decodes these already, older botocore hands back the url encoded json
+    if isinstance(document, str):
+        return json.loads(urllib.parse.unquote(document))
+    return document
+
+
+def default_document(policy):
+    for version in policy.get('PolicyVersionList', []):
+        if version.get('IsDefaultVersion'):
+            return as_document(version['Document'])
+    return None
+
+
+class IAMSnapshot:
+    """the whole accounts iam from get_account_authorization_details
+
+    users, groups and roles only keep names and arns, every managed policy
+    document is stored once by arn no matter how many users it is attached to.
+    """
+
+    def __init__(self, account, users, groups, roles, policies, taken_at=None):
+        self.account = account
+        self.users = users        # {name: {'attached', 'inline', 'groups', 'boundary'}}
+        self.groups = groups      # {name: {'attached', 'inline'}}
+        self.roles = roles        # {name: {'attached', 'inline', 'boundary'}}
+        self.policies = policies  # {arn: default version document}
+        self.taken_at = taken_at or time.time()
+
+    @classmethod
+    def from_pages(cls, account, pages):
+        users = {}
+        groups = {}
+        roles = {}
+        policies = {}
+
+        def attached(entry):
+            return [(p['PolicyName'], p['PolicyArn']) for p in entry.get('AttachedManagedPolicies', [])]
+
+        def inline(entry, key):
+            return [(p['PolicyName'], as_document(p['PolicyDocument'])) for p in entry.get(key, [])]
+
+        def boundary(entry):
+            return entry.get('PermissionsBoundary', {}).get('PermissionsBoundaryArn')
+
+        for page in pages:
+            for user in page.get('UserDetailList', []):
+                users[user['UserName']] = {
+                    'attached': attached(user),
+                    'inline': inline(user, 'UserPolicyList'),
+                    'groups': list(user.get('GroupList', [])),
+                    'boundary': boundary(user)
+                }
+            for group in page.get('GroupDetailList', []):
+                groups[group['GroupName']] = {
+                    'attached': attached(group),
+                    'inline': inline(group, 'GroupPolicyList')
+                }
+            for role in page.get('RoleDetailList', []):
+                roles[role['RoleName']] = {
+                    'attached': attached(role),
+                    'inline': inline(role, 'RolePolicyList'),
+                    'boundary': boundary(role)
+                }
+            for policy in page.get('Policies', []):
+                document = default_document(policy)
+                if document is not None:
+                    policies[policy['Arn']] = document
+
+        return cls(account, users, groups, roles, policies)
+
+    def bindings(self, name):
+        """UserBindings for a user, or for a role when no user has that name"""
+        user = self.users.get(name)
+        if user is not None:
+            groups = []
+            for group_name in user['groups']:
+                group = self.groups.get(group_name, {'attached': [], 'inline': []})
+                groups.append(GroupBindings(name=group_name, attached=group['attached'], inline=group['inline']))
+            return UserBindings(
+                username=name,
+                attached=user['attached'],
+                inline=user['inline'],
+                groups=groups,
+                boundary_arn=user['boundary']
+            )
+
+        role = self.roles.get(name)
+        if role is not None:
+            return UserBindings(
+                username=name,
+                attached=role['attached'],
+                inline=role['inline'],
+                boundary_arn=role['boundary']
+            )
+
+        return None
+
+    def documents(self, arns):
+        return {arn: self.policies[arn] for arn in arns if arn in self.policies}
+
+    def age(self):
+        return time.time() - self.taken_at
+
+    def summary(self):
+        return f"{len(self.users)} users, {len(self.groups)} groups, {len(self.roles)} roles, {len(self.policies)} policies"
+
+    def save(self, path):
+        data = {
+            'account': self.account,
+            'taken_at': self.taken_at,
+            'users': self.users,
+            'groups': self.groups,
+            'roles': self.roles,
+            'policies': self.policies
+        }
+        # write next to it and rename so a crash never leaves half a file
+        tmp = f"{path}.tmp"
+        with gzip.open(tmp, 'wt') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, 'rt') as f:
+            data = json.load(f)
+
+        def pairs(entries):
+            # json turns the (name, arn) tuples into lists
+            for entry in entries.values():
+                entry['attached'] = [tuple(p) for p in entry['attached']]
+                entry['inline'] = [tuple(p) for p in entry['inline']]
+            return entries
+
+        return cls(
+            data['account'],
+            pairs(data['users']),
+            pairs(data['groups']),
+            pairs(data['roles']),
+            data['policies'],
+            data['taken_at']
+        )
+
+
+class SnapshotStore:
+    """keeps one IAMSnapshot per account, taken again every interval seconds
+
+    with a path the snapshot is also written to disk and read back on the
+    next start, so a restart doesnt have to pull the whole account again
+    """
+
+    def __init__(self, clients=None, cache=None, path=None, interval=3600):
+        self.clients = clients
+        self.cache = cache
+        self.path = path
+        self.interval = interval
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def _take(self, account):
+        clients = self.clients or get_clients()
+        iam = clients.client('iam')
+        paginator = iam.get_paginator('get_account_authorization_details')
+        pages = paginator.paginate(PaginationConfig={'PageSize': 1000})
+        return IAMSnapshot.from_pages(account, pages)
+
+    def _from_disk(self, account):
+        if not self.path or not os.path.exists(self.path):
+            return None
+        try:
+            snapshot = IAMSnapshot.load(self.path)
+        except Exception:
+            return None
+        if snapshot.account != account:
+            return None
+        return snapshot
+
+    def get(self, refresh=False):
+        account = (self.cache or get_cache()).account_id(self.clients)
+
+        # one caller pulls the account, the rest wait for it instead of
+        # all hitting get_account_authorization_details at once
+        with self._lock:
+            snapshot = self._snapshots.get(account)
+            if snapshot is None and not refresh:
+                snapshot = self._from_disk(account)
+
+            if refresh or snapshot is None or snapshot.age() > self.interval:
+                snapshot = self._take(account)
+                if self.path:
+                    snapshot.save(self.path)
+
+            self._snapshots[account] = snapshot
+            return snapshot
+
+
+_default_store = None
+_default_lock = threading.Lock()
+
+
+def get_snapshot_store():
+    """the process wide store when CHATBOT_IAM_SNAPSHOT=1, otherwise None"""
+    global _default_store
+
+    if os.getenv('CHATBOT_IAM_SNAPSHOT') != '1':
+        return None
+
+    with _default_lock:
+        if _default_store is None:
+            _default_store = SnapshotStore(
+                path=os.getenv('CHATBOT_IAM_SNAPSHOT_FILE') or None,
+                interval=int(os.getenv('CHATBOT_IAM_SNAPSHOT_INTERVAL', '3600'))
+            )
+        return _default_store
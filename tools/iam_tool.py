@@ -1,81 +1,139 @@
-import boto3
+import asyncio
+from typing import Optional
 from langchain_core.tools import BaseTool
 from pydantic import BaseModel, Field
 
+from tools.aws_clients import ClientFactory, get_clients
+from tools.cache import ResourceCache, get_cache
+from tools.iam_policy import PolicyFetcher, build_permissions
+from tools.iam_snapshot import SnapshotStore, get_snapshot_store
+from tools.inventory import Inventory, get_inventory
+
 class IAMUserInput(BaseModel):
     username: str = Field(description="username")
+    action: str = Field(default="", description="optional actions to check, like s3:PutObject, several separated by commas")
+    resource: str = Field(default="", description="optional resource arn the actions are checked against, empty for any resource")
+    refresh: bool = Field(default=False, description="true to skip cached data and ask aws again")
 
 
 class GetIAMUserPermissionsTool(BaseTool):
     name: str = "get_iam_user_permissions"
-    description: str = "checks iam permissions for a user"
+    description: str = "checks iam permissions for a user, lists their policies or checks if they can do specific actions"
     args_schema: type[BaseModel] = IAMUserInput
+    cache: Optional[ResourceCache] = None
+    clients: Optional[ClientFactory] = None
+    snapshots: Optional[SnapshotStore] = None
+    inventory: Optional[Inventory] = None
     
-    def _run(self, username: str) -> str:
+    def _permissions(self, fetcher, bindings, refresh=False, snapshot=None):
+        """compiled permissions for the user, kept in the cache so repeat checks dont refetch"""
         
-        iam = boto3.client('iam')
+        cache = self.cache or get_cache()
         
-        # check user exists
-        try:
-            user = iam.get_user(UserName=username)
-        except:
-            return f"user {username} not found"
+        def load():
+            arns = bindings.managed_arns()
+            documents = {}
+            if snapshot is not None:
+                documents = snapshot.documents(arns)
+            # aws managed policies nobody uses can be missing from a snapshot
+            missing = [arn for arn in arns if arn not in documents]
+            documents.update(fetcher.documents(missing, refresh))
+            return build_permissions(bindings, documents)
         
+        key = f"{cache.account_id(self.clients)}/permissions/{bindings.username}"
+        if snapshot is not None:
+            # a new snapshot means new answers
+            key = f"{key}/{snapshot.taken_at}"
+        return cache.get_or_load('iam', key, load, refresh)
+    
+    def _run(self, username: str, action: str = "", resource: str = "", refresh: bool = False) -> str:
         
-        output = f"permissions for {username}:\n\n"
+        cache = self.cache or get_cache()
+        clients = self.clients or get_clients()
+        iam = clients.client('iam')
+        fetcher = PolicyFetcher(iam, cache)
+        store = self.snapshots or get_snapshot_store()
+        snapshot = None
         
+        inventory = None
+        if not refresh:
+            inventory = self.inventory or get_inventory(cache.account_id(self.clients))
+            if inventory is not None and not inventory.has('iam'):
+                inventory = None
         
+        # check user exists
         try:
-            policies_response = iam.list_attached_user_policies(UserName=username)
-            policies = policies_response['AttachedPolicies']
+            if inventory is not None:
+                # the inventory file has the same bindings and documents
+                snapshot = inventory
+                bindings = snapshot.bindings(username)
+                if bindings is None:
+                    return f"user {username} not found"
+            elif store is not None:
+                # whole account in one go, every user after that is free
+                snapshot = store.get(refresh)
+                bindings = snapshot.bindings(username)
+                if bindings is None:
+                    return f"user {username} not found"
+            else:
+                bindings = fetcher.bindings(username, refresh)
+        except Exception as e:
+            if "NoSuchEntity" in str(e):
+                return f"user {username} not found"
+            return f"error getting iam user {username}: {e}"
+        
+        if action.strip():
+            permissions = self._permissions(fetcher, bindings, refresh, snapshot)
+            target = resource.strip() or None
+            
+            output = f"permission check for {username}"
+            if target:
+                output = output + f" on {target}"
+            output = output + ":\n"
+            
+            for one_action in [a.strip() for a in action.split(',') if a.strip()]:
+                decision = permissions.evaluate(one_action, target)
+                verdict = "ALLOWED" if decision.allowed else "DENIED"
+                output = output + f"- {one_action}: {verdict}, {decision.reason}\n"
             
-            if len(policies) > 0:
-                output = output + "managed policies:\n"
-                for policy in policies:
-                    policy_name = policy['PolicyName']
-                    policy_arn = policy['PolicyArn']
-                    output = output + f"- {policy_name} ({policy_arn})\n"
-        except:
-            pass
+            if inventory is not None:
+                output = output + inventory.note()
+            return output.strip()
         
         
-        try:
-            inline_response = iam.list_user_policies(UserName=username)
-            inline_policies = inline_response['PolicyNames']
-            
-            if len(inline_policies) > 0:
-                output = output + "\ninline policies:\n"
-                for policy_name in inline_policies:
-                    output = output + f"- {policy_name}\n"
-        except:
-            pass
+        output = f"permissions for {username}:\n\n"
+        
+        if len(bindings.attached) > 0:
+            output = output + "managed policies:\n"
+            for policy_name, policy_arn in bindings.attached:
+                output = output + f"- {policy_name} ({policy_arn})\n"
+        
+        if len(bindings.inline) > 0:
+            output = output + "\ninline policies:\n"
+            for policy_name, document in bindings.inline:
+                output = output + f"- {policy_name}\n"
         
         # groups
-        try:
-            groups_response = iam.list_groups_for_user(UserName=username)
-            groups = groups_response['Groups']
-            
-            if len(groups) > 0:
-                output = output + "\ngroups:\n"
-                for group in groups:
-                    group_name = group['GroupName']
-                    output = output + f"- {group_name}\n"
-                    
-                    
-                    try:
-                        group_policies = iam.list_attached_group_policies(GroupName=group_name)
-                        for policy in group_policies['AttachedPolicies']:
-                            output = output + f"  -> {policy['PolicyName']}\n"
-                    except:
-                        pass
-        except:
-            pass
+        if len(bindings.groups) > 0:
+            output = output + "\ngroups:\n"
+            for group in bindings.groups:
+                output = output + f"- {group.name}\n"
+                for policy_name, policy_arn in group.attached:
+                    output = output + f"  -> {policy_name}\n"
+                for policy_name, document in group.inline:
+                    output = output + f"  -> {policy_name} (inline)\n"
+        
+        if bindings.boundary_arn:
+            output = output + f"\npermissions boundary: {bindings.boundary_arn}\n"
         
         
         if output == f"permissions for {username}:\n\n":
             return f"{username} has no permissions"
         
+        if inventory is not None:
+            output = output + "\n" + inventory.note() + "\n"
         return output
     
-    def _arun(self, username: str) -> str:
-        return self._run(username)
+    async def _arun(self, username: str, action: str = "", resource: str = "", refresh: bool = False) -> str:
+        # boto3 is blocking, run it on a worker thread so other tools keep going
+        return await asyncio.to_thread(self._run, username, action, resource, refresh)
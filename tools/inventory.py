@@ -0,0 +1,436 @@
+import ipaddress
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from tools.ec2_index import InstanceRecord
+from tools.iam_policy import GroupBindings, UserBindings
+from tools.sg_index import Rule
+
+
+class BucketRecord(NamedTuple):
+    name: str
+    public: bool
+    reason: str
+    file_count: int
+    total_size: int
+    complete: bool
+
+
+class GroupRecord(NamedTuple):
+    group_id: str
+    name: str
+    description: str
+    vpc_id: str
+    region: str
+
+
+SCHEMA = """
+create table meta (key text primary key, value text);
+
+create table buckets (name text primary key, public integer, reason text, file_count integer, total_size integer, complete integer);
+create index buckets_public on buckets (public);
+
+create table instances (row integer primary key, instance_id text, instance_type text, state text, name text collate nocase, region text);
+create index instances_id on instances (instance_id);
+create index instances_name on instances (name);
+create table instance_ips (row integer, ip text, ip_number integer, public integer);
+create index instance_ips_ip on instance_ips (ip);
+create index instance_ips_number on instance_ips (ip_number);
+create table instance_tags (row integer, key text collate nocase, value text collate nocase);
+create index instance_tags_pair on instance_tags (key, value);
+
+create table security_groups (group_id text, name text, description text, vpc_id text, region text);
+create index security_groups_id on security_groups (group_id);
+create table sg_rules (group_id text, direction text, protocol text, from_port integer, to_port integer, cidr text, peer text, description text, region text, net_start integer, net_end integer);
+create index sg_rules_group on sg_rules (group_id);
+create index sg_rules_peer on sg_rules (peer);
+create index sg_rules_net on sg_rules (net_start, net_end);
+
+create table iam_principals (name text, kind text, boundary text);
+create index iam_principals_name on iam_principals (name);
+create table iam_members (group_name text, user_name text);
+create index iam_members_user on iam_members (user_name);
+create table iam_attached (principal text, kind text, policy_name text, policy_arn text);
+create index iam_attached_principal on iam_attached (principal, kind);
+create index iam_attached_arn on iam_attached (policy_arn);
+create table iam_inline (principal text, kind text, policy_name text, document text);
+create index iam_inline_principal on iam_inline (principal, kind);
+create table iam_policies (arn text primary key, document text);
+
+-- every managed policy a user gets, directly or through a group
+create view iam_user_policies as
+    select principal as user_name, 'direct' as via, policy_name, policy_arn from iam_attached where kind = 'user'
+    union all
+    select m.user_name, 'group ' || m.group_name, a.policy_name, a.policy_arn
+    from iam_members m join iam_attached a on a.principal = m.group_name and a.kind = 'group';
+"""
+
+# sqlite integers are 64 bit, ipv6 addresses dont fit and are matched in python
+MAX_SQL_INT = 2 ** 63 - 1
+
+# most ? placeholders in one statement on older sqlite builds
+CHUNK = 500
+
+
+def ip_number(ip):
+    number = int(ipaddress.ip_address(ip))
+    if number > MAX_SQL_INT:
+        return None
+    return number
+
+
+def network_range(cidr):
+    """(first, last) address of a block as integers, None for ipv6"""
+    network = ipaddress.ip_network(cidr, strict=False)
+    if network.version != 4:
+        return None
+    return int(network.network_address), int(network.broadcast_address)
+
+
+def write_inventory(path, account, buckets, instances, groups, rules, iam, failed=(), parts=(), regions=(), all_regions=False):
+    """writes the collected records to a new sqlite file at path
+
+    parts names the parts that were collected whole ('buckets', 'instances',
+    'security_groups', 'iam'), the tools only trust those. regions are the
+    regions instances and security groups were collected in, all_regions
+    says that was every enabled region. the file is built next to path and
+    renamed over it, readers of the old one keep their open copy until they
+    reopen
+    """
+    tmp = f"{path}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+    db = sqlite3.connect(tmp)
+    try:
+        db.executescript(SCHEMA)
+
+        db.executemany("insert into meta values (?, ?)", [
+            ('account', account),
+            ('taken_at', str(time.time())),
+            ('failed', json.dumps(list(failed))),
+            ('parts', json.dumps(list(parts))),
+            ('regions', json.dumps(list(regions))),
+            ('all_regions', json.dumps(all_regions))
+        ])
+
+        db.executemany(
+            "insert into buckets values (?, ?, ?, ?, ?, ?)",
+            [(b.name, int(b.public), b.reason, b.file_count, b.total_size, int(b.complete)) for b in buckets]
+        )
+
+        for row, record in enumerate(instances):
+            db.execute(
+                "insert into instances values (?, ?, ?, ?, ?, ?)",
+                (row, record.instance_id, record.instance_type, record.state, record.name, record.region)
+            )
+            db.executemany(
+                "insert into instance_ips values (?, ?, ?, ?)",
+                [(row, ip, ip_number(ip), 0) for ip in record.private_ips] +
+                [(row, ip, ip_number(ip), 1) for ip in record.public_ips]
+            )
+            db.executemany("insert into instance_tags values (?, ?, ?)", [(row, k, v) for k, v in record.tags])
+
+        db.executemany("insert into security_groups values (?, ?, ?, ?, ?)", groups)
+
+        sg_rows = []
+        for rule in rules:
+            start, end = None, None
+            if rule.cidr:
+                span = network_range(rule.cidr)
+                if span is not None:
+                    start, end = span
+            sg_rows.append(tuple(rule) + (start, end))
+        db.executemany("insert into sg_rules values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", sg_rows)
+
+        if iam is not None:
+            write_iam(db, iam)
+
+        db.commit()
+    finally:
+        db.close()
+
+    os.replace(tmp, path)
+
+
+def write_iam(db, iam):
+    for kind, entries in (('user', iam.users), ('group', iam.groups), ('role', iam.roles)):
+        for name, entry in entries.items():
+            db.execute("insert into iam_principals values (?, ?, ?)", (name, kind, entry.get('boundary')))
+            db.executemany(
+                "insert into iam_attached values (?, ?, ?, ?)",
+                [(name, kind, policy_name, arn) for policy_name, arn in entry['attached']]
+            )
+            db.executemany(
+                "insert into iam_inline values (?, ?, ?, ?)",
+                [(name, kind, policy_name, json.dumps(document)) for policy_name, document in entry['inline']]
+            )
+            for group_name in entry.get('groups', []):
+                db.execute("insert into iam_members values (?, ?)", (group_name, name))
+
+    db.executemany("insert into iam_policies values (?, ?)", [(arn, json.dumps(doc)) for arn, doc in iam.policies.items()])
+
+
+class Inventory:
+    """read only view of an inventory file, the tools answer from it instead of aws
+
+    lookups are indexed sql queries on a memory mapped sqlite file, so
+    nothing is loaded up front and a large account costs no more memory
+    than a small one. ips and cidr blocks are stored as integer ranges so
+    "which instances are in 10.0.0.0/8" and "which rules allow 1.2.3.4" are
+    range scans. it also works as an iam snapshot for the iam tool
+    (bindings, documents and taken_at).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._db.execute("pragma mmap_size = 268435456")
+        self._lock = threading.Lock()
+
+        meta = dict(self._query("select key, value from meta"))
+        self.account = meta['account']
+        self.taken_at = float(meta['taken_at'])
+        self.failed = json.loads(meta.get('failed') or '[]')
+        self.parts = set(json.loads(meta.get('parts') or '[]'))
+        self.regions = set(json.loads(meta.get('regions') or '[]'))
+        self.all_regions = json.loads(meta.get('all_regions') or 'false')
+
+    def _query(self, sql, params=()):
+        # one connection shared by the tool threads
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _chunked(self, sql, values, params=()):
+        """runs sql with `in ({})` filled by values, a chunk at a time"""
+        rows = []
+        values = list(values)
+        for i in range(0, len(values), CHUNK):
+            chunk = values[i:i + CHUNK]
+            placeholders = ", ".join("?" * len(chunk))
+            rows.extend(self._query(sql.format(placeholders), tuple(params) + tuple(chunk)))
+        return rows
+
+    def has(self, part):
+        """true when the part was collected whole, an empty table otherwise means nothing"""
+        return part in self.parts
+
+    def covers(self, part, region):
+        """true when the part was collected whole for region, 'all' for every region"""
+        if not self.has(part):
+            return False
+        if region == 'all':
+            return self.all_regions
+        return region in self.regions
+
+    def age(self):
+        return time.time() - self.taken_at
+
+    def age_text(self):
+        minutes = int(self.age() // 60)
+        if minutes < 60:
+            return f"{minutes} minutes ago"
+        if minutes < 48 * 60:
+            return f"{minutes // 60} hours ago"
+        return f"{minutes // (24 * 60)} days ago"
+
+    def note(self):
+        return f"(from the inventory snapshot taken {self.age_text()}, say refresh for live data)"
+
+    def counts(self):
+        counts = {}
+        for table in ('buckets', 'instances', 'security_groups', 'sg_rules', 'iam_principals', 'iam_policies'):
+            counts[table] = self._query(f"select count(*) from {table}")[0][0]
+        return counts
+
+    def summary(self):
+        c = self.counts()
+        text = (
+            f"{c['buckets']} buckets, {c['instances']} instances, {c['security_groups']} security groups "
+            f"with {c['sg_rules']} rules, {c['iam_principals']} iam users/groups/roles, {c['iam_policies']} policies"
+        )
+        if len(self.failed) > 0:
+            text = text + "\nfailed: " + "; ".join(self.failed)
+        missing = [part for part in ('buckets', 'instances', 'security_groups', 'iam') if part not in self.parts]
+        if len(missing) > 0:
+            text = text + "\nthese come from aws instead: " + ", ".join(missing)
+        return text
+
+    # s3
+
+    def buckets(self):
+        rows = self._query("select name, public, reason, file_count, total_size, complete from buckets order by name")
+        return [BucketRecord(name, bool(public), reason, count, size, bool(complete)) for name, public, reason, count, size, complete in rows]
+
+    # ec2
+
+    def _instance_records(self, rows):
+        rows = list(dict.fromkeys(rows))
+        if len(rows) == 0:
+            return []
+
+        ips = {}
+        for row, ip, public in self._chunked("select row, ip, public from instance_ips where row in ({}) order by rowid", rows):
+            ips.setdefault((row, public), []).append(ip)
+        tags = {}
+        for row, key, value in self._chunked("select row, key, value from instance_tags where row in ({}) order by rowid", rows):
+            tags.setdefault(row, []).append((key, value))
+
+        records = {}
+        sql = "select row, instance_id, instance_type, state, name, region from instances where row in ({})"
+        for row, instance_id, instance_type, state, name, region in self._chunked(sql, rows):
+            records[row] = InstanceRecord(
+                instance_id=instance_id,
+                instance_type=instance_type,
+                state=state,
+                name=name,
+                private_ips=tuple(ips.get((row, 0), [])),
+                public_ips=tuple(ips.get((row, 1), [])),
+                region=region,
+                tags=tuple(tags.get(row, []))
+            )
+        return [records[row] for row in rows if row in records]
+
+    def instances(self, kind, value, region=None):
+        """instance records for one parsed query term, like the instance index"""
+        if kind == 'ip':
+            rows = self._query("select row from instance_ips where ip = ?", (value,))
+        elif kind == 'id':
+            rows = self._query("select row from instances where instance_id = ?", (value,))
+        elif kind == 'tag':
+            rows = self._query("select row from instance_tags where key = ? and value = ?", value)
+        elif kind == 'cidr':
+            span = network_range(value)
+            if span is not None:
+                rows = self._query("select row from instance_ips where ip_number between ? and ? order by row", span)
+            else:
+                network = ipaddress.ip_network(value, strict=False)
+                rows = [
+                    (row,) for row, ip in self._query("select row, ip from instance_ips where ip like '%:%'")
+                    if ipaddress.ip_address(ip) in network
+                ]
+        elif '*' in value or '?' in value:
+            rows = self._query("select row from instances where lower(name) glob ?", (value.lower(),))
+        else:
+            rows = self._query("select row from instances where name = ?", (value,))
+
+        records = self._instance_records(row for row, in rows)
+        if region is not None:
+            records = [r for r in records if r.region == region]
+        return records
+
+    # security groups
+
+    def rules(self, group_id='', source='', port=None, protocol='', region=None):
+        """[(Rule, group name)] of inbound rules, the same questions the rule index answers"""
+        where = ["r.direction = 'in'"]
+        params = []
+        network = None
+
+        if source.startswith('sg-'):
+            where.append("r.peer = ?")
+            params.append(source)
+        elif source:
+            network = ipaddress.ip_network(source, strict=False)
+            span = network_range(source)
+            if span is not None:
+                # the rules range has to hold the whole source
+                where.append("r.net_start <= ? and r.net_end >= ?")
+                params.extend(span)
+            else:
+                where.append("r.cidr like '%:%'")
+        if group_id:
+            where.append("r.group_id = ?")
+            params.append(group_id)
+        if port is not None:
+            where.append("r.from_port <= ? and r.to_port >= ?")
+            params.extend([port, port])
+        if protocol:
+            where.append("(r.protocol = '-1' or r.protocol = ?)")
+            params.append(protocol)
+        if region is not None:
+            where.append("r.region = ?")
+            params.append(region)
+
+        sql = (
+            "select r.group_id, r.direction, r.protocol, r.from_port, r.to_port, r.cidr, r.peer, r.description, r.region, "
+            "coalesce(g.name, '') from sg_rules r left join security_groups g on g.group_id = r.group_id and g.region = r.region "
+            f"where {' and '.join(where)} order by r.rowid"
+        )
+        matches = []
+        for row in self._query(sql, params):
+            rule = Rule(*row[:9])
+            if network is not None and network.version == 6:
+                rule_network = ipaddress.ip_network(rule.cidr, strict=False)
+                if not network.subnet_of(rule_network):
+                    continue
+            matches.append((rule, row[9]))
+        return matches
+
+    # iam
+
+    def _policies(self, name, kind):
+        attached = self._query("select policy_name, policy_arn from iam_attached where principal = ? and kind = ? order by rowid", (name, kind))
+        inline = self._query("select policy_name, document from iam_inline where principal = ? and kind = ? order by rowid", (name, kind))
+        return [tuple(a) for a in attached], [(policy_name, json.loads(document)) for policy_name, document in inline]
+
+    def bindings(self, name):
+        """UserBindings for a user, or a role when no user has that name"""
+        found = self._query(
+            "select kind, boundary from iam_principals where name = ? and kind in ('user', 'role') order by kind = 'role'",
+            (name,)
+        )
+        if len(found) == 0:
+            return None
+
+        kind, boundary = found[0]
+        attached, inline = self._policies(name, kind)
+
+        groups = []
+        if kind == 'user':
+            for group_name, in self._query("select group_name from iam_members where user_name = ? order by rowid", (name,)):
+                group_attached, group_inline = self._policies(group_name, 'group')
+                groups.append(GroupBindings(name=group_name, attached=group_attached, inline=group_inline))
+
+        return UserBindings(username=name, attached=attached, inline=inline, groups=groups, boundary_arn=boundary)
+
+    def documents(self, arns):
+        rows = self._chunked("select arn, document from iam_policies where arn in ({})", arns)
+        return {arn: json.loads(document) for arn, document in rows}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_inventories = {}
+_inventories_lock = threading.Lock()
+
+
+def get_inventory(account=None) -> Optional[Inventory]:
+    """the inventory at CHATBOT_INVENTORY_DB, None when unset, missing or for another account
+
+    the file is opened again after the snapshot command replaces it
+    """
+    path = os.getenv('CHATBOT_INVENTORY_DB')
+    if not path or not os.path.exists(path):
+        return None
+
+    modified = os.path.getmtime(path)
+    with _inventories_lock:
+        entry = _inventories.get(path)
+        if entry is None or entry[0] != modified:
+            try:
+                entry = (modified, Inventory(path))
+            except sqlite3.Error:
+                return None
+            _inventories[path] = entry
+        inventory = entry[1]
+
+    if account is not None and inventory.account != account:
+        return None
+    return inventory
@@ -0,0 +1,29 @@
+from typing import Optional
+from langchain_core.tools import BaseTool
+from pydantic import BaseModel, Field
+
+from tools.results import PageStore, get_pages
+
+
+class ShowMoreInput(BaseModel):
+    page_id: str = Field(description="the page_id from a tool result that was cut off, like p3")
+
+
+class ShowMoreTool(BaseTool):
+    name: str = "show_more"
+    description: str = "gets the next part of a tool result that was too long to show at once"
+    args_schema: type[BaseModel] = ShowMoreInput
+    pages: Optional[PageStore] = None
+    
+    def _run(self, page_id: str):
+        pages = self.pages or get_pages()
+        
+        result = pages.get(page_id)
+        if result is None:
+            return f"no page {page_id}, ask the original tool again"
+        
+        # the runner cuts this down to the budget again and saves what is left
+        return result
+    
+    async def _arun(self, page_id: str):
+        return self._run(page_id)
@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tools.aws_clients import get_clients
+from tools.cache import get_cache
+
+
+def enabled_regions(cache=None, clients=None, refresh=False):
+    """regions this account can use, from describe_regions, cached for a day"""
+    cache = cache or get_cache()
+    clients = clients or get_clients()
+
+    ec2 = clients.client('ec2')
+    response = cache.call('regions', ec2, 'describe_regions', refresh=refresh)
+    return sorted(r['RegionName'] for r in response['Regions'])
+
+
+def default_region(clients=None):
+    """the region clients go to when none is given, from the profile or env"""
+    clients = clients or get_clients()
+    return clients.client('ec2').meta.region_name
+
+
+def fan_out(regions, fn, max_workers=16, stop_when=None):
+    """runs fn(region) for every region at once
+
+    returns [(region, result, error)] in region order. if stop_when(result)
+    is true for any result the regions still queued are dropped and the
+    answer comes back without waiting for the slow ones.
+    """
+    results = {}
+
+    if len(regions) == 0:
+        return []
+
+    pool = ThreadPoolExecutor(max_workers=min(max_workers, len(regions)))
+    try:
+        futures = {}
+        for region in regions:
+            futures[pool.submit(fn, region)] = region
+
+        for future in as_completed(futures):
+            region = futures[future]
+            try:
+                result = future.result()
+                results[region] = (region, result, None)
+            except Exception as e:
+                results[region] = (region, None, e)
+                continue
+
+            if stop_when is not None and stop_when(result):
+                break
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    return [results[r] for r in regions if r in results]
@@ -0,0 +1,139 @@
+import itertools
+import threading
+from collections import OrderedDict
+
+
+# same rough guess as memory.py, about 4 characters a token
+CHARS_PER_TOKEN = 4
+
+# room kept for the "showing x of y" line
+RESERVED_CHARS = 200
+
+
+class ToolResult:
+    """what a tool found as records, only turned into text when it is sent
+
+    render(record) gives the text for one record. summarize(records), when
+    given, describes the records that didnt fit so the answer still has the
+    totals. notes always go at the end, things like totals and failures.
+    """
+
+    def __init__(self, records, render=str, header="", notes=None, summarize=None, separator="\n", noun="results", offset=0, total=None):
+        self.records = list(records)
+        self.render = render
+        self.header = header
+        self.notes = notes or []
+        self.summarize = summarize
+        self.separator = separator
+        self.noun = noun
+        self.offset = offset
+        self.total = total if total is not None else len(self.records)
+
+    def rest(self, shown):
+        """the records after the first shown, for the next page"""
+        return ToolResult(
+            self.records[shown:],
+            render=self.render,
+            header=f"more {self.noun}:",
+            summarize=self.summarize,
+            separator=self.separator,
+            noun=self.noun,
+            offset=self.offset + shown,
+            total=self.total
+        )
+
+    def __str__(self):
+        return fit(self, None)
+
+
+class PageStore:
+    """results that didnt fit, kept so show_more can hand out the next page"""
+
+    def __init__(self, max_pages=100):
+        self.max_pages = max_pages
+        self._pages = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def save(self, result):
+        with self._lock:
+            page_id = f"p{next(self._ids)}"
+            self._pages[page_id] = result
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+            return page_id
+
+    def get(self, page_id):
+        with self._lock:
+            return self._pages.get(page_id.strip())
+
+
+def fit(result, max_tokens, pages=None):
+    """text for a result in at most about max_tokens
+
+    records are rendered one at a time and only until the budget is used
+    up, so a huge result never gets turned into text in full. whatever is
+    left over is summarized and saved as a page for show_more. plain
+    strings that are too long are paged line by line. max_tokens None
+    means no limit.
+    """
+    if isinstance(result, str):
+        if max_tokens is None or len(result) <= max_tokens * CHARS_PER_TOKEN:
+            return result
+        result = ToolResult(result.splitlines(), noun="lines")
+
+    parts = []
+    if result.header:
+        parts.append(result.header)
+
+    if max_tokens is None:
+        parts.extend(result.render(record) for record in result.records)
+        parts.extend(result.notes)
+        return result.separator.join(parts)
+
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    used = len(result.header) + sum(len(note) for note in result.notes) + RESERVED_CHARS
+    shown = 0
+
+    for record in result.records:
+        text = result.render(record)
+        if used + len(text) + len(result.separator) > max_chars:
+            # always show something, even if the first record has to be cut
+            if shown == 0:
+                room = max(max_chars - used, 100)
+                parts.append(text[:room] + "...(cut)")
+                shown = 1
+            break
+        parts.append(text)
+        used = used + len(text) + len(result.separator)
+        shown = shown + 1
+
+    if shown < len(result.records):
+        hidden = result.records[shown:]
+        if result.summarize is not None:
+            parts.append(result.summarize(hidden))
+
+        first = result.offset + 1
+        last = result.offset + shown
+        more = f"(showing {result.noun} {first}-{last} of {result.total}"
+        if pages is not None:
+            page_id = pages.save(result.rest(shown))
+            more = more + f", call show_more with page_id {page_id} for the next ones"
+        parts.append(more + ")")
+
+    parts.extend(result.notes)
+    return result.separator.join(parts)
+
+
+_default_pages = None
+_default_lock = threading.Lock()
+
+
+def get_pages():
+    """the process wide page store"""
+    global _default_pages
+
+    with _default_lock:
+        if _default_pages is None:
+            _default_pages = PageStore()
+        return _default_pages
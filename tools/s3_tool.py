@@ -1,12 +1,50 @@
-import boto3
+import asyncio
 import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from botocore.exceptions import ClientError
 from langchain_core.tools import BaseTool
 from pydantic import BaseModel, Field
 
+from tools.aws_clients import ClientFactory, get_clients
+from tools.cache import ResourceCache, get_cache
+from tools.inventory import Inventory, get_inventory
+from tools.results import ToolResult
+
 
 
 class S3Input(BaseModel):
     bucket_name: str = Field(default="", description="bucket name or leave empty")
+    refresh: bool = Field(default=False, description="true to skip cached data and ask aws again")
+
+
+
+class BucketInfo(BaseModel):
+    name: str
+    public: bool = False
+    reason: str = ""
+    file_count: int = 0
+    total_size: int = 0
+    complete: bool = True
+    stats_source: str = "listing"
+    error: str = ""               # what couldnt be checked, empty when all went fine
+    public_unknown: bool = False  # the acl or policy check failed
+    listed: bool = True           # false when the object count and size couldnt be read
+
+
+class BucketCheckFailed(Exception):
+    """carries a half checked bucket out of the cache loader so it isnt cached
+
+    result is what the caller still gets back, a BucketInfo or the text of
+    a bucket description
+    """
+
+    def __init__(self, result, error):
+        super().__init__(error)
+        self.result = result
 
 
 
@@ -14,105 +52,417 @@ class S3Tool(BaseTool):
     name: str = "s3_tool"
     description: str = "use this for s3 questions like how many buckets, which are public, whats in a bucket, sizes, etc. put bucket name for specific bucket or leave empty for all"
     args_schema: type[BaseModel] = S3Input
+    max_workers: int = 16
+    bucket_timeout: float = 30.0
+    # the whole scan stops here and answers with what it has, this has to
+    # stay under the tool call timeout or the partial listing is lost
+    scan_timeout: Optional[float] = 60.0
+    max_objects: int = 100000
+    use_cloudwatch: bool = False
+    cache: Optional[ResourceCache] = None
+    clients: Optional[ClientFactory] = None
+    inventory: Optional[Inventory] = None
     
-    def _run(self, bucket_name: str = "") -> str:
+    def _check_public(self, s3, name):
+        """returns (public, reason, error) from the bucket acl and bucket policy
         
-        s3 = boto3.client('s3')
+        error says which check failed, a bucket that looks private with an
+        error might still be public
+        """
+        errors = []
         
+        # check if public (copied from stack overflow)
+        try:
+            acl = s3.get_bucket_acl(Bucket=name)
+            grants = acl['Grants']
+            for grant in grants:
+                grantee = grant['Grantee']
+                if grantee.get('Type') == 'Group':
+                    uri = grantee.get('URI')
+                    if uri and 'AllUsers' in uri:
+                        return True, "acl grants AllUsers", ""
+        except Exception as e:
+            errors.append(f"acl: {e}")
         
-        response = s3.list_buckets()
-        buckets = response['Buckets']
         
+        try:
+            policy_response = s3.get_bucket_policy(Bucket=name)
+            policy_string = policy_response['Policy']
+            policy = json.loads(policy_string)
+            statements = policy['Statement']
+            for stmt in statements:
+                principal = stmt.get('Principal')
+                effect = stmt.get('Effect')
+                if principal == '*' and effect == 'Allow':
+                    return True, "bucket policy allows everyone", ""
+        except ClientError as e:
+            # no policy at all is the normal case
+            if e.response.get('Error', {}).get('Code') != 'NoSuchBucketPolicy':
+                errors.append(f"policy: {e}")
+        except Exception as e:
+            errors.append(f"policy: {e}")
         
-        if bucket_name == "":
-            
-            output = f"you have {len(buckets)} buckets:\n\n"
-            
+        return False, "", "; ".join(errors)
+    
+    def _object_stats(self, s3, name, limit, sample=0):
+        """streams the bucket listing page by page and adds up count and size
+        
+        stops after limit objects so huge buckets dont run forever, only the
+        first `sample` objects are kept. returns (count, size, complete, sample)
+        """
+        file_count = 0
+        total_size = 0
+        complete = True
+        files = []
+        
+        # one key past the limit tells us whether there was more
+        paginator = s3.get_paginator('list_objects_v2')
+        pages = paginator.paginate(Bucket=name, PaginationConfig={'PageSize': min(1000, limit + 1)})
+        
+        for page in pages:
+            for obj in page.get('Contents', []):
+                if file_count >= limit:
+                    complete = False
+                    break
+                file_count = file_count + 1
+                total_size = total_size + obj['Size']
+                if len(files) < sample:
+                    files.append((obj['Key'], obj['Size']))
+            if not complete:
+                break
+        
+        return file_count, total_size, complete, files
+    
+    def _cloudwatch_stats(self, cloudwatch, name):
+        """daily s3 storage metrics from cloudwatch, returns (count, size) or None
+        
+        the object count covers every storage class but the size is kept per
+        class (standard, standard ia, glacier, ...), so the size is the sum
+        of every class the bucket has a metric for
+        """
+        now = datetime.now(timezone.utc)
+        bucket = {'Name': 'BucketName', 'Value': name}
+        
+        listed = cloudwatch.list_metrics(Namespace='AWS/S3', MetricName='BucketSizeBytes', Dimensions=[bucket])
+        storage_types = []
+        for metric in listed['Metrics']:
+            for dimension in metric['Dimensions']:
+                if dimension['Name'] == 'StorageType':
+                    storage_types.append(dimension['Value'])
+        
+        wanted = [('NumberOfObjects', 'AllStorageTypes')] + [('BucketSizeBytes', t) for t in dict.fromkeys(storage_types)]
+        queries = []
+        for i, (metric, storage_type) in enumerate(wanted):
+            queries.append({
+                'Id': f"m{i}",
+                'MetricStat': {
+                    'Metric': {
+                        'Namespace': 'AWS/S3',
+                        'MetricName': metric,
+                        'Dimensions': [bucket, {'Name': 'StorageType', 'Value': storage_type}]
+                    },
+                    'Period': 86400,
+                    'Stat': 'Average'
+                }
+            })
+        
+        response = cloudwatch.get_metric_data(
+            MetricDataQueries=queries,
+            StartTime=now - timedelta(days=3),
+            EndTime=now
+        )
+        
+        # newest datapoint of each metric wins
+        latest = {}
+        for result in response['MetricDataResults']:
+            points = list(zip(result['Timestamps'], result['Values']))
+            if len(points) > 0:
+                latest[result['Id']] = int(max(points)[1])
+        
+        if 'm0' not in latest:
+            return None
+        sizes = [latest[f"m{i}"] for i in range(1, len(wanted)) if f"m{i}" in latest]
+        if len(sizes) == 0:
+            return None
+        
+        return latest['m0'], sum(sizes)
+    
+    def _inspect_bucket(self, s3, cloudwatch, name):
+        public, reason, error = self._check_public(s3, name)
+        
+        info = BucketInfo(name=name, public=public, reason=reason, error=error, public_unknown=bool(error))
+        
+        if cloudwatch is not None:
+            try:
+                stats = self._cloudwatch_stats(cloudwatch, name)
+                if stats:
+                    info.file_count, info.total_size = stats
+                    info.stats_source = "cloudwatch"
+                    return info
+            except:
+                pass
+        
+        try:
+            file_count, total_size, complete, files = self._object_stats(s3, name, self.max_objects)
+            info.file_count = file_count
+            info.total_size = total_size
+            info.complete = complete
+        except Exception as e:
+            errors = [info.error, f"listing: {e}"]
+            info.error = "; ".join(x for x in errors if x)
+            info.listed = False
+        
+        return info
+    
+    def _count_text(self, info):
+        if not info.complete:
+            return f"at least {info.file_count} files"
+        if info.stats_source == "cloudwatch":
+            return f"{info.file_count} files (cloudwatch daily metric)"
+        return f"{info.file_count} files"
+    
+    def _bucket_text(self, info):
+        # convert to mb
+        size_mb = info.total_size / 1024 / 1024
+        
+        lines = [f"- {info.name}"]
+        if info.public:
+            lines.append(f"  PUBLIC ({info.reason})")
+        elif info.public_unknown:
+            lines.append("  public or private unknown")
+        else:
+            lines.append("  private")
+        if info.error:
+            lines.append(f"  couldnt check: {info.error}")
+        if not info.listed:
+            return "\n".join(lines)
+        lines.append(f"  {self._count_text(info)}")
+        lines.append(f"  {size_mb:.2f}MB")
+        return "\n".join(lines)
+    
+    def _bucket_summary(self, infos):
+        public = [info.name for info in infos if info.public]
+        size_mb = sum(info.total_size for info in infos) / 1024 / 1024
+        files = sum(info.file_count for info in infos)
+        
+        text = f"{len(infos)} more buckets not listed: {len(public)} public, {files} files, {size_mb:.2f}MB"
+        if len(public) > 0:
+            # public ones are what people ask about, name them all
+            text = text + "\npublic among them: " + ", ".join(public)
+        return text
+    
+    def _inspect_cached(self, s3, cloudwatch, name, refresh=False):
+        cache = self.cache or get_cache()
+        key = f"{cache.account_id(self.clients)}/inspect/{name}/{self.max_objects}/{cloudwatch is not None}"
+        
+        def load():
+            info = self._inspect_bucket(s3, cloudwatch, name)
+            if info.error:
+                # the next question tries this bucket again
+                raise BucketCheckFailed(info, info.error)
+            return info
+        
+        try:
+            return cache.get_or_load('s3', key, load, refresh)
+        except BucketCheckFailed as e:
+            return e.result
+    
+    def _describe_cached(self, s3, cloudwatch, bucket_name, refresh=False):
+        cache = self.cache or get_cache()
+        key = f"{cache.account_id(self.clients)}/details/{bucket_name}/{self.max_objects}/{cloudwatch is not None}"
+        
+        def load():
+            text, error = self._describe_bucket(s3, cloudwatch, bucket_name)
+            if error:
+                # a throttle or access denied shouldnt answer for the next 5 minutes
+                raise BucketCheckFailed(text, error)
+            return text
+        
+        try:
+            return cache.get_or_load('s3', key, load, refresh)
+        except BucketCheckFailed as e:
+            return e.result
+    
+    def _describe_bucket(self, s3, cloudwatch, bucket_name):
+        """(text, error), error is empty when every check went fine"""
+        lines = [f"bucket: {bucket_name}", ""]
+        
+        
+        is_public, reason, error = self._check_public(s3, bucket_name)
+        
+        if is_public:
+            lines.extend([f"PUBLIC (anyone can access, {reason})", ""])
+        elif error:
+            lines.extend([f"couldnt check if public: {error}", ""])
+        else:
+            lines.extend(["private", ""])
+        
+        
+        try:
+            info = BucketInfo(name=bucket_name, public=is_public, reason=reason)
             
-            for b in buckets:
-                name = b['Name']
-                
-                # check if public (copied from stack overflow)
-                public = False
-                try:
-                    acl = s3.get_bucket_acl(Bucket=name)
-                    grants = acl['Grants']
-                    for grant in grants:
-                        grantee = grant['Grantee']
-                        if grantee.get('Type') == 'Group':
-                            uri = grantee.get('URI')
-                            if uri:
-                                if 'AllUsers' in uri:
-                                    public = True
-                except:
-                    pass
-                
-                
+            stats = None
+            if cloudwatch is not None:
                 try:
-                    policy_response = s3.get_bucket_policy(Bucket=name)
-                    policy_string = policy_response['Policy']
-                    policy = json.loads(policy_string)
-                    statements = policy['Statement']
-                    for stmt in statements:
-                        principal = stmt.get('Principal')
-                        effect = stmt.get('Effect')
-                        if principal == '*':
-                            if effect == 'Allow':
-                                public = True
+                    stats = self._cloudwatch_stats(cloudwatch, bucket_name)
                 except:
                     pass
-                
-                
-                file_count = 0
-                total_size = 0
-                try:
-                    objects_response = s3.list_objects_v2(Bucket=name, MaxKeys=1000)
-                    if 'Contents' in objects_response:
-                        contents = objects_response['Contents']
-                        file_count = len(contents)
-                        for obj in contents:
-                            total_size = total_size + obj['Size']
-                except:
-                    pass
-                
-                # convert to mb
-                size_mb = total_size / 1024 / 1024
-                
-                
-                if public:
-                    output = output + f"- {name}\n"
-                    output = output + "  PUBLIC\n"
+            
+            # only show first 20 files
+            if stats:
+                info.file_count, info.total_size = stats
+                info.stats_source = "cloudwatch"
+                _, _, _, files = self._object_stats(s3, bucket_name, 20, sample=20)
+            else:
+                file_count, total_size, complete, files = self._object_stats(s3, bucket_name, self.max_objects, sample=20)
+                info.file_count = file_count
+                info.total_size = total_size
+                info.complete = complete
+            
+            if len(files) == 0:
+                lines.append("empty bucket")
+                return "\n".join(lines), error
+            
+            total_mb = info.total_size / 1024 / 1024
+            
+            lines.append(f"{self._count_text(info)}:")
+            
+            for name, size in files:
+                size_mb = size / 1024 / 1024
+                lines.append(f"- {name} ({size_mb:.2f}MB)")
+            
+            if info.file_count > len(files):
+                remaining = info.file_count - len(files)
+                if info.complete:
+                    lines.append(f"...and {remaining} more")
                 else:
-                    output = output + f"- {name}\n"
-                    output = output + "  private\n"
-                output = output + f"  {file_count} files\n"
-                output = output + f"  {size_mb:.2f}MB\n\n"
+                    lines.append(f"...and at least {remaining} more")
             
-            # count public/private
-            public_count = 0
-            private_count = 0
+            lines.append("")
+            if info.complete:
+                lines.append(f"total: {total_mb:.2f}MB")
+            else:
+                lines.append(f"total: at least {total_mb:.2f}MB")
             
-            for b in buckets:
-                name = b['Name']
-                is_public = False
+        except Exception as e:
+            lines.append(f"error getting contents: {e}")
+            if error:
+                error = error + "; "
+            error = error + f"contents: {e}"
+        
+        return "\n".join(lines), error
+    
+    def _inspect_all(self, s3, cloudwatch, names, refresh=False):
+        """inspects every bucket on a thread pool, returns (results by name, failures)"""
+        results = {}
+        failed = []
+        
+        if len(names) == 0:
+            return results, failed
+        
+        workers = min(self.max_workers, len(names))
+        started = {}
+        
+        def inspect(name):
+            # the timeout counts from here, not from when the bucket was queued
+            started[name] = time.monotonic()
+            return self._inspect_cached(s3, cloudwatch, name, refresh)
+        
+        pool = ThreadPoolExecutor(max_workers=workers)
+        try:
+            futures = {}
+            for name in names:
+                futures[name] = pool.submit(inspect, name)
+            
+            pending = set(names)
+            timed_out = set()
+            out_of_time = False
+            scan_start = time.monotonic()
+            while len(pending) > 0:
+                now = time.monotonic()
+                if self.scan_timeout is not None and now - scan_start >= self.scan_timeout:
+                    out_of_time = True
+                    break
+                for name in list(pending):
+                    if futures[name].done():
+                        pending.discard(name)
+                    elif name in started and now - started[name] >= self.bucket_timeout:
+                        timed_out.add(name)
+                        pending.discard(name)
+                if len(pending) == 0:
+                    break
                 
-                try:
-                    acl = s3.get_bucket_acl(Bucket=name)
-                    for g in acl['Grants']:
-                        if g['Grantee'].get('Type') == 'Group':
-                            if 'AllUsers' in g['Grantee'].get('URI', ''):
-                                is_public = True
-                except:
-                    pass
+                # a thread cant be stopped, once every worker is stuck on a
+                # timed out bucket the queued ones will never start
+                stuck = [name for name in timed_out if not futures[name].done()]
+                if len(stuck) >= workers:
+                    break
                 
-                if is_public:
-                    public_count = public_count + 1
-                else:
-                    private_count = private_count + 1
+                deadlines = [started[name] + self.bucket_timeout for name in pending if name in started]
+                if self.scan_timeout is not None:
+                    deadlines.append(scan_start + self.scan_timeout)
+                timeout = self.bucket_timeout
+                if len(deadlines) > 0:
+                    timeout = max(min(deadlines) - now, 0.01)
+                wait([futures[name] for name in pending], timeout=timeout, return_when=FIRST_COMPLETED)
+            
+            for name in names:
+                future = futures[name]
+                if not future.done():
+                    future.cancel()
+                    if name in timed_out:
+                        failed.append((name, f"timed out after {self.bucket_timeout:g}s"))
+                    elif out_of_time and name in started:
+                        failed.append((name, f"still running when the scan stopped after {self.scan_timeout:g}s"))
+                    elif out_of_time:
+                        failed.append((name, f"not checked, the scan stopped after {self.scan_timeout:g}s"))
+                    else:
+                        failed.append((name, "not checked, every worker was stuck on a slow bucket"))
+                    continue
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    failed.append((name, str(e)))
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        
+        return results, failed
+    
+    def _run(self, bucket_name: str = "", refresh: bool = False):
+        
+        cache = self.cache or get_cache()
+        
+        # with a snapshot the all buckets question needs no aws calls at all
+        if bucket_name == "" and not refresh:
+            inventory = self.inventory or get_inventory(cache.account_id(self.clients))
+            if inventory is not None and inventory.has('buckets'):
+                infos = [BucketInfo(**record._asdict()) for record in inventory.buckets()]
+                result = self._listing(infos, [])
+                result.notes.append(inventory.note())
+                return result
+        
+        # pooled clients, timeouts and retries come from the factory config
+        clients = self.clients or get_clients()
+        s3 = clients.client('s3')
+        
+        cloudwatch = None
+        if self.use_cloudwatch:
+            cloudwatch = clients.client('cloudwatch')
+        
+        
+        response = cache.call('s3', s3, 'list_buckets', refresh=refresh)
+        buckets = response['Buckets']
+        
+        
+        if bucket_name == "":
             
-            output = output + f"total: {public_count} public and {private_count} private"
+            # inspect buckets in parallel, results come back in bucket order
+            names = [b['Name'] for b in buckets]
+            results, failed = self._inspect_all(s3, cloudwatch, names, refresh)
             
-            return output
+            # every bucket is inspected once, the listing and totals both use it
+            infos = [results[name] for name in names if name in results]
+            return self._listing(infos, failed)
             
         else:
             
@@ -125,83 +475,53 @@ class S3Tool(BaseTool):
             if not bucket_exists:
                 return f"bucket {bucket_name} doesnt exist"
             
-            result = f"bucket: {bucket_name}\n\n"
-            
-            
-            is_public = False
-            
+            return self._describe_cached(s3, cloudwatch, bucket_name, refresh)
+    
+    def _listing(self, infos, failed):
+        """every bucket with its totals, failed is [(name, error)] for the ones that couldnt be checked"""
+        # a bucket that errored is listed with what is known about it and
+        # counted with the ones that couldnt be checked at all
+        errored = [(info.name, info.error) for info in infos if info.error]
+        public_count = len([info for info in infos if info.public])
+        private_count = len([info for info in infos if not info.public and not info.public_unknown])
+        unknown = len(failed) + len([info for info in infos if info.public_unknown and not info.public])
         
-            try:
-                acl = s3.get_bucket_acl(Bucket=bucket_name)
-                grants = acl['Grants']
-                for grant in grants:
-                    grantee = grant['Grantee']
-                    if grantee.get('Type') == 'Group':
-                        uri = grantee.get('URI')
-                        if uri and 'AllUsers' in uri:
-                            is_public = True
-            except:
-                pass
-            
-            
-            try:
-                policy_response = s3.get_bucket_policy(Bucket=bucket_name)
-                policy_string = policy_response['Policy']
-                policy_data = json.loads(policy_string)
-                for statement in policy_data['Statement']:
-                    if statement.get('Principal') == '*' and statement.get('Effect') == 'Allow':
-                        is_public = True
-            except:
-                pass
-            
-            if is_public:
-                result = result + "PUBLIC (anyone can access)\n\n"
-            else:
-                result = result + "private\n\n"
-            
-            
-            try:
-                objects = s3.list_objects_v2(Bucket=bucket_name, MaxKeys=100)
-                
-                if 'Contents' not in objects:
-                    result = result + "empty bucket"
-                    return result
-                
-                files = objects['Contents']
-                
-                
-                total = 0
-                for f in files:
-                    total = total + f['Size']
-                
-                total_mb = total / 1024 / 1024
-                
-                result = result + f"{len(files)} files:\n"
-                
-                # only show first 20 files
-                count = 0
-                for file in files:
-                    if count >= 20:
-                        break
-                    
-                    name = file['Key']
-                    size = file['Size']
-                    size_mb = size / 1024 / 1024
-                    
-                    result = result + f"- {name} ({size_mb:.2f}MB)\n"
-                    
-                    count = count + 1
-                
-                if len(files) > 20:
-                    remaining = len(files) - 20
-                    result = result + f"...and {remaining} more\n"
-                
-                result = result + f"\ntotal: {total_mb:.2f}MB"
-                
-            except Exception as e:
-                result = result + f"error getting contents: {e}"
-            
-            return result
+        notes = []
+        problems = failed + errored
+        if len(problems) > 0:
+            lines = [f"couldnt check {len(problems)} buckets:"]
+            for name, error in problems:
+                lines.append(f"- {name}: {error}")
+            notes.append("\n".join(lines))
+        
+        total = f"total: {public_count} public and {private_count} private"
+        if unknown > 0:
+            total = total + f" ({unknown} unknown)"
+        notes.append(total)
+        
+        return ToolResult(
+            infos,
+            render=self._bucket_text,
+            header=f"you have {len(infos) + len(failed)} buckets:",
+            notes=notes,
+            summarize=self._bucket_summary,
+            separator="\n\n",
+            noun="buckets"
+        )
     
-    def _arun(self, bucket_name: str = "") -> str:
-        return self._run(bucket_name)
+    async def _arun(self, bucket_name: str = "", refresh: bool = False):
+        # boto3 is blocking, run it on a worker thread so other tools keep going
+        return await asyncio.to_thread(self._run, bucket_name, refresh)
+
+
+def make_s3_tool():
+    """the s3 tool with its settings from the environment"""
+    # 0 means the scan has no overall deadline
+    scan_timeout = float(os.getenv('CHATBOT_S3_SCAN_TIMEOUT', '60')) or None
+    return S3Tool(
+        use_cloudwatch=os.getenv('CHATBOT_S3_CLOUDWATCH') == '1',
+        max_objects=int(os.getenv('CHATBOT_S3_MAX_OBJECTS', '100000')),
+        max_workers=int(os.getenv('CHATBOT_S3_WORKERS', '16')),
+        bucket_timeout=float(os.getenv('CHATBOT_S3_BUCKET_TIMEOUT', '30')),
+        scan_timeout=scan_timeout
+    )
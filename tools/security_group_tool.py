@@ -1,138 +1,273 @@
-import boto3
+import asyncio
+import ipaddress
+from typing import Optional
 from langchain_core.tools import BaseTool
 from pydantic import BaseModel, Field
 
+from tools.aws_clients import ClientFactory, get_clients
+from tools.cache import ResourceCache, get_cache
+from tools.inventory import Inventory, get_inventory
+from tools.regions import default_region, enabled_regions, fan_out
+from tools.results import ToolResult
+from tools.sg_index import get_index, parse_rules, peer_text, port_text
+
 
 class SecurityGroupInput(BaseModel):
-    group_id: str = Field(description="security group id (sg-xxxxx) or leave empty for all groups")
+    group_id: str = Field(default="", description="security group id (sg-xxxxx) or leave empty for all groups")
+    source: str = Field(default="", description="only rules that let this in: an ip, a cidr like 0.0.0.0/0, or another group id")
+    port: Optional[int] = Field(default=None, description="only rules that cover this port, like 22 or 5432")
+    protocol: str = Field(default="", description="tcp, udp or icmp, empty for any")
+    region: str = Field(default="", description="aws region, 'all' for every enabled region, empty for the default region")
+    refresh: bool = Field(default=False, description="true to skip cached data and ask aws again")
+
+
+# what describe_security_groups says about a group id a region doesnt have
+NOT_FOUND_CODES = ('InvalidGroup.NotFound', 'InvalidGroupId.NotFound', 'InvalidGroupId.Malformed')
+
+
+def group_not_found(error):
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') in NOT_FOUND_CODES
+
+
+def format_group(sg, region=''):
+    lines = [
+        f"security group: {sg['GroupName']} ({sg['GroupId']})",
+        f"description: {sg['Description']}",
+        f"vpc: {sg.get('VpcId', 'N/A')}"
+    ]
+    if region:
+        lines.append(f"region: {region}")
+    
+    rules = parse_rules(sg, region)
+    for direction, title, word in (('in', 'inbound', 'from'), ('out', 'outbound', 'to')):
+        matching = [r for r in rules if r.direction == direction]
+        if len(matching) == 0:
+            lines.append(f"{title} rules: none")
+            continue
+        lines.append(f"{title} rules:")
+        for rule in matching:
+            lines.append(f"  - {rule.protocol} {port_text(rule)} {word} {peer_text(rule)}")
+    
+    return "\n".join(lines)
 
 
 class GetSecurityGroupInfoTool(BaseTool):
     name: str = "get_security_group_info"
-    description: str = "checks security group information and rules"
+    description: str = "checks security group information and rules. give a source, port or protocol to get only the rules that match, like which groups allow 0.0.0.0/0 on 22 or what can reach sg-123 on 5432"
     args_schema: type[BaseModel] = SecurityGroupInput
+    cache: Optional[ResourceCache] = None
+    clients: Optional[ClientFactory] = None
+    inventory: Optional[Inventory] = None
+    all_regions: bool = False
     
-    def _run(self, group_id: str = "") -> str:
-        
-        ec2 = boto3.client('ec2')
-        
-        try:
-            if group_id and group_id.strip():
-                # Get specific security group
-                response = ec2.describe_security_groups(GroupIds=[group_id.strip()])
-            else:
-                # Get all security groups
-                response = ec2.describe_security_groups()
-                
-        except Exception as e:
-            if "InvalidGroupId" in str(e):
-                return f"security group {group_id} not found"
-            return f"error getting security groups: {str(e)}"
+    def _describe(self, region, group_id, refresh=False):
+        """security groups in one region, all of them when group_id is empty"""
         
-        security_groups = response['SecurityGroups']
+        cache = self.cache or get_cache()
+        clients = self.clients or get_clients()
+        ec2 = clients.client('ec2', region)
         
-        if len(security_groups) == 0:
-            return "no security groups found"
+        if group_id:
+            # Get specific security group
+            response = cache.call('security_group', ec2, 'describe_security_groups', refresh=refresh, GroupIds=[group_id])
+            return response['SecurityGroups']
+        
+        # Get all security groups
+        return cache.call_paginated('security_group', ec2, 'describe_security_groups', 'SecurityGroups', refresh=refresh)
+    
+    def _query(self, region, group_id, source, port, protocol, refresh=False):
+        """matching inbound rules in one region, from the rule index"""
+        
+        index = get_index(region, self.clients, self.cache)
+        index.ensure(refresh)
+        
+        if source.startswith('sg-'):
+            rules = index.reachable_from(source, port, protocol)
+        elif source:
+            rules = index.allowing(source, port, protocol)
+        elif group_id:
+            rules = index.into(group_id, port, protocol)
+        else:
+            rules = index.on_port(port, protocol)
+        
+        if group_id:
+            rules = [r for r in rules if r.group_id == group_id]
+        
+        return [(rule, index.group_name(rule.group_id)) for rule in rules]
+    
+    def _regions(self, region):
+        if region == "all" or (region == "" and self.all_regions):
+            return enabled_regions(self.cache, self.clients)
+        return [region or None]
+    
+    def _run_query(self, group_id, source, port, protocol, region, refresh):
+        
+        if source and not source.startswith('sg-'):
+            try:
+                ipaddress.ip_network(source, strict=False)
+            except ValueError:
+                return f"source {source} is not an ip, cidr or security group id"
         
-        output = ""
+        # the region the question is about, the snapshot has to have it
+        wanted = region or default_region(self.clients)
+        if region == "all" or (region == "" and self.all_regions):
+            wanted = "all"
         
-        for sg in security_groups:
-            sg_id = sg['GroupId']
-            sg_name = sg['GroupName']
-            description = sg['Description']
-            vpc_id = sg.get('VpcId', 'N/A')
+        inventory = None
+        if not refresh:
+            inventory = self.inventory or get_inventory((self.cache or get_cache()).account_id(self.clients))
+            if inventory is not None and not inventory.covers('security_groups', wanted):
+                inventory = None
+        
+        matches = []
+        failed = []
+        if inventory is not None:
+            in_region = None
+            if wanted != "all":
+                in_region = wanted
+            matches = inventory.rules(group_id, source, port, protocol, in_region)
+            regions = sorted(set(rule.region for rule, group_name in matches))
+        else:
+            regions = self._regions(region)
+            results = fan_out(regions, lambda r: self._query(r, group_id, source, port, protocol, refresh))
+            for r, found, error in results:
+                if error is not None:
+                    failed.append(f"{r}: {error}")
+                    continue
+                matches.extend(found)
+        
+        conditions = []
+        if group_id:
+            conditions.append(f"into {group_id}")
+        if source:
+            conditions.append(f"from {source}")
+        if port is not None:
+            conditions.append(f"on port {port}")
+        if protocol:
+            conditions.append(f"over {protocol}")
+        asked = " ".join(conditions)
+        
+        if len(matches) == 0:
+            if len(failed) > 0:
+                return "error getting security groups: " + "; ".join(failed)
+            if inventory is not None:
+                return f"no inbound rules allow traffic {asked}\n{inventory.note()}"
+            return f"no inbound rules allow traffic {asked}"
+        
+        def render(match):
+            rule, group_name = match
+            where = ""
+            if rule.region and len(regions) > 1:
+                where = f" in {rule.region}"
+            return f"- {group_name} ({rule.group_id}){where}: {rule.protocol} {port_text(rule)} from {peer_text(rule)}"
+        
+        def summarize(hidden):
+            groups = set(rule.group_id for rule, group_name in hidden)
+            return f"{len(hidden)} more rules in {len(groups)} groups not listed"
+        
+        notes = []
+        if len(failed) > 0:
+            notes.append("couldnt check regions: " + "; ".join(failed))
+        if inventory is not None:
+            notes.append(inventory.note())
+        
+        return ToolResult(
+            matches,
+            render=render,
+            header=f"{len(matches)} inbound rules allow traffic {asked}:",
+            notes=notes,
+            summarize=summarize,
+            noun="rules"
+        )
+    
+    def _run(self, group_id: str = "", source: str = "", port: Optional[int] = None, protocol: str = "", region: str = "", refresh: bool = False):
+        
+        group_id = group_id.strip()
+        source = source.strip()
+        protocol = protocol.strip().lower()
+        
+        # a targeted question only needs the matching rules, not every group
+        if source or port is not None or protocol:
+            return self._run_query(group_id, source, port, protocol, region, refresh)
+        
+        security_groups = []
+        failed = []
+        multi_region = region == "all" or (region == "" and self.all_regions)
+        
+        if multi_region:
+            
+            def describe(r):
+                try:
+                    return self._describe(r, group_id, refresh)
+                except Exception as e:
+                    # a group id only lives in one region
+                    if group_not_found(e):
+                        return []
+                    raise
             
-            output += f"security group: {sg_name} ({sg_id})\n"
-            output += f"description: {description}\n"
-            output += f"vpc: {vpc_id}\n"
+            # a single group can only be in one region, stop once its found
+            stop_when = None
+            if group_id:
+                stop_when = lambda groups: len(groups) > 0
             
-            # Inbound rules
-            inbound_rules = sg['IpPermissions']
-            if len(inbound_rules) > 0:
-                output += "inbound rules:\n"
-                for rule in inbound_rules:
-                    protocol = rule.get('IpProtocol', 'N/A')
-                    from_port = rule.get('FromPort', 'N/A')
-                    to_port = rule.get('ToPort', 'N/A')
-                    
-                    if protocol == '-1':
-                        port_range = "all ports"
-                    elif from_port == to_port:
-                        port_range = str(from_port)
-                    else:
-                        port_range = f"{from_port}-{to_port}"
-                    
-                    # Sources
-                    sources = []
-                    
-                    # IP ranges
-                    for ip_range in rule.get('IpRanges', []):
-                        cidr = ip_range['CidrIp']
-                        desc = ip_range.get('Description', '')
-                        if desc:
-                            sources.append(f"{cidr} ({desc})")
-                        else:
-                            sources.append(cidr)
-                    
-                    # Security groups
-                    for sg_ref in rule.get('UserIdGroupPairs', []):
-                        ref_sg_id = sg_ref['GroupId']
-                        ref_desc = sg_ref.get('Description', '')
-                        if ref_desc:
-                            sources.append(f"{ref_sg_id} ({ref_desc})")
-                        else:
-                            sources.append(ref_sg_id)
-                    
-                    sources_str = ", ".join(sources) if sources else "no sources"
-                    output += f"  - {protocol} {port_range} from {sources_str}\n"
-            else:
-                output += "inbound rules: none\n"
+            results = fan_out(enabled_regions(self.cache, self.clients), describe, stop_when=stop_when)
             
-            # Outbound rules
-            outbound_rules = sg['IpPermissionsEgress']
-            if len(outbound_rules) > 0:
-                output += "outbound rules:\n"
-                for rule in outbound_rules:
-                    protocol = rule.get('IpProtocol', 'N/A')
-                    from_port = rule.get('FromPort', 'N/A')
-                    to_port = rule.get('ToPort', 'N/A')
-                    
-                    if protocol == '-1':
-                        port_range = "all ports"
-                    elif from_port == to_port:
-                        port_range = str(from_port)
-                    else:
-                        port_range = f"{from_port}-{to_port}"
-                    
-                    # Destinations
-                    destinations = []
-                    
-                    # IP ranges
-                    for ip_range in rule.get('IpRanges', []):
-                        cidr = ip_range['CidrIp']
-                        desc = ip_range.get('Description', '')
-                        if desc:
-                            destinations.append(f"{cidr} ({desc})")
-                        else:
-                            destinations.append(cidr)
-                    
-                    # Security groups
-                    for sg_ref in rule.get('UserIdGroupPairs', []):
-                        ref_sg_id = sg_ref['GroupId']
-                        ref_desc = sg_ref.get('Description', '')
-                        if ref_desc:
-                            destinations.append(f"{ref_sg_id} ({ref_desc})")
-                        else:
-                            destinations.append(ref_sg_id)
-                    
-                    destinations_str = ", ".join(destinations) if destinations else "no destinations"
-                    output += f"  - {protocol} {port_range} to {destinations_str}\n"
-            else:
-                output += "outbound rules: none\n"
+            for r, groups, error in results:
+                if error is not None:
+                    failed.append(f"{r}: {error}")
+                    continue
+                for sg in groups:
+                    security_groups.append((r, sg))
             
-            output += "\n"
+            if len(security_groups) == 0 and len(failed) > 0:
+                return "error getting security groups: " + "; ".join(failed)
+            if len(security_groups) == 0 and group_id:
+                return f"security group {group_id} not found"
+        else:
+            try:
+                for sg in self._describe(region or None, group_id, refresh):
+                    security_groups.append((region, sg))
+            except Exception as e:
+                if group_not_found(e):
+                    return f"security group {group_id} not found"
+                return f"error getting security groups: {str(e)}"
+        
+        if len(security_groups) == 0:
+            return "no security groups found"
+        
+        notes = []
+        if len(failed) > 0:
+            notes.append("couldnt check regions: " + "; ".join(failed))
+        
+        if group_id:
+            blocks = [format_group(sg, sg_region) for sg_region, sg in security_groups]
+            return "\n\n".join(blocks + notes)
+        
+        # every rule of every group is far too much text, list the groups
+        # and let the next question ask about the rules it cares about
+        def render(entry):
+            sg_region, sg = entry
+            where = ""
+            if sg_region:
+                where = f" in {sg_region}"
+            inbound = len(sg.get('IpPermissions', []))
+            outbound = len(sg.get('IpPermissionsEgress', []))
+            return f"- {sg['GroupName']} ({sg['GroupId']}){where}, vpc {sg.get('VpcId', 'N/A')}: {inbound} inbound, {outbound} outbound rules"
+        
+        def summarize(hidden):
+            rules = sum(len(sg.get('IpPermissions', [])) + len(sg.get('IpPermissionsEgress', [])) for sg_region, sg in hidden)
+            return f"{len(hidden)} more groups with {rules} rules between them not listed"
         
-        return output.strip()
+        return ToolResult(
+            security_groups,
+            render=render,
+            header=f"{len(security_groups)} security groups:",
+            notes=notes,
+            summarize=summarize,
+            noun="groups"
+        )
     
-    def _arun(self, group_id: str = "") -> str:
-        return self._run(group_id)
+    async def _arun(self, group_id: str = "", source: str = "", port: Optional[int] = None, protocol: str = "", region: str = "", refresh: bool = False):
+        # boto3 is blocking, run it on a worker thread so other tools keep going
+        return await asyncio.to_thread(self._run, group_id, source, port, protocol, region, refresh)
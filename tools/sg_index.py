@@ -0,0 +1,257 @@
+import bisect
+import ipaddress
+import threading
+from typing import NamedTuple, Optional
+
+from tools.aws_clients import get_clients
+from tools.cache import get_cache
+
+
+ALL_PORTS = (0, 65535)
+
+
+class Rule(NamedTuple):
+    """one source or destination of one security group rule"""
+    group_id: str
+    direction: str           # 'in' or 'out'
+    protocol: str            # 'tcp', 'udp', 'icmp', '-1' for everything
+    from_port: int
+    to_port: int
+    cidr: Optional[str]      # ip range, or None for a group or prefix list
+    peer: Optional[str]      # referenced group id or prefix list id
+    description: str
+    region: str
+
+
+def port_text(rule):
+    if rule.protocol == '-1' or (rule.from_port, rule.to_port) == ALL_PORTS:
+        return "all ports"
+    if rule.from_port == rule.to_port:
+        return str(rule.from_port)
+    return f"{rule.from_port}-{rule.to_port}"
+
+
+def peer_text(rule):
+    target = rule.cidr or rule.peer
+    if rule.description:
+        return f"{target} ({rule.description})"
+    return target
+
+
+def parse_rules(sg, region=''):
+    """every rule of a group as Rules, one per cidr, group or prefix list"""
+    rules = []
+
+    for direction, key in (('in', 'IpPermissions'), ('out', 'IpPermissionsEgress')):
+        for permission in sg.get(key, []):
+            protocol = str(permission.get('IpProtocol', '-1')).lower()
+            from_port = permission.get('FromPort')
+            to_port = permission.get('ToPort')
+
+            # all traffic, and icmp with -1, have no real port range
+            if protocol == '-1' or from_port is None or from_port < 0:
+                from_port, to_port = ALL_PORTS
+
+            def add(cidr, peer, description):
+                rules.append(Rule(
+                    group_id=sg['GroupId'],
+                    direction=direction,
+                    protocol=protocol,
+                    from_port=from_port,
+                    to_port=to_port,
+                    cidr=cidr,
+                    peer=peer,
+                    description=description or '',
+                    region=region or ''
+                ))
+
+            for ip_range in permission.get('IpRanges', []):
+                add(ip_range['CidrIp'], None, ip_range.get('Description'))
+            for ip_range in permission.get('Ipv6Ranges', []):
+                add(ip_range['CidrIpv6'], None, ip_range.get('Description'))
+            for pair in permission.get('UserIdGroupPairs', []):
+                add(None, pair['GroupId'], pair.get('Description'))
+            for prefix_list in permission.get('PrefixListIds', []):
+                add(None, prefix_list['PrefixListId'], prefix_list.get('Description'))
+
+    return rules
+
+
+def protocol_matches(rule, protocol):
+    return not protocol or rule.protocol == '-1' or rule.protocol == protocol
+
+
+class RuleTables(NamedTuple):
+    """one build of the index, rule positions only mean something within it"""
+    groups: dict
+    rules: list
+    intervals: list
+    interval_starts: list
+    by_interval: dict
+    by_prefix: dict
+    by_group: dict
+    referenced_by: dict
+
+
+EMPTY_TABLES = RuleTables({}, [], [], [], {}, {}, {}, {})
+
+
+class SecurityGroupIndex:
+    """every security group rule in one region, indexed for targeted questions
+
+    rules are looked up by port through a sorted list of the distinct port
+    ranges, by address through one dict per cidr prefix length, and by group
+    through a graph of which groups name which other groups as a source.
+    the index is rebuilt whenever the cached describe_security_groups
+    response changes, so it follows the cache ttl and refresh.
+
+    a rebuild swaps in a whole new RuleTables at once and every lookup
+    reads self.tables once, so readers never need the lock and never mix
+    positions from one build with rules from another.
+    """
+
+    def __init__(self, region=None, clients=None, cache=None):
+        self.region = region
+        self.clients = clients
+        self.cache = cache
+        self.tables = EMPTY_TABLES
+        self._source = None
+        self._lock = threading.Lock()
+
+    @property
+    def groups(self):
+        return self.tables.groups
+
+    @property
+    def rules(self):
+        return self.tables.rules
+
+    def ensure(self, refresh=False):
+        cache = self.cache or get_cache()
+        clients = self.clients or get_clients()
+        ec2 = clients.client('ec2', self.region)
+        groups = cache.call_paginated('security_group', ec2, 'describe_security_groups', 'SecurityGroups', refresh=refresh)
+
+        with self._lock:
+            # same cached response as last time, nothing changed
+            if groups is self._source or groups == self._source:
+                return
+            self.tables = self._build(groups)
+            self._source = groups
+
+    def _build(self, security_groups):
+        groups = {}
+        rules = []
+        by_interval = {}
+        by_prefix = {}
+        by_group = {}
+        referenced_by = {}
+
+        for sg in security_groups:
+            groups[sg['GroupId']] = sg
+            for rule in parse_rules(sg, self.region):
+                position = len(rules)
+                rules.append(rule)
+
+                by_interval.setdefault((rule.from_port, rule.to_port), []).append(position)
+                by_group.setdefault(rule.group_id, []).append(position)
+
+                if rule.cidr:
+                    network = ipaddress.ip_network(rule.cidr, strict=False)
+                    key = (network.version, network.prefixlen)
+                    by_prefix.setdefault(key, {}).setdefault(int(network.network_address), []).append(position)
+                elif rule.peer and rule.peer.startswith('sg-') and rule.direction == 'in':
+                    # peer can reach rule.group_id
+                    referenced_by.setdefault(rule.peer, []).append(position)
+
+        intervals = sorted(by_interval)
+        return RuleTables(
+            groups=groups,
+            rules=rules,
+            intervals=intervals,
+            interval_starts=[start for start, end in intervals],
+            by_interval=by_interval,
+            by_prefix=by_prefix,
+            by_group=by_group,
+            referenced_by=referenced_by
+        )
+
+    def _on_port(self, tables, port):
+        """positions of every rule whose port range has port in it"""
+        # only ranges starting at or below the port can hold it
+        last = bisect.bisect_right(tables.interval_starts, port)
+        positions = set()
+        for start, end in tables.intervals[:last]:
+            if end >= port:
+                positions.update(tables.by_interval[(start, end)])
+        return positions
+
+    def _covering(self, tables, cidr):
+        """positions of every rule whose range contains the whole cidr"""
+        network = ipaddress.ip_network(cidr, strict=False)
+        address = int(network.network_address)
+        bits = network.max_prefixlen
+
+        positions = set()
+        for prefixlen in range(network.prefixlen + 1):
+            table = tables.by_prefix.get((network.version, prefixlen))
+            if table is None:
+                continue
+            mask = ((1 << prefixlen) - 1) << (bits - prefixlen)
+            positions.update(table.get(address & mask, []))
+        return positions
+
+    def _select(self, tables, positions, port=None, protocol='', direction='in'):
+        if port is not None:
+            positions = positions & self._on_port(tables, port)
+        rules = [tables.rules[p] for p in sorted(positions)]
+        return [
+            r for r in rules
+            if r.direction == direction and protocol_matches(r, protocol)
+        ]
+
+    def allowing(self, cidr, port=None, protocol='', direction='in'):
+        """rules that let the cidr (or ip) in, "who allows 0.0.0.0/0 on 22" """
+        tables = self.tables
+        return self._select(tables, self._covering(tables, cidr), port, protocol, direction)
+
+    def on_port(self, port, protocol='', direction='in'):
+        tables = self.tables
+        return self._select(tables, set(range(len(tables.rules))), port, protocol, direction)
+
+    def into(self, group_id, port=None, protocol=''):
+        """what can reach group_id, its inbound rules"""
+        tables = self.tables
+        return self._select(tables, set(tables.by_group.get(group_id, [])), port, protocol, 'in')
+
+    def reachable_from(self, group_id, port=None, protocol=''):
+        """inbound rules of other groups that let group_id in"""
+        tables = self.tables
+        return self._select(tables, set(tables.referenced_by.get(group_id, [])), port, protocol, 'in')
+
+    def group_name(self, group_id):
+        sg = self.tables.groups.get(group_id)
+        if sg is None:
+            return ''
+        return sg['GroupName']
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(region=None, clients=None, cache=None):
+    """one shared index per account and region"""
+    key = ((cache or get_cache()).account_id(clients), region)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = SecurityGroupIndex(region, clients, cache)
+            _indexes[key] = index
+        return index
+
+
+def clear_indexes():
+    """forgets every index, the next question builds it again"""
+    with _indexes_lock:
+        _indexes.clear()
@@ -0,0 +1,171 @@
+"""the snapshot command, the whole account into one inventory file
+
+    python -m tools.snapshot inventory.db
+    python -m tools.snapshot inventory.db --all-regions
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tools.aws_clients import get_clients
+from tools.cache import get_cache
+from tools.ec2_index import InstanceIndex
+from tools.iam_snapshot import IAMSnapshot
+from tools.inventory import BucketRecord, GroupRecord, Inventory, write_inventory
+from tools.regions import default_region, enabled_regions, fan_out
+from tools.s3_tool import S3Tool
+from tools.sg_index import parse_rules
+
+
+class Collector:
+    """pulls buckets, instances, security groups and iam at the same time
+
+    each part runs on its own thread (and fans out further per bucket or
+    region). a part that fails, even for one bucket or region, is named in
+    the file and left out of its parts, so the tools go to aws for it
+    instead of trusting half the records.
+    """
+
+    def __init__(self, clients=None, cache=None, all_regions=False, on_progress=None):
+        self.clients = clients or get_clients()
+        self.cache = cache or get_cache()
+        self.all_regions = all_regions
+        self.on_progress = on_progress
+        self.failed = []
+        self.incomplete = set()
+
+    def _progress(self, message):
+        if self.on_progress is not None:
+            self.on_progress(message)
+
+    def regions(self):
+        # records always carry a real region name, so a question about
+        # us-east-1 finds what was collected as the default region
+        if self.all_regions:
+            return enabled_regions(self.cache, self.clients)
+        return [default_region(self.clients)]
+
+    def _per_region(self, part, what, fn):
+        results = []
+        for region, found, error in fan_out(self.regions(), fn):
+            if error is not None:
+                self.failed.append(f"{what} in {region}: {error}")
+                self.incomplete.add(part)
+                continue
+            results.extend(found)
+        return results
+
+    def buckets(self):
+        # nobody is waiting on a snapshot, only single buckets time out
+        tool = S3Tool(cache=self.cache, clients=self.clients, scan_timeout=None)
+        s3 = self.clients.client('s3')
+        names = [b['Name'] for b in s3.list_buckets()['Buckets']]
+
+        # same inspection as "which buckets are public", fresh and on a pool
+        results, failed = tool._inspect_all(s3, None, names, refresh=True)
+        for name, error in failed:
+            self.failed.append(f"bucket {name}: {error}")
+            self.incomplete.add('buckets')
+
+        records = []
+        for name in names:
+            if name in results:
+                info = results[name]
+                if info.error:
+                    self.failed.append(f"bucket {name}: {info.error}")
+                    self.incomplete.add('buckets')
+                records.append(BucketRecord(info.name, info.public, info.reason, info.file_count, info.total_size, info.complete))
+        return records
+
+    def instances(self):
+        def sweep(region):
+            index = InstanceIndex(region, self.clients)
+            index.rebuild()
+            return index.records()
+
+        return self._per_region('instances', 'instances', sweep)
+
+    def security_groups(self):
+        def describe(region):
+            ec2 = self.clients.client('ec2', region)
+            groups = []
+            for page in ec2.get_paginator('describe_security_groups').paginate():
+                groups.extend(page['SecurityGroups'])
+            return [(region, sg) for sg in groups]
+
+        groups = []
+        rules = []
+        for region, sg in self._per_region('security_groups', 'security groups', describe):
+            groups.append(GroupRecord(sg['GroupId'], sg['GroupName'], sg.get('Description', ''), sg.get('VpcId', ''), region))
+            rules.extend(parse_rules(sg, region))
+        return groups, rules
+
+    def iam(self):
+        iam = self.clients.client('iam')
+        pages = iam.get_paginator('get_account_authorization_details').paginate(PaginationConfig={'PageSize': 1000})
+        return IAMSnapshot.from_pages(self.cache.account_id(self.clients), pages)
+
+    def collect(self):
+        """{part: records}, parts that failed are missing"""
+        parts = {
+            'buckets': self.buckets,
+            'instances': self.instances,
+            'security_groups': self.security_groups,
+            'iam': self.iam
+        }
+
+        collected = {}
+        with ThreadPoolExecutor(max_workers=len(parts)) as pool:
+            futures = {name: pool.submit(fn) for name, fn in parts.items()}
+            for name, future in futures.items():
+                try:
+                    collected[name] = future.result()
+                    self._progress(f"snapshot: {name} done")
+                except Exception as e:
+                    self.failed.append(f"{name}: {e}")
+                    self._progress(f"snapshot: {name} failed: {e}")
+        return collected
+
+    def complete(self, collected):
+        """the parts that came back whole"""
+        return [name for name in collected if name not in self.incomplete]
+
+
+def take_snapshot(path, clients=None, cache=None, all_regions=False, on_progress=None):
+    """collects the account into the inventory file at path and returns it opened"""
+    cache = cache or get_cache()
+    collector = Collector(clients, cache, all_regions, on_progress)
+    collected = collector.collect()
+
+    groups, rules = collected.get('security_groups', ([], []))
+    regions = collector.regions()
+    write_inventory(
+        path,
+        cache.account_id(collector.clients),
+        collected.get('buckets', []),
+        collected.get('instances', []),
+        groups,
+        rules,
+        collected.get('iam'),
+        collector.failed,
+        collector.complete(collected),
+        regions,
+        all_regions
+    )
+    return Inventory(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="snapshot the aws account into an inventory file")
+    parser.add_argument('path', nargs='?', default='inventory.db')
+    parser.add_argument('--all-regions', action='store_true', help="every enabled region, not just the default one")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    inventory = take_snapshot(args.path, all_regions=args.all_regions, on_progress=print)
+    print(f"wrote {args.path} in {time.perf_counter() - start:.1f}s")
+    print(inventory.summary())
+
+
+if __name__ == "__main__":
+    main()
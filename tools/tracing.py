@@ -0,0 +1,203 @@
+import contextlib
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+
+
+# error codes aws uses when it slows a caller down
+THROTTLING_CODES = {
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+    'TooManyRequestsException', 'ProvisionedThroughputExceededException', 'RequestLimitExceeded',
+    'SlowDown', 'RequestThrottled', 'BandwidthLimitExceeded', 'EC2ThrottledException'
+}
+
+_current = contextvars.ContextVar('chatbot_span', default=None)
+
+
+class Span:
+    """one timed piece of work, nested under whatever span was open when it started"""
+
+    __slots__ = ('id', 'trace', 'parent', 'kind', 'name', 'attrs', 'started_at', 'start', 'seconds', 'error')
+
+    def __init__(self, span_id, trace, parent, kind, name, attrs):
+        self.id = span_id
+        self.trace = trace
+        self.parent = parent
+        self.kind = kind
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, key, amount=1):
+        self.attrs[key] = self.attrs.get(key, 0) + amount
+
+    def record(self):
+        record = {
+            'trace': self.trace,
+            'id': self.id,
+            'parent': self.parent,
+            'kind': self.kind,
+            'name': self.name,
+            'start': round(self.started_at, 6),
+            'seconds': round(self.seconds or 0.0, 6)
+        }
+        if self.error:
+            record['error'] = self.error
+        record.update(self.attrs)
+        return record
+
+
+class Tracer:
+    """spans for questions, llm calls, tools and aws calls
+
+    every finished span is added to running totals (count, time, errors,
+    retries, throttles, tokens) for the stats command, and written as one
+    json line when a path is given. the current span lives in a contextvar
+    so spans nest across awaits and asyncio.to_thread. aws calls made from
+    plain thread pools still get their own spans, just without a parent.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.totals = {}
+        self.counters = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._file = None
+        if path:
+            self._file = open(path, 'a', buffering=1)
+
+    def start(self, kind, name, **attrs):
+        parent = _current.get()
+        span_id = next(self._ids)
+        trace = parent.trace if parent is not None else span_id
+        return Span(span_id, trace, parent.id if parent is not None else None, kind, name, attrs)
+
+    def finish(self, span, error=None):
+        span.seconds = time.perf_counter() - span.start
+        if error is not None:
+            span.error = error if isinstance(error, str) else f"{type(error).__name__}: {error}"
+
+        key = (span.kind, span.name)
+        with self._lock:
+            count, seconds, worst, errors = self.totals.get(key, (0, 0.0, 0.0, 0))
+            self.totals[key] = (
+                count + 1,
+                seconds + span.seconds,
+                max(worst, span.seconds),
+                errors + (1 if span.error else 0)
+            )
+            for counter in ('retries', 'throttles', 'input_tokens', 'output_tokens', 'cache_read_tokens', 'cache_write_tokens'):
+                if span.attrs.get(counter):
+                    self.counters[counter] = self.counters.get(counter, 0) + span.attrs[counter]
+            if self._file is not None:
+                self._file.write(json.dumps(span.record(), default=str) + "\n")
+
+    @contextlib.contextmanager
+    def span(self, kind, name, **attrs):
+        """times the block, spans started inside it are its children"""
+        span = self.start(kind, name, **attrs)
+        token = _current.set(span)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current.reset(token)
+            self.finish(span, error)
+
+    def install(self, clients):
+        """times every aws call made by the factory's clients, with retries and throttling"""
+        clients.register('before-call', self._before_call)
+        clients.register('needs-retry', self._needs_retry)
+        clients.register('after-call', self._after_call)
+        clients.register('after-call-error', self._after_call_error)
+
+    def _before_call(self, model=None, context=None, **kwargs):
+        if context is None:
+            return
+        service = model.service_model.service_name
+        context['chatbot_span'] = self.start('aws', f"{service}.{model.name}")
+
+    def _needs_retry(self, response=None, request_dict=None, attempts=None, **kwargs):
+        # only looks, returning None leaves the retry decision to botocore
+        if request_dict is None or response is None:
+            return None
+        span = request_dict.get('context', {}).get('chatbot_span')
+        if span is None:
+            return None
+        code = response[1].get('Error', {}).get('Code')
+        if code in THROTTLING_CODES:
+            span.add('throttles')
+        return None
+
+    def _after_call(self, http_response=None, parsed=None, context=None, **kwargs):
+        span = (context or {}).pop('chatbot_span', None)
+        if span is None:
+            return
+        metadata = (parsed or {}).get('ResponseMetadata', {})
+        span.set(
+            status=metadata.get('HTTPStatusCode'),
+            retries=metadata.get('RetryAttempts', 0)
+        )
+        error = (parsed or {}).get('Error', {}).get('Code')
+        self.finish(span, error)
+
+    def _after_call_error(self, exception=None, context=None, **kwargs):
+        span = (context or {}).pop('chatbot_span', None)
+        if span is not None:
+            self.finish(span, exception)
+
+    def summary(self):
+        """totals in prometheus text format, slowest kinds first"""
+        with self._lock:
+            totals = dict(self.totals)
+            counters = dict(self.counters)
+
+        if len(totals) == 0:
+            return "no spans recorded yet"
+
+        lines = []
+        for (kind, name), (count, seconds, worst, errors) in sorted(totals.items(), key=lambda item: -item[1][1]):
+            labels = f'kind="{kind}",name="{name}"'
+            lines.append(f"chatbot_span_count{{{labels}}} {count}")
+            lines.append(f"chatbot_span_seconds_total{{{labels}}} {seconds:.4f}")
+            lines.append(f"chatbot_span_seconds_max{{{labels}}} {worst:.4f}")
+            if errors:
+                lines.append(f"chatbot_span_errors_total{{{labels}}} {errors}")
+
+        lines.append(f"chatbot_aws_retries_total {counters.get('retries', 0)}")
+        lines.append(f"chatbot_aws_throttles_total {counters.get('throttles', 0)}")
+        for kind in ('input', 'output', 'cache_read', 'cache_write'):
+            lines.append(f'chatbot_llm_tokens_total{{type="{kind}"}} {counters.get(kind + "_tokens", 0)}')
+        return "\n".join(lines)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+_default_tracer = None
+_default_lock = threading.Lock()
+
+
+def get_tracer():
+    """the process wide tracer, CHATBOT_TRACE_FILE=path also writes every span as json lines"""
+    global _default_tracer
+
+    with _default_lock:
+        if _default_tracer is None:
+            _default_tracer = Tracer(os.getenv('CHATBOT_TRACE_FILE') or None)
+        return _default_tracer
@@ -0,0 +1,153 @@
+import threading
+import time
+
+from tools.aws_clients import get_clients
+from tools.cache import get_cache
+from tools.ec2_index import get_index as get_instance_index
+from tools.iam_policy import PolicyFetcher
+from tools.iam_snapshot import get_snapshot_store
+from tools.regions import enabled_regions
+from tools.s3_tool import S3Tool
+from tools.sg_index import get_index as get_group_index
+
+
+class Warmup:
+    """fills the caches in the background so the first question is fast
+
+    every step runs on its own daemon thread, so quitting never waits for
+    a slow aws call. cancel() stops steps between calls, a call already
+    on the wire is left to finish on its own.
+    """
+
+    def __init__(self, tools=None, cache=None, clients=None, on_progress=None, workers=8):
+        self.cache = cache
+        self.clients = clients
+        self.on_progress = on_progress
+        self.workers = workers
+        self.s3_tool = None
+        for tool in tools or []:
+            if isinstance(tool, S3Tool):
+                self.s3_tool = tool
+        self.steps = {}
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    def _regions(self):
+        regions = enabled_regions(self.cache, self.clients)
+        return f"{len(regions)} regions"
+
+    def _buckets(self):
+        tool = self.s3_tool or S3Tool(cache=self.cache, clients=self.clients)
+        cache = self.cache or get_cache()
+        clients = self.clients or get_clients()
+        s3 = clients.client('s3')
+        cloudwatch = None
+        if tool.use_cloudwatch:
+            cloudwatch = clients.client('cloudwatch')
+
+        names = [b['Name'] for b in cache.call('s3', s3, 'list_buckets')['Buckets']]
+        # the same per bucket entries the tool reads for "which are public"
+        done = self._each(names, lambda name: tool._inspect_cached(s3, cloudwatch, name))
+        return f"{done} of {len(names)} buckets"
+
+    def _instances(self):
+        index = get_instance_index(None, self.clients)
+        index.ensure()
+        return f"{len(index.by_id)} instances"
+
+    def _security_groups(self):
+        index = get_group_index(None, self.clients, self.cache)
+        index.ensure()
+        return f"{len(index.groups)} groups, {len(index.rules)} rules"
+
+    def _iam(self):
+        store = get_snapshot_store()
+        if store is not None:
+            return store.get().summary()
+        cache = self.cache or get_cache()
+        clients = self.clients or get_clients()
+        iam = clients.client('iam')
+        # bindings are per user and only a few calls, the managed policy
+        # documents behind them are shared and what the tool waits on
+        fetcher = PolicyFetcher(iam, cache)
+        arns = [p['Arn'] for p in cache.call_paginated('iam', iam, 'list_policies', 'Policies', OnlyAttached=True)]
+        done = self._each(arns, fetcher.document)
+        return f"{done} of {len(arns)} attached policies"
+
+    def _each(self, items, fn):
+        """fn(item) for every item on a few daemon threads, stops on cancel"""
+        pending = list(items)
+        done = [0]
+        lock = threading.Lock()
+
+        def worker():
+            while not self._cancelled.is_set():
+                with lock:
+                    if len(pending) == 0:
+                        return
+                    item = pending.pop(0)
+                try:
+                    fn(item)
+                    with lock:
+                        done[0] = done[0] + 1
+                except Exception:
+                    pass
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(min(self.workers, len(pending)))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return done[0]
+
+    def _run_step(self, name, fn):
+        start = time.perf_counter()
+        try:
+            result = fn()
+            state = "cancelled" if self._cancelled.is_set() else "done"
+        except Exception as e:
+            result = str(e)
+            state = "failed"
+
+        with self._lock:
+            self.steps[name] = (state, result, time.perf_counter() - start)
+            finished = len([s for s in self.steps.values() if s[0] != "running"])
+            total = len(self.steps)
+
+        if self.on_progress is not None:
+            self.on_progress(f"warm-up {finished}/{total}: {name} {state} ({result}, {time.perf_counter() - start:.1f}s)")
+
+    def start(self):
+        steps = [
+            ('regions', self._regions),
+            ('buckets', self._buckets),
+            ('instances', self._instances),
+            ('security groups', self._security_groups),
+            ('iam', self._iam)
+        ]
+        with self._lock:
+            for name, fn in steps:
+                self.steps[name] = ("running", "", 0.0)
+        for name, fn in steps:
+            threading.Thread(target=self._run_step, args=(name, fn), daemon=True).start()
+        return self
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_done(self):
+        with self._lock:
+            return all(state != "running" for state, result, seconds in self.steps.values())
+
+    def status(self):
+        with self._lock:
+            steps = dict(self.steps)
+        if len(steps) == 0:
+            return "warm-up not started"
+        lines = []
+        for name, (state, result, seconds) in steps.items():
+            if state == "running":
+                lines.append(f"- {name}: running")
+            else:
+                lines.append(f"- {name}: {state}, {result} ({seconds:.1f}s)")
+        return "warm-up:\n" + "\n".join(lines)